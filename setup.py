@@ -35,6 +35,7 @@ setuptools.setup(
     keywords=["mender", "OTA", "updater"],
     packages=setuptools.find_packages(where="src"),
     install_requires=["cryptography", "requests"],
+    extras_require={"http2": ["httpx[http2]"], "zstd": ["zstandard"]},
     entry_points={"console_scripts": ["mender-python-client=mender.mender:main"]},
     package_dir={"": "src"},
     python_requires=">=3.6",
@@ -0,0 +1,478 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Streaming reader for Mender Artifacts (format version 3)
+
+An Artifact is an uncompressed tar archive with the members::
+
+  version
+  manifest
+  manifest.sig                 (optional)
+  header.tar[.gz|.xz|.zst]
+  data/0000.tar[.gz|.xz|.zst]
+  ...
+
+The Artifact is read front to back in a single pass, without seeking, so that
+it can be read straight from the HTTP response of the download. The checksums
+in the manifest are verified as the members, and the payload files, are read,
+and the Artifact is only valid once all the payload files in the manifest have
+been read. Corrupt, or truncated, Artifacts raise ArtifactError.
+"""
+import contextlib
+import hashlib
+import io
+import json
+import logging as log
+import os.path
+import re
+import tarfile
+import time
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Set
+
+import mender.artifact.compression as compression
+
+BUFFER_SIZE = 1024 * 1024
+TAR_BLOCK_SIZE = tarfile.RECORDSIZE
+
+SUPPORTED_VERSIONS = (3,)
+
+_HEADER_RE = re.compile(r"^header\.tar(\.[a-z0-9]+)?$")
+_DATA_RE = re.compile(r"^data/(\d{4})\.tar(\.[a-z0-9]+)?$")
+
+
+class ArtifactError(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def _corrupt(name: str) -> Iterator[None]:
+    """Raise ArtifactError for the corrupt, or truncated, data of 'name'"""
+    try:
+        yield
+    except (tarfile.TarError, compression.CompressionError, ValueError) as e:
+        # ValueError covers the JSON, and the text, which does not decode
+        raise ArtifactError(f"Corrupt {name}: {e}") from e
+
+
+def _json_object(name: str, data: bytes) -> dict:
+    with _corrupt(name):
+        obj = json.loads(data)
+    if not isinstance(obj, dict):
+        raise ArtifactError(f"Corrupt {name}: not a JSON object")
+    return obj
+
+
+class Header:
+    """The metadata of an Artifact, as read from its leading members"""
+
+    def __init__(self):
+        self.version: Optional[dict] = None
+        self.manifest: Dict[str, str] = {}
+        self.manifest_raw = b""
+        self.signature: Optional[bytes] = None
+        self.info: dict = {}
+        self.type_info: List[dict] = []
+        self.meta_data: List[dict] = []
+        self.compression = ""
+
+    @property
+    def artifact_name(self) -> str:
+        return self.info.get("artifact_provides", {}).get("artifact_name", "")
+
+    @property
+    def provides(self) -> Dict[str, str]:
+        provides = dict(self.info.get("artifact_provides", {}))
+        for type_info in self.type_info:
+            provides.update(type_info.get("artifact_provides") or {})
+        return provides
+
+    @property
+    def depends(self) -> Dict[str, List[str]]:
+        depends = {}
+        for k, v in self.info.get("artifact_depends", {}).items():
+            depends[k] = v if isinstance(v, list) else [v]
+        for type_info in self.type_info:
+            for k, v in (type_info.get("artifact_depends") or {}).items():
+                depends[k] = v if isinstance(v, list) else [v]
+        return depends
+
+    @property
+    def device_types(self) -> List[str]:
+        return self.depends.get("device_type", [])
+
+    def payload_type(self, index: int) -> str:
+        payloads = self.info.get("payloads", [])
+        if index < len(payloads):
+            return payloads[index].get("type") or ""
+        return ""
+
+
+def parse_manifest(raw: bytes) -> Dict[str, str]:
+    """Parse the '<sha256>  <name>' lines of a manifest into {name: sha256}"""
+    manifest = {}
+    with _corrupt("manifest"):
+        text = raw.decode()
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        parts = line.split()
+        if len(parts) != 2 or len(parts[0]) != 64:
+            raise ArtifactError(f"Malformed manifest line: {line}")
+        manifest[parts[1]] = parts[0]
+    return manifest
+
+
+def check_compatibility(header: Header, provides: Dict[str, str]) -> None:
+    """Verify that the device, described by 'provides', satisfies the Artifact
+
+    Raises ArtifactError describing the first unsatisfied dependency.
+    """
+    for key, accepted in sorted(header.depends.items()):
+        if key not in provides:
+            raise ArtifactError(
+                f"The Artifact depends on {key}, which the device does not provide"
+            )
+        if provides[key] not in accepted:
+            raise ArtifactError(
+                f"The Artifact depends on {key} being one of {accepted}, "
+                f"but the device has: {provides[key]}"
+            )
+
+
+class HashingReader(io.RawIOBase):
+    """A file-object which computes the sha256 of all the data read through it"""
+
+    def __init__(self, fileobj: BinaryIO):
+        super().__init__()
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        with _corrupt("Artifact"):
+            data = self.fileobj.read(size)
+        if data:
+            self.sha256.update(data)
+            self.bytes_read += len(data)
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[: len(data)] = data
+        return len(data)
+
+    def drain(self) -> None:
+        while self.read(BUFFER_SIZE):
+            pass
+
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+
+def verify_checksum(name: str, actual: str, manifest: Dict[str, str]) -> None:
+    expected = manifest.get(name)
+    if expected is None:
+        raise ArtifactError(f"{name} is not listed in the manifest")
+    if expected != actual:
+        raise ArtifactError(
+            f"Checksum mismatch for {name}: expected {expected}, got {actual}"
+        )
+
+
+class PayloadFile:
+    """A file in a payload, read from the Artifact stream
+
+    The file must be read before the next one is requested from the reader,
+    as the Artifact is read in a single pass.
+    """
+
+    def __init__(self, index: int, name: str, size: int, fileobj: BinaryIO):
+        self.index = index
+        self.name = name
+        self.size = size
+        self.reader = HashingReader(fileobj)
+
+    @property
+    def manifest_name(self) -> str:
+        return f"data/{self.index:04d}/{self.name}"
+
+    def read(self, size: int = -1) -> bytes:
+        return self.reader.read(size)
+
+    def hexdigest(self) -> str:
+        return self.reader.hexdigest()
+
+
+class Reader:
+    """Read an Artifact from 'fileobj' in a single pass
+
+    Usage::
+
+      reader = Reader(response.raw)
+      header = reader.read_header()
+      for payload_file in reader.payload_files():
+          while True:
+              data = payload_file.read(BUFFER_SIZE)
+              ...
+
+    'verify' is called with the manifest, and its signature, before anything
+    else is read from the Artifact, and raises ArtifactError if the signature
+    is invalid. With 'verify', an unsigned Artifact is rejected.
+    """
+
+    def __init__(
+        self,
+        fileobj: BinaryIO,
+        bufsize: int = BUFFER_SIZE,
+        verify: Optional[Callable[[bytes, bytes], None]] = None,
+    ):
+        self.bufsize = bufsize
+        self.verify = verify
+        try:
+            self.tar = tarfile.open(fileobj=fileobj, mode="r|", bufsize=bufsize)
+        except tarfile.TarError as e:
+            raise ArtifactError(f"Not an Artifact: {e}") from e
+        self.header: Optional[Header] = None
+        self._next: Optional[tarfile.TarInfo] = None
+
+    def _members(self) -> Iterator[tarfile.TarInfo]:
+        while True:
+            if self._next is not None:
+                member, self._next = self._next, None
+            else:
+                try:
+                    member = self.tar.next()
+                except tarfile.TarError as e:
+                    raise ArtifactError(f"Corrupt Artifact: {e}") from e
+            if member is None:
+                return
+            yield member
+
+    def _read_member(self, member: tarfile.TarInfo) -> bytes:
+        fileobj = self.tar.extractfile(member)
+        if fileobj is None:
+            raise ArtifactError(f"{member.name} is not a regular file")
+        with _corrupt(member.name):
+            return fileobj.read()
+
+    def read_header(self) -> Header:
+        """Read, and verify, the members preceding the payloads"""
+        header = Header()
+        version_raw = b""
+        for member in self._members():
+            if member.name == "version":
+                version_raw = self._read_member(member)
+                header.version = _json_object("version", version_raw)
+                if header.version.get("format") != "mender" or header.version.get(
+                    "version"
+                ) not in SUPPORTED_VERSIONS:
+                    raise ArtifactError(
+                        f"Unsupported Artifact version: {header.version}"
+                    )
+            elif member.name == "manifest":
+                header.manifest_raw = self._read_member(member)
+                header.manifest = parse_manifest(header.manifest_raw)
+            elif member.name == "manifest.sig":
+                header.signature = self._read_member(member)
+            elif _HEADER_RE.match(member.name):
+                if not header.manifest:
+                    raise ArtifactError("The manifest must precede the header")
+                if self.verify is not None:
+                    if header.signature is None:
+                        raise ArtifactError("The Artifact is not signed")
+                    self.verify(header.manifest_raw, header.signature)
+                header.compression = _HEADER_RE.match(member.name).group(1) or ""
+                fileobj = self.tar.extractfile(member)
+                hashing = HashingReader(fileobj)
+                self._read_header_tar(hashing, header)
+                hashing.drain()
+                verify_checksum(member.name, hashing.hexdigest(), header.manifest)
+                verify_checksum(
+                    "version", hashlib.sha256(version_raw).hexdigest(), header.manifest
+                )
+                self.header = header
+                return header
+            elif member.name.startswith("manifest-augment") or member.name.startswith(
+                "header-augment"
+            ):
+                raise ArtifactError("Augmented Artifacts are not supported")
+            else:
+                raise ArtifactError(f"Unexpected Artifact member: {member.name}")
+        raise ArtifactError("The Artifact has no header")
+
+    def _open_tar(self, fileobj: BinaryIO, suffix: str) -> tarfile.TarFile:
+        """Open the tar in 'fileobj', decompressing it on the fly"""
+        with _corrupt("Artifact"):
+            try:
+                stream = compression.open_stream(fileobj, expected=suffix)
+            except compression.CompressionError as e:
+                raise ArtifactError(str(e)) from e
+            return tarfile.open(fileobj=stream, mode="r|", bufsize=self.bufsize)
+
+    def _read_header_tar(self, fileobj: BinaryIO, header: Header) -> None:
+        with self._open_tar(fileobj, header.compression) as tar, _corrupt("header"):
+            for member in tar:
+                f = tar.extractfile(member)
+                if f is None:
+                    continue
+                data = f.read()
+                m = re.match(r"^headers/(\d{4})/(type-info|meta-data)$", member.name)
+                if member.name == "header-info":
+                    header.info = _json_object(member.name, data)
+                elif m:
+                    index = int(m.group(1))
+                    target = (
+                        header.type_info
+                        if m.group(2) == "type-info"
+                        else header.meta_data
+                    )
+                    while len(target) <= index:
+                        target.append({})
+                    target[index] = (
+                        _json_object(member.name, data) if data.strip() else {}
+                    )
+                else:
+                    log.debug(f"Ignoring the header member: {member.name}")
+
+    def payload_files(self) -> Iterator[PayloadFile]:
+        """Yield the files in all the payloads, verifying them as they are read
+
+        Raises ArtifactError, once the end of the Artifact is reached, unless
+        all the payloads in the header, and all their files in the manifest,
+        were read.
+        """
+        if self.header is None:
+            self.read_header()
+        payloads: Set[int] = set()
+        verified: Set[str] = set()
+        for member in self._members():
+            m = _DATA_RE.match(member.name)
+            if not m:
+                raise ArtifactError(f"Unexpected Artifact member: {member.name}")
+            index = int(m.group(1))
+            payloads.add(index)
+            fileobj = self.tar.extractfile(member)
+            with self._open_tar(fileobj, m.group(2) or "") as tar:
+                for file_member in self._payload_members(tar, member.name):
+                    f = tar.extractfile(file_member)
+                    if f is None:
+                        continue
+                    payload_file = PayloadFile(
+                        index, os.path.basename(file_member.name), file_member.size, f
+                    )
+                    yield payload_file
+                    # Verify the file, even if the consumer did not read all of it
+                    payload_file.reader.drain()
+                    verify_checksum(
+                        payload_file.manifest_name,
+                        payload_file.hexdigest(),
+                        self.header.manifest,
+                    )
+                    verified.add(payload_file.manifest_name)
+        expected = len(self.header.info.get("payloads") or [])
+        if payloads != set(range(expected)):
+            raise ArtifactError(
+                f"The Artifact has the payloads {sorted(payloads)}, "
+                f"but its header lists {expected}"
+            )
+        missing = sorted(
+            name
+            for name in self.header.manifest
+            if name.startswith("data/") and name not in verified
+        )
+        if missing:
+            raise ArtifactError(
+                f"The Artifact is missing the payload files: {', '.join(missing)}"
+            )
+
+    @staticmethod
+    def _payload_members(tar: tarfile.TarFile, name: str) -> Iterator[tarfile.TarInfo]:
+        while True:
+            with _corrupt(name):
+                member = tar.next()
+            if member is None:
+                return
+            yield member
+
+
+#
+# Writer, for the tests and the benchmarks
+#
+
+
+def _tar_add(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _compressed_tar(members: Dict[str, bytes], suffix: str) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w|") as tar:
+        for name, data in members.items():
+            _tar_add(tar, name, data)
+    return compression.compress(buf.getvalue(), suffix)
+
+
+def write(
+    fileobj: BinaryIO,
+    artifact_name: str,
+    device_types: List[str],
+    files: Dict[str, bytes],
+    payload_type: str = "rootfs-image",
+    compression: str = ".gz",
+    provides: Optional[Dict[str, str]] = None,
+    depends: Optional[Dict[str, List[str]]] = None,
+    sign=None,
+) -> None:
+    """Write a single payload version 3 Artifact to 'fileobj'
+
+    :param sign: optional function returning the signature of the manifest
+    """
+    version = json.dumps({"format": "mender", "version": 3}).encode()
+    header_info = {
+        "payloads": [{"type": payload_type}],
+        "artifact_provides": {"artifact_name": artifact_name},
+        "artifact_depends": {"device_type": device_types},
+    }
+    type_info = {
+        "type": payload_type,
+        "artifact_provides": provides or {},
+        "artifact_depends": depends or {},
+    }
+    header = _compressed_tar(
+        {
+            "header-info": json.dumps(header_info).encode(),
+            "headers/0000/type-info": json.dumps(type_info).encode(),
+        },
+        compression,
+    )
+    data = _compressed_tar(files, compression)
+    header_name = "header.tar" + compression
+    checksums = {"version": version, header_name: header}
+    checksums.update({f"data/0000/{name}": content for name, content in files.items()})
+    manifest = "".join(
+        f"{hashlib.sha256(content).hexdigest()}  {name}\n"
+        for name, content in sorted(checksums.items())
+    ).encode()
+    with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+        _tar_add(tar, "version", version)
+        _tar_add(tar, "manifest", manifest)
+        if sign:
+            _tar_add(tar, "manifest.sig", sign(manifest))
+        _tar_add(tar, header_name, header)
+        _tar_add(tar, "data/0000.tar" + compression, data)
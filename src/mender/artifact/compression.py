@@ -0,0 +1,201 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Streaming decompression of the Artifact headers, and payloads
+
+The compression is detected from the leading magic bytes of the stream, rather
+than trusted from the file name suffix. The decompressors read, and return, the
+data in bounded chunks, so that the memory used does not depend on the size of
+the payload. zstd requires the optional 'zstandard' package.
+"""
+# pylint: disable=import-outside-toplevel
+import io
+import logging as log
+from typing import BinaryIO, Optional
+
+NONE = ""
+GZIP = ".gz"
+XZ = ".xz"
+BZIP2 = ".bz2"
+ZSTD = ".zst"
+
+# The magic bytes at the start of the compressed streams
+MAGIC = (
+    (b"\x1f\x8b", GZIP),
+    (b"\xfd7zXZ\x00", XZ),
+    (b"BZh", BZIP2),
+    (b"\x28\xb5\x2f\xfd", ZSTD),
+)
+MAGIC_SIZE = max(len(magic) for magic, _ in MAGIC)
+
+# The size of the reads from the compressed stream
+READ_SIZE = 64 * 1024
+
+
+class CompressionError(Exception):
+    pass
+
+
+def detect(prefix: bytes) -> str:
+    """Return the compression of the stream starting with 'prefix'"""
+    for magic, compression in MAGIC:
+        if prefix.startswith(magic):
+            return compression
+    return NONE
+
+
+def available() -> tuple:
+    """Return the compressions which can be decompressed here"""
+    try:
+        import zstandard  # pylint: disable=unused-import
+    except ImportError:
+        return (NONE, GZIP, XZ, BZIP2)
+    return (NONE, GZIP, XZ, BZIP2, ZSTD)
+
+
+class _Prefixed(io.RawIOBase):
+    """Put the bytes already read from 'fileobj' back in front of it"""
+
+    def __init__(self, prefix: bytes, fileobj: BinaryIO):
+        self._prefix = prefix
+        self._fileobj = fileobj
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self._prefix:
+            n = min(len(b), len(self._prefix))
+            b[:n] = self._prefix[:n]
+            self._prefix = self._prefix[n:]
+            return n
+        data = self._fileobj.read(len(b))
+        b[: len(data)] = data
+        return len(data)
+
+
+def _peek(fileobj: BinaryIO, size: int):
+    """Return the first 'size' bytes of 'fileobj', and the stream to read from"""
+    if hasattr(fileobj, "peek"):
+        return fileobj.peek(size)[:size], fileobj  # type: ignore
+    prefix = b""
+    while len(prefix) < size:
+        data = fileobj.read(size - len(prefix))
+        if not data:
+            break
+        prefix += data
+    return prefix, io.BufferedReader(_Prefixed(prefix, fileobj), READ_SIZE)
+
+
+class _Checked(io.RawIOBase):
+    """Raise CompressionError for the corrupt, or truncated, data of 'fileobj'
+
+    'errors' are the exceptions the decompressor raises for such data.
+    """
+
+    def __init__(self, fileobj: BinaryIO, errors: tuple):
+        self._fileobj = fileobj
+        self._errors = errors
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            return self._fileobj.read(size)
+        except self._errors as e:
+            raise CompressionError(f"Corrupt compressed data: {e}") from e
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[: len(data)] = data
+        return len(data)
+
+
+def decompress(fileobj: BinaryIO, compression: str) -> BinaryIO:
+    """Return a file object reading the data of the compressed 'fileobj'
+
+    Reading corrupt, or truncated, data raises CompressionError.
+    """
+    if compression == NONE:
+        return fileobj
+    if compression == GZIP:
+        import gzip
+        import zlib
+
+        # gzip.BadGzipFile is new in Python 3.8, an OSError before
+        bad = getattr(gzip, "BadGzipFile", OSError)
+        return _Checked(  # type: ignore
+            gzip.GzipFile(fileobj=fileobj, mode="rb"), (EOFError, zlib.error, bad)
+        )
+    if compression == XZ:
+        import lzma
+
+        return _Checked(  # type: ignore
+            lzma.LZMAFile(fileobj), (EOFError, lzma.LZMAError)
+        )
+    if compression == BZIP2:
+        import bz2
+
+        return _Checked(bz2.BZ2File(fileobj), (EOFError, OSError))  # type: ignore
+    if compression == ZSTD:
+        try:
+            import zstandard
+        except ImportError as e:
+            raise CompressionError(
+                "zstd compression requires the 'zstandard' package"
+            ) from e
+        return _Checked(  # type: ignore
+            zstandard.ZstdDecompressor().stream_reader(fileobj, read_size=READ_SIZE),
+            (zstandard.ZstdError,),
+        )
+    raise CompressionError(f"Unsupported compression: {compression}")
+
+
+def open_stream(fileobj: BinaryIO, expected: Optional[str] = None) -> BinaryIO:
+    """Detect the compression of 'fileobj', and return its decompressed data
+
+    :param expected: the compression given by the file name, which only serves
+                     to point out a mismatch
+    """
+    prefix, fileobj = _peek(fileobj, MAGIC_SIZE)
+    compression = detect(prefix)
+    if expected is not None and expected != compression:
+        log.warning(
+            f"The data is compressed with '{compression or 'none'}', "
+            f"and not '{expected or 'none'}' as its name says"
+        )
+    return decompress(fileobj, compression)
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    """Compress 'data' in one go, for the tests and the benchmarks"""
+    if compression == NONE:
+        return data
+    if compression == GZIP:
+        import gzip
+
+        return gzip.compress(data)
+    if compression == XZ:
+        import lzma
+
+        return lzma.compress(data)
+    if compression == BZIP2:
+        import bz2
+
+        return bz2.compress(data)
+    if compression == ZSTD:
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(data)
+    raise CompressionError(f"Unsupported compression: {compression}")
@@ -0,0 +1,193 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Content-addressed cache of downloaded Artifacts
+
+The Artifacts are stored under the sha256 of their manifest, which lists the
+checksums of everything else in the Artifact, and so identifies its content.
+A retried, or re-created, deployment of the same Artifact is then installed
+from the cache, instead of being downloaded again.
+
+The least recently used Artifacts are evicted to keep the cache within its
+size budget.
+"""
+import errno
+import hashlib
+import logging as log
+import os
+import os.path
+import shutil
+import time
+from typing import Dict, Optional
+
+import mender.artifact.artifact as artifact
+import mender.datastore.datastore as datastore
+
+INDEX_FILENAME = "index.json"
+
+
+def manifest_digest(header: artifact.Header) -> str:
+    return hashlib.sha256(header.manifest_raw).hexdigest()
+
+
+def verify(path: str, digest: str, verify_signature=None) -> bool:
+    """Read the whole Artifact at 'path', and verify it against 'digest'
+
+    Returns False for a corrupt, or truncated, Artifact, which the Reader
+    reports as ArtifactError.
+
+    :param verify_signature: verify the signature of the manifest as well, see
+                             artifact.Reader
+    """
+    try:
+        with open(path, "rb") as fh:
+            reader = artifact.Reader(fh, verify=verify_signature)
+            header = reader.read_header()
+            if manifest_digest(header) != digest:
+                log.error(f"The manifest of {path} does not match: {digest}")
+                return False
+            for _ in reader.payload_files():
+                pass
+    except (artifact.ArtifactError, OSError) as e:
+        log.error(f"Failed to verify the Artifact {path}: {e}")
+        return False
+    return True
+
+
+def link(src: str, dst: str) -> None:
+    """Hardlink 'src' to 'dst', or copy it if they are on different filesystems"""
+    datastore.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copyfile(src, dst)
+
+
+class ArtifactCache:
+    """An LRU cache of Artifacts in 'directory', of at most 'max_size' bytes
+
+    Usage::
+
+      cache = ArtifactCache(settings.PATHS.artifact_cache, 512 * 1024 * 1024)
+      if not cache.get(artifact_name, digest, artifact_path):
+          download(artifact_path, digest=digest)
+          cache.add(artifact_name, digest, artifact_path, verified=True)
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.mender")
+
+    def _load(self) -> Dict[str, dict]:
+        return datastore.read_json(self.index_path) or {}
+
+    def _store(self, index: Dict[str, dict]) -> None:
+        datastore.write_json(self.index_path, index)
+
+    def get(self, artifact_name: str, digest: str, dst: str) -> bool:
+        """Place a verified copy of the Artifact at 'dst', if there is one cached"""
+        index = self._load()
+        entry = index.get(digest)
+        if not entry or entry.get("artifact_name") != artifact_name:
+            return False
+        path = self._path(digest)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = -1
+        if size != entry.get("size") or not verify(path, digest):
+            log.warning(f"Evicting the corrupt cached Artifact {artifact_name}")
+            datastore.remove(path)
+            del index[digest]
+            self._store(index)
+            return False
+        link(path, dst)
+        entry["last_used"] = time.time()
+        self._store(index)
+        log.info(f"Using the cached Artifact {artifact_name}")
+        return True
+
+    def lookup(self, digest: str) -> Optional[str]:
+        """Return the path of the cached Artifact with the manifest 'digest', if any
+
+        The Artifact is not verified, nor marked as used.
+        """
+        entry = self._load().get(digest)
+        if not entry:
+            return None
+        path = self._path(digest)
+        return path if os.path.isfile(path) else None
+
+    def add(
+        self, artifact_name: str, digest: str, src: str, verified: bool = False
+    ) -> bool:
+        """Verify the downloaded Artifact at 'src', and add it to the cache
+
+        :param verified: the Artifact was verified against 'digest' as it was
+                         downloaded, and is not read again
+        """
+        size = os.path.getsize(src)
+        if size > self.max_size:
+            log.info(
+                f"The Artifact {artifact_name} ({size} bytes) exceeds the cache size"
+            )
+            return False
+        if not verified and not verify(src, digest):
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+        index = self._load()
+        self._evict(index, self.max_size - size, keep=digest)
+        link(src, self._path(digest))
+        index[digest] = {
+            "artifact_name": artifact_name,
+            "size": size,
+            "last_used": time.time(),
+        }
+        self._store(index)
+        log.info(f"Cached the Artifact {artifact_name}")
+        return True
+
+    def _evict(self, index: Dict[str, dict], max_size: int, keep: str) -> None:
+        """Remove the least recently used Artifacts, until at most 'max_size' remain"""
+        index.pop(keep, None)
+        total = sum(entry.get("size", 0) for entry in index.values())
+        for digest, entry in sorted(
+            index.items(), key=lambda item: item[1].get("last_used", 0)
+        ):
+            if total <= max_size:
+                break
+            log.info(f"Evicting the cached Artifact {entry.get('artifact_name')}")
+            datastore.remove(self._path(digest))
+            del index[digest]
+            total -= entry.get("size", 0)
+
+    def size(self) -> int:
+        return sum(entry.get("size", 0) for entry in self._load().values())
+
+
+def configure(config, directory: str) -> Optional[ArtifactCache]:
+    """Return the Artifact cache given by the configuration, if enabled"""
+    try:
+        max_size = int(config.ArtifactCacheSizeMB) * 1024 * 1024
+    except (TypeError, ValueError):
+        log.error(f"Invalid ArtifactCacheSizeMB: {config.ArtifactCacheSizeMB}")
+        return None
+    if max_size <= 0:
+        return None
+    return ArtifactCache(directory, max_size)
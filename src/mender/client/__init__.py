@@ -11,7 +11,109 @@
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
+import contextlib
+import logging as log
+from typing import Iterator, Optional, Tuple
+
+import mender.client.servers as servers
+import mender.metrics.metrics as metrics
+import mender.tracing.tracing as tracing
+
+DEFAULT_POOL_SIZE = 10
+# The default (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (30.0, 60.0)
+
+_session = None
+_transport = "requests"
+_timeout = DEFAULT_TIMEOUT
 
 
 class HTTPUnathorized(Exception):
     pass
+
+
+def session():
+    """Return the transport shared by all the requests to the server
+
+    Sharing the transport keeps the connections to the server alive in between
+    requests, instead of doing a new TCP and TLS handshake for every request.
+    See mender.client.transport for the interface of the transports.
+    """
+    global _session  # pylint: disable=global-statement
+    if _session is None:
+        configure_session()
+    return _session
+
+
+def configure_session(
+    pool_size: int = DEFAULT_POOL_SIZE,
+    transport: Optional[str] = None,
+    timeout: Optional[Tuple[Optional[float], Optional[float]]] = None,
+):
+    """(Re-)create the shared transport, keeping up to 'pool_size' connections per host
+
+    :param transport: one of mender.client.transport.TRANSPORTS, or None to keep
+                      the current one
+    :param timeout: the (connect, read) timeouts of every request, in seconds,
+                    or None to keep the current ones
+    """
+    # pylint: disable=import-outside-toplevel
+    import mender.client.transport as client_transport
+
+    global _session, _transport, _timeout  # pylint: disable=global-statement
+    _transport = transport or _transport
+    _timeout = timeout or _timeout
+    _session = client_transport.create(_transport, pool_size, _timeout)
+    return _session
+
+
+def _seconds(value) -> Optional[float]:
+    """A timeout in seconds from the configuration, where 0 disables it"""
+    try:
+        return float(value) or None
+    except (TypeError, ValueError):
+        log.error(f"Invalid timeout: {value}. Not using a timeout")
+        return None
+
+
+def configure(config) -> None:
+    """Select the transport, the timeouts, and the servers, from the configuration"""
+    servers.configure(config)
+    timeout = (
+        _seconds(config.ConnectTimeoutSeconds),
+        _seconds(config.ReadTimeoutSeconds),
+    )
+    if config.HTTPTransport != _transport or timeout != _timeout or _session is None:
+        configure_session(transport=config.HTTPTransport, timeout=timeout)
+
+
+@contextlib.contextmanager
+def observe_request(
+    endpoint: str, method: str, server: Optional[str] = None
+) -> Iterator[tracing.Span]:
+    """Trace, and record the latency of, a request to the Mender server
+
+    The caller sets the 'status_code' attribute on the yielded span once the
+    response is received. A request raising an exception is recorded as an
+    error. The latency, and the outcome, of a request to the 'server' URL are
+    recorded for choosing among the servers, see mender.client.servers.
+    """
+    with tracing.span(
+        f"{method} {endpoint}",
+        kind=tracing.KIND_CLIENT,
+        endpoint=endpoint,
+        method=method,
+    ) as span:
+        try:
+            yield span
+        except Exception:
+            metrics.HTTP_REQUESTS.inc(endpoint=endpoint, code="error")
+            servers.record(server, span.duration, False)
+            raise
+        finally:
+            metrics.HTTP_REQUEST_DURATION.observe(span.duration, endpoint=endpoint)
+        code = span.attributes.get("status_code")
+        metrics.HTTP_REQUESTS.inc(endpoint=endpoint, code=str(code))
+        servers.record(server, span.duration, code is not None and code < 500)
+        if code is None or code >= 400:
+            span.outcome = tracing.OUTCOME_ERROR
@@ -11,14 +11,18 @@
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
+import hashlib
 import json
 import logging as log
-from typing import Optional
+from typing import Optional, Tuple
 import requests
 
 from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKeyWithSerialization
 
+import mender.datastore.datastore as datastore
+import mender.metrics.metrics as metrics
 import mender.security.key as key
+from mender.client import observe_request, session
 
 JWTToken = str
 
@@ -29,8 +33,58 @@ def request(
     id_data: dict,
     private_key: RSAPrivateKeyWithSerialization,
     server_certificate: str,
+    cache_path: Optional[str] = None,
 ) -> Optional[JWTToken]:
-    return authorize(server_url, id_data, tenant_token, private_key, server_certificate)
+    return authorize(
+        server_url,
+        id_data,
+        tenant_token,
+        private_key,
+        server_certificate,
+        cache_path=cache_path,
+    )
+
+
+def signed_request(
+    id_data: dict,
+    tenant_token: str,
+    private_key: RSAPrivateKeyWithSerialization,
+    cache_path: Optional[str] = None,
+) -> Tuple[str, str]:
+    """Return the body of the auth request, and its signature
+
+    The body, with the public key PEM, and the signature are stored in
+    'cache_path', under a hash of the identity data, the tenant token, and the
+    public key, and reused for as long as these do not change.
+    """
+    id_data_json = json.dumps(id_data)
+    numbers = private_key.public_key().public_numbers()
+    inputs = hashlib.sha256(
+        json.dumps([id_data_json, tenant_token, numbers.n, numbers.e]).encode()
+    ).hexdigest()
+    if cache_path:
+        cached = datastore.read_json(cache_path)
+        if isinstance(cached, dict) and cached.get("inputs") == inputs:
+            body, signature = cached.get("body"), cached.get("signature")
+            if isinstance(body, str) and isinstance(signature, str):
+                log.debug("Using the cached signed auth request")
+                return body, signature
+    body = json.dumps(
+        {
+            "id_data": id_data_json,
+            "pubkey": key.public_key(private_key),
+            "tenant_token": tenant_token,
+        }
+    )
+    signature = key.sign(private_key, body)
+    if cache_path:
+        try:
+            datastore.write_json(
+                cache_path, {"inputs": inputs, "body": body, "signature": signature}
+            )
+        except OSError as e:
+            log.warning(f"Failed to cache the signed auth request: {e}")
+    return body, signature
 
 
 def authorize(
@@ -39,7 +93,13 @@ def authorize(
     tenant_token: str,
     private_key: RSAPrivateKeyWithSerialization,
     server_certificate: str,
+    cache_path: Optional[str] = None,
 ) -> Optional[JWTToken]:
+    """Request a JWT from the server
+
+    :param cache_path: where to keep the signed request body, see
+                       signed_request()
+    """
     if not server_url:
         log.error("ServerURL not provided, unable to authorize")
         return None
@@ -50,14 +110,13 @@ def authorize(
         log.error("No private key provided, unable to authorize")
         return None
 
-    id_data_json = json.dumps(id_data)
-    public_key = key.public_key(private_key)
-    body = {"id_data": id_data_json, "pubkey": public_key, "tenant_token": tenant_token}
-    raw_data = json.dumps(body)
+    raw_data, signature = signed_request(
+        id_data, tenant_token, private_key, cache_path
+    )
     headers = {
         "Content-Type": "application/json",
         "Accept": "application/json",
-        "X-MEN-Signature": key.sign(private_key, raw_data),
+        "X-MEN-Signature": signature,
         "Authorization": "API_KEY",
     }
     try:
@@ -65,12 +124,15 @@ def authorize(
             log.info(
                 f"Trying to authorize with the server-certificate: {server_certificate}"
             )
-        r = requests.post(
-            server_url + "/api/devices/v1/authentication/auth_requests",
-            data=raw_data,
-            headers=headers,
-            verify=server_certificate if server_certificate else True,
-        )
+        metrics.HTTP_BYTES_SENT.inc(len(raw_data), endpoint="auth_requests")
+        with observe_request("auth_requests", "POST", server_url) as span:
+            r = session().post(
+                server_url + "/api/devices/v1/authentication/auth_requests",
+                data=raw_data,
+                headers=headers,
+                verify=server_certificate if server_certificate else True,
+            )
+            span.set(status_code=r.status_code)
     except (
         requests.RequestException,
         requests.ConnectionError,
@@ -89,3 +151,28 @@ def authorize(
     log.error(f"Error {r.reason}. code: {r.status_code}")
     log.error(f"json: {r.json()}")
     return None
+
+
+def probe(server_url: str, server_certificate: str) -> bool:
+    """Measure the latency of the server with a HEAD request to its auth endpoint
+
+    The request is recorded for choosing among the servers, as any other, and
+    costs the server no authorization. Returns True if the server answered.
+    """
+    try:
+        with observe_request("auth_probe", "HEAD", server_url) as span:
+            r = session().head(
+                server_url + "/api/devices/v1/authentication/auth_requests",
+                verify=server_certificate if server_certificate else True,
+            )
+            span.set(status_code=r.status_code)
+    except (
+        requests.RequestException,
+        requests.ConnectionError,
+        requests.URLRequired,
+        requests.TooManyRedirects,
+        requests.Timeout,
+    ) as e:
+        log.debug(f"Failed to probe the server {server_url}: {e}")
+        return False
+    return r.status_code < 500
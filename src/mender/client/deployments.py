@@ -11,19 +11,46 @@
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
+import contextlib
+import io
 import logging as log
-from typing import Optional
-import os.path
+import os
+import socket
+import threading
+import time
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
 import requests
+import urllib3
 
-import mender.settings.settings as settings
+import mender.artifact.artifact as artifact
+import mender.cache.cache as artifactcache
+import mender.installer.rootfs as rootfs
 import mender.log.log as menderlog
-from mender.client import HTTPUnathorized
+import mender.metrics.metrics as metrics
+import mender.outbox.outbox as outbox
+import mender.pipeline.pipeline as pipeline
+from mender.client import HTTPUnathorized, observe_request, session
 
 STATUS_SUCCESS = "success"
 STATUS_FAILURE = "failure"
 STATUS_DOWNLOADING = "downloading"
 
+# How often a download reports its progress, for it to be resumed from there
+PROGRESS_INTERVAL = 16 * 1024 * 1024
+
+# The first ranged request for the Artifact header fetches this much
+PREFLIGHT_CHUNK_SIZE = 16 * 1024
+
+# The bounds of the chunks in which the Artifact is downloaded
+MIN_CHUNK_SIZE = 4 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+# The default period over which the minimum download speed is enforced
+STALL_WINDOW = 60
+
+# Verifies the signature of the manifest, see artifact.Reader
+Verify = Callable[[bytes, bytes], None]
+
 
 class DeploymentInfo:
     """Class which holds all the information related to a deployment.
@@ -62,12 +89,24 @@ def request(
         return None
     headers = {"Content-Type": "application/json", "Authorization": "Bearer " + JWT}
     parameters = {**device_type, **artifact_name}
-    r = requests.get(
-        server_url + "/api/devices/v1/deployments/device/deployments/next",
-        headers=headers,
-        params=parameters,
-        verify=server_certificate if server_certificate else True,
-    )
+    try:
+        with observe_request("deployments_next", "GET", server_url) as span:
+            r = session().get(
+                server_url + "/api/devices/v1/deployments/device/deployments/next",
+                headers=headers,
+                params=parameters,
+                verify=server_certificate if server_certificate else True,
+            )
+            span.set(status_code=r.status_code)
+    except (
+        requests.RequestException,
+        requests.ConnectionError,
+        requests.URLRequired,
+        requests.TooManyRedirects,
+        requests.Timeout,
+    ) as e:
+        log.error(f"Failed to check for an update: {e}")
+        return None
     log.debug(f"update: request: {r}")
     deployment_info = None
     if r.status_code == 200:
@@ -86,27 +125,394 @@ def request(
     return deployment_info
 
 
+class _RangeReader(io.RawIOBase):
+    """Read the start of the Artifact at 'url' through ranged requests
+
+    Every request fetches twice as much as the previous one, so that reading
+    the leading members of the Artifact only takes a request or two. Servers
+    ignoring the Range header are read from the start, and cut off early.
+    """
+
+    def __init__(self, url: str, server_certificate: str, chunk_size: int):
+        super().__init__()
+        self.url = url
+        self.server_certificate = server_certificate
+        self.chunk_size = chunk_size
+        self.buffer = b""
+        self.offset = 0
+        self.size: Optional[int] = None
+        self.bytes_fetched = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while (size < 0 or len(self.buffer) < size) and (
+            self.size is None or self.offset < self.size
+        ):
+            self._fetch()
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def _fetch(self) -> None:
+        start, end = self.offset, self.offset + self.chunk_size - 1
+        self.chunk_size *= 2
+        with observe_request("artifact_header", "GET") as span, session().get(
+            self.url,
+            headers={"Range": f"bytes={start}-{end}"},
+            stream=True,
+            verify=self.server_certificate if self.server_certificate else True,
+        ) as response:
+            span.set(status_code=response.status_code)
+            if response.status_code == 206:
+                # Content-Range: bytes <start>-<end>/<size>
+                total = response.headers.get("Content-Range", "").rpartition("/")[2]
+                self.size = int(total) if total.isdigit() else None
+                data = response.raw.read(end - start + 1)
+            elif response.status_code == 200:
+                length = response.headers.get("Content-Length", "")
+                self.size = int(length) if length.isdigit() else None
+                data = response.raw.read(end + 1)[start:]
+            elif response.status_code == 416:
+                data = b""
+            else:
+                response.raise_for_status()
+                raise requests.HTTPError(
+                    f"Unexpected status {response.status_code}", response=response
+                )
+        self.bytes_fetched += len(data)
+        if not data:
+            self.size = self.offset
+        self.offset += len(data)
+        self.buffer += data
+
+
+def preflight(
+    deployment_data: DeploymentInfo,
+    server_certificate: str,
+    chunk_size: int = PREFLIGHT_CHUNK_SIZE,
+    verify: Optional[Verify] = None,
+) -> Optional[Tuple[artifact.Header, Optional[int]]]:
+    """Fetch only the leading version, manifest, and header members of the Artifact
+
+    Returns the verified header, and the size of the Artifact, if the server
+    told, or None if the header could not be fetched. Raises
+    artifact.ArtifactError if the header, or its signature, is invalid.
+    """
+    reader = _RangeReader(deployment_data.artifact_uri, server_certificate, chunk_size)
+    try:
+        header = artifact.Reader(
+            reader, bufsize=artifact.TAR_BLOCK_SIZE, verify=verify
+        ).read_header()
+    # _RangeReader reads response.raw directly, which raises the urllib3 errors
+    except (
+        requests.RequestException,
+        requests.ConnectionError,
+        requests.URLRequired,
+        requests.TooManyRedirects,
+        requests.Timeout,
+        urllib3.exceptions.HTTPError,
+    ) as e:
+        log.warning(f"Failed to fetch the Artifact header: {e}")
+        return None
+    log.info(
+        f"Fetched the header of the Artifact {header.artifact_name} "
+        f"in {reader.bytes_fetched} bytes"
+    )
+    return header, reader.size
+
+
+class DownloadStalled(Exception):
+    """The download progressed slower than the minimum speed"""
+
+    def __init__(self, downloaded: int):
+        super().__init__(f"The download stalled after {downloaded} bytes")
+        self.downloaded = downloaded
+
+
+def _abort(response) -> None:
+    """Shut the connection of 'response' down, failing any read blocked on it"""
+    # pylint: disable=protected-access
+    sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+    try:
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+            return
+    except OSError:
+        pass
+    response.close()
+
+
+class StallWatchdog:
+    """Abort a download receiving less than 'min_speed' bytes/s
+
+    The read timeout only fires when no bytes arrive at all, and the HTTP stack
+    returns the body in whole chunks, so a trickling download is noticed by
+    neither. The watchdog polls 'received' from a thread of its own, and shuts
+    the connection down if less than 'min_speed' * 'window' bytes arrive within
+    'window' seconds, plus the time it takes to fill one 'chunk_size' chunk at
+    the minimum speed. A 'min_speed' of 0 disables the watchdog.
+    """
+
+    def __init__(
+        self,
+        response,
+        received: Callable[[], int],
+        min_speed: float,
+        window: float,
+        chunk_size: int,
+    ):
+        self.response = response
+        self.received = received
+        self.quota = min_speed * window
+        self.deadline = window + (chunk_size / min_speed if min_speed else 0)
+        self.stalled = False
+        self._done = threading.Event()
+        self._suspended = threading.Event()
+
+    def __enter__(self) -> "StallWatchdog":
+        if self.quota > 0:
+            threading.Thread(
+                target=self._watch, name="stall-watchdog", daemon=True
+            ).start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._done.set()
+
+    @contextlib.contextmanager
+    def suspended(self) -> Iterator[None]:
+        """Do not count the time in the block, while the download is paused"""
+        self._suspended.set()
+        try:
+            yield
+        finally:
+            self._suspended.clear()
+
+    def _watch(self) -> None:
+        start, start_bytes = time.monotonic(), self.received()
+        while not self._done.wait(min(1.0, self.deadline / 4)):
+            now, received = time.monotonic(), self.received()
+            if self._suspended.is_set() or received - start_bytes >= self.quota:
+                start, start_bytes = now, received
+            elif now - start > self.deadline:
+                self.stalled = True
+                metrics.DOWNLOAD_STALLS.inc()
+                log.warning(
+                    f"The download stalled: {received - start_bytes} bytes "
+                    f"received in {now - start:.0f}s"
+                )
+                _abort(self.response)
+                return
+
+
+def watchdog_paused(
+    watchdog: StallWatchdog, pause: Optional[Callable[[], float]]
+) -> Optional[Callable[[], float]]:
+    """Wrap 'pause', for the time paused not to count as a stall"""
+    if pause is None:
+        return None
+
+    def paused() -> float:
+        with watchdog.suspended():
+            return pause()  # type: ignore
+
+    return paused
+
+
+def chunk_size(min_speed: float, window: float) -> int:
+    """The size of the chunks read, small enough for the watchdog to see progress"""
+    if not min_speed:
+        return MAX_CHUNK_SIZE
+    return int(max(MIN_CHUNK_SIZE, min(min_speed * window, MAX_CHUNK_SIZE)))
+
+
 def download(
-    deployment_data: DeploymentInfo, artifact_path: str, server_certificate: str
+    deployment_data: DeploymentInfo,
+    artifact_path: str,
+    server_certificate: str,
+    offset: int = 0,
+    progress: Optional[Callable[[int], None]] = None,
+    min_speed: float = 0,
+    stall_window: float = STALL_WINDOW,
+    retries: int = 0,
+    verify: Optional[Verify] = None,
+    pause: Optional[Callable[[], float]] = None,
+    on_received: Optional[Callable[[int], None]] = None,
+    digest: Optional[str] = None,
 ) -> bool:
-    """Download the update artifact to the artifact_path"""
+    """Download the update artifact to the artifact_path
+
+    :param offset: resume a previous download from this byte, if the server
+                   supports it
+    :param progress: called with the number of bytes downloaded, after they
+                     have been synced to disk, every PROGRESS_INTERVAL bytes
+    :param min_speed: abort a download slower than this many bytes/s over
+                      'stall_window' seconds, and resume it up to 'retries' times
+    :param verify: verify the signature, and the checksums, of the Artifact as
+                   it is downloaded. A download resumed from 'offset', or after
+                   a stall, is verified from the disk once complete instead
+    :param pause: called before every chunk read from the network, to pause the
+                  download while the device is busy
+    :param on_received: called with the number of bytes received, with every
+                        chunk read from the network
+    :param digest: the expected manifest digest, see mender.cache.cache. The
+                   Artifact is verified against it, and its checksums, as with
+                   'verify'
+    """
     if not artifact_path:
         log.error("No path provided in which to store the Artifact")
         return False
+    for attempt in range(retries + 1):
+        try:
+            if not _download(
+                deployment_data,
+                artifact_path,
+                server_certificate,
+                offset,
+                progress,
+                min_speed,
+                stall_window,
+                None if offset else verify,
+                None if offset else digest,
+                pause,
+                on_received,
+            ):
+                return False
+            if (verify or digest) and offset:
+                if verify_file(artifact_path, verify, digest):
+                    return True
+                try:
+                    os.remove(artifact_path)
+                except OSError:
+                    pass
+                return False
+            return True
+        except DownloadStalled as e:
+            if attempt == retries:
+                log.error(f"Giving up the download: {e}")
+                return False
+            log.info(f"{e}. Resuming it ({attempt + 1}/{retries})")
+            metrics.RETRIES.inc(operation="download")
+            offset = e.downloaded
+    return False
+
+
+def verify_artifact(
+    fileobj: BinaryIO, verify: Optional[Verify], digest: Optional[str] = None
+) -> None:
+    """Read the whole Artifact, verifying it, and its manifest against 'digest'
+
+    Raises artifact.ArtifactError.
+    """
+    reader = artifact.Reader(fileobj, verify=verify)
+    header = reader.read_header()
+    if digest and artifactcache.manifest_digest(header) != digest:
+        raise artifact.ArtifactError(f"The manifest does not match: {digest}")
+    for _ in reader.payload_files():
+        pass
+
+
+def verify_file(
+    artifact_path: str, verify: Optional[Verify], digest: Optional[str] = None
+) -> bool:
+    try:
+        with open(artifact_path, "rb") as fh:
+            verify_artifact(fh, verify, digest)
+    except (artifact.ArtifactError, OSError) as e:
+        log.error(f"Failed to verify the Artifact {artifact_path}: {e}")
+        return False
+    return True
+
+
+def _download(
+    deployment_data: DeploymentInfo,
+    artifact_path: str,
+    server_certificate: str,
+    offset: int,
+    progress: Optional[Callable[[int], None]],
+    min_speed: float,
+    stall_window: float,
+    verify: Optional[Verify],
+    digest: Optional[str],
+    pause: Optional[Callable[[], float]],
+    on_received: Optional[Callable[[int], None]],
+) -> bool:
     update_url = deployment_data.artifact_uri
     log.info(f"Downloading Artifact: {artifact_path}")
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    downloaded = offset
+    watchdog = None
+    size = chunk_size(min_speed, stall_window)
     try:
-        with requests.get(
+        with observe_request("artifact_download", "GET") as span, session().get(
             update_url,
+            headers=headers,
             stream=True,
             verify=server_certificate if server_certificate else True,
         ) as response:
-            with open(artifact_path, "wb") as fh:
-                for data in response.iter_content(chunk_size=1024*1024): # 1MiB at a time
-                    if not data:
-                        break
-                    fh.write(data)
-                    fh.flush()
+            span.set(status_code=response.status_code)
+            if response.status_code not in (200, 206):
+                log.error(
+                    f"Failed to download the Artifact, error: {response.status_code}: {response.reason}"
+                )
+                return False
+            if offset and response.status_code != 206:
+                log.info("The server does not support resuming the download")
+                offset = 0
+            if offset:
+                log.info(f"Resuming the download from byte {offset}")
+            received = downloaded = synced = offset
+
+            def write(data: bytes) -> None:
+                nonlocal downloaded, synced
+                fh.write(data)
+                fh.flush()
+                downloaded += len(data)
+                if progress and downloaded - synced >= PROGRESS_INTERVAL:
+                    os.fsync(fh.fileno())
+                    synced = downloaded
+                    progress(downloaded)
+
+            with StallWatchdog(
+                response, lambda: received, min_speed, stall_window, size
+            ) as watchdog, open(artifact_path, "r+b" if offset else "wb") as fh:
+                if offset:
+                    fh.seek(offset)
+                    fh.truncate()
+                paused = watchdog_paused(watchdog, pause)
+                # The disk writes, and the verification, overlap the network
+                # reads
+                with contextlib.ExitStack() as stack:
+                    stages = [stack.enter_context(pipeline.Stage("write", write))]
+                    if verify or digest:
+                        stages.append(
+                            stack.enter_context(
+                                pipeline.StreamStage(
+                                    "verify",
+                                    lambda f: verify_artifact(f, verify, digest),
+                                )
+                            )
+                        )
+                    for data in response.iter_content(chunk_size=size):
+                        if not data:
+                            break
+                        received += len(data)
+                        metrics.DOWNLOAD_BYTES.inc(len(data))
+                        if on_received:
+                            on_received(received)
+                        for stage in stages:
+                            stage.put(data)
+                        if paused:
+                            paused()
+                if progress:
+                    os.fsync(fh.fileno())
+                if watchdog.stalled:
+                    # The connection was shut down, and may have ended cleanly
+                    raise DownloadStalled(downloaded)
+            span.set(bytes=downloaded - offset, offset=offset)
     except (
         requests.RequestException,
         requests.ConnectionError,
@@ -114,21 +520,155 @@ def download(
         requests.TooManyRedirects,
         requests.Timeout,
     ) as e:
+        if watchdog and watchdog.stalled:
+            raise DownloadStalled(downloaded) from e
         log.error(e)
         return False
+    except OSError as e:
+        if watchdog and watchdog.stalled:
+            raise DownloadStalled(downloaded) from e
+        log.error(f"Failed to store the Artifact in {artifact_path}: {e}")
+        return False
+    except artifact.ArtifactError as e:
+        if watchdog and watchdog.stalled:
+            raise DownloadStalled(downloaded) from e
+        log.error(f"The Artifact failed the verification: {e}")
+        try:
+            os.remove(artifact_path)
+        except OSError:
+            pass
+        return False
+    if span.duration > 0:
+        metrics.DOWNLOAD_THROUGHPUT.set((downloaded - offset) / span.duration)
     return True
 
 
-def report(
-    server_url: str, status: str, deployment_id: str, server_certificate: str, JWT: str
-) -> bool:
-    """Report update :param status to the Mender server"""
-    if not status:
-        log.error("No status given to report")
-        return False
+def download_rootfs(
+    deployment_data: DeploymentInfo,
+    device: str,
+    server_certificate: str,
+    direct: bool = False,
+    min_speed: float = 0,
+    stall_window: float = STALL_WINDOW,
+    retries: int = 0,
+    verify: Optional[Verify] = None,
+    pause: Optional[Callable[[], float]] = None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> Optional[bool]:
+    """Stream the rootfs-image in the Artifact straight to the partition 'device'
+
+    Returns None, without writing anything, if the Artifact does not carry a
+    rootfs-image, in which case it has to be downloaded to the data store. A
+    stalled download is started over, up to 'retries' times, as the stream can
+    not be resumed in the middle. With 'verify', the signature is verified
+    before anything is written to the partition. 'progress' is called with the
+    number of bytes downloaded, as they are read.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return _download_rootfs(
+                deployment_data,
+                device,
+                server_certificate,
+                direct,
+                min_speed,
+                stall_window,
+                verify,
+                pause,
+                progress,
+            )
+        except DownloadStalled as e:
+            if attempt == retries:
+                log.error(f"Giving up the download: {e}")
+                return False
+            log.info(f"{e}. Starting it over ({attempt + 1}/{retries})")
+            metrics.RETRIES.inc(operation="download")
+    return False
+
+
+def _download_rootfs(
+    deployment_data: DeploymentInfo,
+    device: str,
+    server_certificate: str,
+    direct: bool,
+    min_speed: float,
+    stall_window: float,
+    verify: Optional[Verify],
+    pause: Optional[Callable[[], float]],
+    progress: Optional[Callable[[int], None]],
+) -> Optional[bool]:
+    log.info(f"Streaming the Artifact to the partition: {device}")
+    downloaded = 0
+    watchdog = None
     try:
-        headers = {"Content-Type": "application/json", "Authorization": "Bearer " + JWT}
-        response = requests.put(
+        with observe_request("artifact_download", "GET") as span, session().get(
+            deployment_data.artifact_uri,
+            stream=True,
+            verify=server_certificate if server_certificate else True,
+        ) as response:
+            span.set(status_code=response.status_code)
+            if response.status_code != 200:
+                log.error(
+                    f"Failed to download the Artifact, error: {response.status_code}: {response.reason}"
+                )
+                return False
+            response.raw.decode_content = True
+            size = chunk_size(min_speed, stall_window)
+            # The network reads overlap the verification, and the disk writes
+            with StallWatchdog(
+                response, response.raw.tell, min_speed, stall_window, size
+            ) as watchdog, pipeline.Prefetcher(
+                "verify",
+                response.raw,
+                size,
+                pause=watchdog_paused(watchdog, pause),
+                progress=progress,
+            ) as raw:
+                reader = artifact.Reader(raw, verify=verify)
+                header = reader.read_header()
+                if header.payload_type(0) != rootfs.PAYLOAD_TYPE:
+                    log.info(
+                        f"The Artifact payload is not a {rootfs.PAYLOAD_TYPE}, but: "
+                        f"{header.payload_type(0)}"
+                    )
+                    return None
+                rootfs.install(reader, device, direct=direct)
+            downloaded = response.raw.tell()
+            metrics.DOWNLOAD_BYTES.inc(downloaded)
+            span.set(bytes=downloaded, device=device)
+    # requests.RequestException is an OSError as well, and must be caught first.
+    # response.raw is read directly, which raises the urllib3 errors, such as
+    # ProtocolError once the watchdog shut the connection down, or
+    # ReadTimeoutError
+    except (
+        requests.RequestException,
+        requests.ConnectionError,
+        requests.URLRequired,
+        requests.TooManyRedirects,
+        requests.Timeout,
+        urllib3.exceptions.HTTPError,
+    ) as e:
+        if watchdog and watchdog.stalled:
+            raise DownloadStalled(response.raw.tell()) from e
+        log.error(e)
+        return False
+    except (artifact.ArtifactError, rootfs.InstallError, OSError) as e:
+        if watchdog and watchdog.stalled:
+            raise DownloadStalled(response.raw.tell()) from e
+        log.error(f"Failed to install the Artifact to {device}: {e}")
+        return False
+    if span.duration > 0:
+        metrics.DOWNLOAD_THROUGHPUT.set(downloaded / span.duration)
+    return True
+
+
+def put_status(
+    server_url: str, status: str, deployment_id: str, server_certificate: str, JWT: str
+):
+    """PUT the deployment status, and return the response"""
+    headers = {"Content-Type": "application/json", "Authorization": "Bearer " + JWT}
+    with observe_request("deployment_status", "PUT", server_url) as span:
+        response = session().put(
             server_url
             + "/api/devices/v1/deployments/device/deployments/"
             + deployment_id
@@ -137,6 +677,44 @@ def report(
             verify=server_certificate if server_certificate else True,
             json={"status": status},
         )
+        span.set(status_code=response.status_code)
+    return response
+
+
+def put_log(
+    server_url: str,
+    messages: List[dict],
+    deployment_id: str,
+    server_certificate: str,
+    JWT: str,
+):
+    """PUT the deployment log messages, and return the response"""
+    headers = {"Content-Type": "application/json", "Authorization": "Bearer " + JWT}
+    with observe_request("deployment_log", "PUT", server_url) as span:
+        response = session().put(
+            server_url
+            + "/api/devices/v1/deployments/device/deployments/"
+            + deployment_id
+            + "/log",
+            headers=headers,
+            verify=server_certificate if server_certificate else True,
+            json={"messages": messages},
+        )
+        span.set(status_code=response.status_code)
+    return response
+
+
+def report(
+    server_url: str, status: str, deployment_id: str, server_certificate: str, JWT: str
+) -> bool:
+    """Report update :param status to the Mender server"""
+    if not status:
+        log.error("No status given to report")
+        return False
+    try:
+        response = put_status(
+            server_url, status, deployment_id, server_certificate, JWT
+        )
         if response.status_code != 204:
             log.error(
                 f"Failed to upload the deployment status '{status}',\
@@ -144,26 +722,12 @@ def report(
             )
             return False
         if status == STATUS_FAILURE:
-            menderlog.add_sub_updater_log(
-                os.path.join(settings.PATHS.deployment_log, "deployment.log")
-            )
-            response = requests.put(
-                server_url
-                + "/api/devices/v1/deployments/device/deployments/"
-                + deployment_id
-                + "/log",
-                headers=headers,
-                verify=server_certificate if server_certificate else True,
-                json={
-                    "messages": [
-                        # Dummy data
-                        {
-                            "timestamp": "2016-03-11T13:03:17.063493443Z",
-                            "level": "INFO",
-                            "message": "OK",
-                        }
-                    ]
-                },
+            response = put_log(
+                server_url,
+                menderlog.read_deployment_log(),
+                deployment_id,
+                server_certificate,
+                JWT,
             )
             if response.status_code != 204:
                 log.error(
@@ -181,3 +745,56 @@ def report(
         log.error(e)
         return False
     return True
+
+
+def deliver(
+    server_url: str, server_certificate: str, JWT: str, report: outbox.Report
+) -> bool:
+    """Deliver a report queued in the outbox
+
+    Returns True if the server accepted the report, or rejected it for good,
+    such as for an aborted deployment, and False if it is to be retried.
+    Raises HTTPUnathorized if the JWT was rejected.
+    """
+    try:
+        if report.kind == outbox.KIND_STATUS:
+            response = put_status(
+                server_url,
+                report.payload["status"],
+                report.deployment_id,
+                server_certificate,
+                JWT,
+            )
+        else:
+            response = put_log(
+                server_url,
+                report.payload["messages"],
+                report.deployment_id,
+                server_certificate,
+                JWT,
+            )
+    except (
+        requests.RequestException,
+        requests.ConnectionError,
+        requests.URLRequired,
+        requests.TooManyRedirects,
+        requests.Timeout,
+    ) as e:
+        log.error(f"Failed to deliver the deployment {report.kind}: {e}")
+        return False
+    if response.status_code in (200, 204):
+        return True
+    if response.status_code == 401:
+        raise HTTPUnathorized()
+    if 400 <= response.status_code < 500:
+        log.error(
+            f"The server rejected the deployment {report.kind} of "
+            f"{report.deployment_id}: {response.status_code}: {response.reason}. "
+            "Dropping it"
+        )
+        return True
+    log.error(
+        f"Failed to deliver the deployment {report.kind}, "
+        f"error: {response.status_code}: {response.reason}"
+    )
+    return False
@@ -15,19 +15,26 @@ import json
 import logging as log
 import requests
 
+import mender.metrics.metrics as metrics
+from mender.client import HTTPUnathorized, observe_request, session
+
 
 def request(
     server_url: str, JWT: str, inventory_data: dict, server_certificate: str
-) -> None:
+) -> bool:
+    """Upload the inventory, and return True if the server accepted it
+
+    Raises HTTPUnathorized if the JWT was rejected.
+    """
     if not server_url:
         log.error("ServerURL not provided, unable to upload the inventory")
-        return None
+        return False
     if not JWT:
         log.error("No JWT not provided, unable to upload the inventory")
-        return None
+        return False
     if not inventory_data:
         log.info("No inventory_data provided")
-        return None
+        return False
     log.debug(
         f"inventory request: server_url: {server_url}\nJWT: {JWT}\ninventory_data: {inventory_data}"
     )
@@ -35,12 +42,15 @@ def request(
     log.debug(f"inventory headers: {headers}")
     raw_data = json.dumps([{"name": k, "value": v} for k, v in inventory_data.items()])
     try:
-        r = requests.put(
-            server_url + "/api/devices/v1/inventory/device/attributes",
-            headers=headers,
-            data=raw_data,
-            verify=server_certificate if server_certificate else True,
-        )
+        metrics.HTTP_BYTES_SENT.inc(len(raw_data), endpoint="inventory_attributes")
+        with observe_request("inventory_attributes", "PUT", server_url) as span:
+            r = session().put(
+                server_url + "/api/devices/v1/inventory/device/attributes",
+                headers=headers,
+                data=raw_data,
+                verify=server_certificate if server_certificate else True,
+            )
+            span.set(status_code=r.status_code)
     except (
         requests.RequestException,
         requests.ConnectionError,
@@ -49,9 +59,13 @@ def request(
         requests.Timeout,
     ) as e:
         log.error(f"Failed to upload the inventory: {e}")
-        return None
+        return False
     log.debug(f"inventory response: {r}")
-    log.error(f"Error {r.reason}. code: {r.status_code}")
+    if r.status_code == 401:
+        log.info(f"The client seems to have been unathorized {r}")
+        raise HTTPUnathorized()
     if r.status_code != 200:
-        log.error(f"{r.json()}")
-    return None
+        log.error(f"Error {r.reason}. code: {r.status_code}")
+        log.error(f"{r.text}")
+        return False
+    return True
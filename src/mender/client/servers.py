@@ -0,0 +1,240 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Choose among several Mender servers, by their latency, and health
+
+The servers are given by ServerURL, and the Servers list of the configuration,
+in order of preference, each with an optional weight. The latency of every
+request to a server is smoothed into a moving average, and the client prefers
+the server with the lowest latency per weight, switching only for a clearly
+faster one. A server failing FAILURE_THRESHOLD requests in a row is not used
+for a while (the circuit breaker opens), for longer after every failed retry.
+
+Only the server in use is measured by the requests of the client, so the other
+servers are probed with a cheap request every PROBE_INTERVAL seconds, for
+longer after every failed probe, for the client to tell if one is faster.
+
+Usage::
+
+  servers.configure(config)
+  for url in servers.SERVERS.due_probes(current):
+      authorize.probe(url, server_certificate)
+  server_url = servers.SERVERS.select(current)
+"""
+import logging as log
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import mender.metrics.metrics as metrics
+
+# The number of failed requests in a row which take a server out of use
+FAILURE_THRESHOLD = 3
+# How long a failing server is not used, doubled after every failed retry
+OPEN_SECONDS = 30.0
+MAX_OPEN_SECONDS = 600.0
+# The weight of the latest latency in the moving average
+LATENCY_ALPHA = 0.3
+# How much faster, relatively, a server must be for the client to switch to it
+SWITCH_MARGIN = 0.5
+# How often the servers not in use are probed, doubled after every failed probe
+PROBE_INTERVAL = 300.0
+MAX_PROBE_INTERVAL = 3600.0
+
+
+class Server:
+    def __init__(self, url: str, weight: float = 1.0):
+        self.url = url
+        self.weight = weight
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.opened = 0
+        self.open_until = 0.0
+        self.next_probe = 0.0
+
+    def available(self, now: float) -> bool:
+        return now >= self.open_until
+
+    def score(self) -> Optional[float]:
+        """The latency per weight, None if not measured yet"""
+        if self.latency is None:
+            return None
+        return self.latency / self.weight
+
+
+class Servers:
+    """The Mender servers, in order of preference, with their latency and health"""
+
+    def __init__(
+        self,
+        servers: List[Tuple[str, float]],
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.servers = [Server(url, weight) for url, weight in servers]
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    @property
+    def urls(self) -> List[str]:
+        return [server.url for server in self.servers]
+
+    def _find(self, url: str) -> Optional[Server]:
+        for server in self.servers:
+            if server.url == url:
+                return server
+        return None
+
+    def record(self, url: str, seconds: float, ok: bool) -> None:
+        """Record a request to the server 'url', and whether the server served it"""
+        with self._lock:
+            server = self._find(url)
+            if server is None:
+                return
+            if ok:
+                if server.latency is None:
+                    server.latency = seconds
+                else:
+                    server.latency += LATENCY_ALPHA * (seconds - server.latency)
+                metrics.SERVER_LATENCY.set(server.latency, server=url)
+                if server.opened:
+                    log.info(f"The server {url} is back")
+                server.failures = server.opened = 0
+                server.open_until = 0.0
+                return
+            server.failures += 1
+            if server.failures < FAILURE_THRESHOLD:
+                return
+            # Opened again by a single failure, once retried
+            seconds_open = min(OPEN_SECONDS * 2 ** server.opened, MAX_OPEN_SECONDS)
+            server.opened += 1
+            server.open_until = self.clock() + seconds_open
+            log.warning(
+                f"The server {url} failed {server.failures} requests in a row. "
+                f"Not using it for {seconds_open:.0f}s"
+            )
+
+    def due_probes(self, current: Optional[str]) -> List[str]:
+        """The servers, other than 'current', due for a probe of their latency
+
+        The servers returned are not due again for PROBE_INTERVAL seconds,
+        doubled for every request they failed in a row, or until their circuit
+        breaker closes.
+        """
+        if len(self.servers) < 2:
+            return []
+        now = self.clock()
+        due = []
+        with self._lock:
+            for server in self.servers:
+                if server.url == current or not server.available(now):
+                    continue
+                if now < server.next_probe:
+                    continue
+                interval = PROBE_INTERVAL * 2 ** min(server.failures, 10)
+                server.next_probe = now + min(interval, MAX_PROBE_INTERVAL)
+                due.append(server.url)
+        return due
+
+    def candidates(self) -> List[str]:
+        """The servers, from the most preferred to the least
+
+        The measured servers come first, the fastest first, and then the others
+        in the configured order. The servers out of use come last, the one
+        back the soonest first.
+        """
+        now = self.clock()
+        with self._lock:
+            indexed = list(enumerate(self.servers))
+            available = [(i, s) for i, s in indexed if s.available(now)]
+            measured = sorted(
+                (s.score(), i, s) for i, s in available if s.score() is not None
+            )
+            unmeasured = [s for _, s in available if s.score() is None]
+            unavailable = sorted(
+                (s.open_until, i, s) for i, s in indexed if not s.available(now)
+            )
+        return (
+            [s.url for _, _, s in measured]
+            + [s.url for s in unmeasured]
+            + [s.url for _, _, s in unavailable]
+        )
+
+    def select(self, current: Optional[str] = None) -> str:
+        """Return the server to use, keeping 'current' unless there is a better one"""
+        candidates = self.candidates()
+        if not candidates:
+            return ""
+        best = candidates[0]
+        now = self.clock()
+        with self._lock:
+            server, other = self._find(current or ""), self._find(best)
+            if server is None or not server.available(now):
+                return best
+            score, best_score = server.score(), other.score() if other else None
+            if score is None or best_score is None:
+                return server.url
+            if best_score < score * (1 - SWITCH_MARGIN):
+                return best
+            return server.url
+
+
+SERVERS = Servers([])
+
+
+def _weight(value) -> float:
+    try:
+        weight = float(value)
+    except (TypeError, ValueError):
+        weight = 0
+    if weight <= 0:
+        log.error(f"Invalid server weight: {value}. Using 1")
+        return 1.0
+    return weight
+
+
+def parse(config) -> List[Tuple[str, float]]:
+    """The (URL, weight) of the ServerURL, and the Servers, of the configuration
+
+    The Servers are given as URLs, or as {"ServerURL": <url>, "Weight": <n>}
+    objects.
+    """
+    servers: List[Tuple[str, float]] = []
+    entries = ([config.ServerURL] if config.ServerURL else []) + list(config.Servers)
+    for entry in entries:
+        if isinstance(entry, dict):
+            url, weight = entry.get("ServerURL", ""), _weight(entry.get("Weight", 1))
+        else:
+            url, weight = str(entry), 1.0
+        url = url.strip().rstrip("/")
+        if url and url not in (u for u, _ in servers):
+            servers.append((url, weight))
+    return servers
+
+
+def configure(config) -> Servers:
+    """Use the servers of the configuration
+
+    Their measurements are kept, unless the configured servers changed.
+    """
+    global SERVERS  # pylint: disable=global-statement
+    servers = parse(config)
+    if [(s.url, s.weight) for s in SERVERS.servers] != servers:
+        SERVERS = Servers(servers)
+        if len(servers) > 1:
+            log.info(f"Using the servers: {', '.join(url for url, _ in servers)}")
+    return SERVERS
+
+
+def record(url: Optional[str], seconds: float, ok: bool) -> None:
+    if url:
+        SERVERS.record(url, seconds, ok)
@@ -0,0 +1,266 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""The transports carrying the requests to the server
+
+A transport is an object with the subset of the requests.Session interface used
+by the client: the get, head, post, and put methods, returning responses with the
+subset of the requests.Response interface used by the client, and raising the
+requests exceptions.
+
+* requests - HTTP/1.1 through a requests.Session (the default)
+* http2    - HTTP/2 through httpx, multiplexing concurrent requests to a host
+             on a single connection. Falls back to HTTP/1.1 for servers not
+             negotiating HTTP/2, and to the requests transport if httpx, or
+             its HTTP/2 support, is not installed.
+"""
+# pylint: disable=import-outside-toplevel
+import contextlib
+import logging as log
+import os
+import ssl
+import threading
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+TRANSPORT_REQUESTS = "requests"
+TRANSPORT_HTTP2 = "http2"
+
+TRANSPORTS = (TRANSPORT_REQUESTS, TRANSPORT_HTTP2)
+
+# The (connect, read) timeouts in seconds, None for no timeout. The read timeout
+# is the longest wait for the next bytes from the server, and not a limit on
+# the duration of the whole request.
+Timeout = Tuple[Optional[float], Optional[float]]
+
+NO_TIMEOUT: Timeout = (None, None)
+
+
+def create(name: str, pool_size: int, timeout: Timeout = NO_TIMEOUT):
+    """Create the transport 'name', or fall back to the requests transport
+
+    :param timeout: the default timeouts of the requests
+    """
+    if name == TRANSPORT_HTTP2:
+        try:
+            return HTTP2Transport(pool_size, timeout)
+        except ImportError as e:
+            log.info(f"HTTP/2 is not available ({e}). Falling back to HTTP/1.1")
+    elif name != TRANSPORT_REQUESTS:
+        log.error(f"Unknown HTTP transport: {name}. Using {TRANSPORT_REQUESTS}")
+    return requests_transport(pool_size, timeout)
+
+
+def requests_transport(pool_size: int, timeout: Timeout = NO_TIMEOUT):
+    import requests
+    import requests.adapters
+
+    class TimeoutHTTPAdapter(requests.adapters.HTTPAdapter):
+        """Apply the default timeouts to the requests not giving their own"""
+
+        def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+            if kwargs.get("timeout") is None:
+                kwargs["timeout"] = timeout
+            return super().send(request, **kwargs)
+
+    adapter = TimeoutHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@contextlib.contextmanager
+def _translate_errors() -> Iterator[None]:
+    """Raise the httpx errors as the requests errors the callers handle"""
+    import httpx
+    import requests
+
+    try:
+        yield
+    except httpx.TimeoutException as e:
+        raise requests.Timeout(str(e)) from e
+    except httpx.TooManyRedirects as e:
+        raise requests.TooManyRedirects(str(e)) from e
+    except (httpx.NetworkError, httpx.RemoteProtocolError) as e:
+        raise requests.ConnectionError(str(e)) from e
+    except (httpx.InvalidURL, httpx.UnsupportedProtocol) as e:
+        raise requests.URLRequired(str(e)) from e
+    except httpx.HTTPError as e:
+        raise requests.RequestException(str(e)) from e
+
+
+class _Raw:
+    """The file-like body of a streamed response, like urllib3's HTTPResponse"""
+
+    def __init__(self, response):
+        self._response = response
+        self._chunks: Optional[Iterator[bytes]] = None
+        self._buffer = b""
+        self.decode_content = False
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        if self._chunks is None:
+            self._chunks = (
+                self._response.iter_bytes()
+                if self.decode_content
+                else self._response.iter_raw()
+            )
+        with _translate_errors():
+            while amt is None or len(self._buffer) < amt:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._buffer += chunk
+        if amt is None:
+            amt = len(self._buffer)
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def tell(self) -> int:
+        """The number of bytes read from the connection"""
+        return self._response.num_bytes_downloaded
+
+
+class HTTP2Response:
+    def __init__(self, response):
+        self._response = response
+        self.status_code: int = response.status_code
+        self.reason: str = response.reason_phrase
+        self.headers = response.headers
+        self.http_version: str = response.http_version
+        self.raw = _Raw(response)
+
+    def _read(self) -> None:
+        with _translate_errors():
+            self._response.read()
+
+    @property
+    def content(self) -> bytes:
+        self._read()
+        return self._response.content
+
+    @property
+    def text(self) -> str:
+        self._read()
+        return self._response.text
+
+    def json(self) -> Any:
+        self._read()
+        return self._response.json()
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        with _translate_errors():
+            yield from self._response.iter_bytes(chunk_size)
+
+    def raise_for_status(self) -> None:
+        import requests
+
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} {self.reason}", response=self)
+
+    def close(self) -> None:
+        self._response.close()
+
+    def __enter__(self) -> "HTTP2Response":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def _ssl_context(verify: Union[str, bool]) -> Union[ssl.SSLContext, bool]:
+    """The httpx 'verify' of the requests 'verify': a CA bundle, or directory,
+    path is given to httpx as an SSL context trusting it"""
+    if isinstance(verify, bool):
+        return verify
+    if os.path.isdir(verify):
+        return ssl.create_default_context(capath=verify)
+    return ssl.create_default_context(cafile=verify)
+
+
+class HTTP2Transport:
+    """Send the requests through httpx over HTTP/2
+
+    A client, with its connection pool, is kept per server certificate, as the
+    certificate is given per request by the callers, and per client by httpx.
+    The SSL context of a certificate is thus built once, when its client is.
+    """
+
+    def __init__(self, pool_size: int, timeout: Timeout = NO_TIMEOUT):
+        import httpx
+        import h2  # pylint: disable=unused-import
+
+        self._httpx = httpx
+        self._limits = httpx.Limits(
+            max_connections=pool_size, max_keepalive_connections=pool_size
+        )
+        connect, read = timeout
+        self._timeout = httpx.Timeout(read, connect=connect)
+        self._clients: Dict[Union[str, bool], Any] = {}
+        self._lock = threading.Lock()
+
+    def _client(self, verify: Union[str, bool]):
+        with self._lock:
+            client = self._clients.get(verify)
+            if client is None:
+                client = self._clients[verify] = self._httpx.Client(
+                    http2=True,
+                    verify=_ssl_context(verify),
+                    limits=self._limits,
+                    follow_redirects=True,
+                    timeout=self._timeout,
+                )
+            return client
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        params: Optional[dict] = None,
+        data: Optional[Union[str, bytes, dict]] = None,
+        json: Optional[Any] = None,
+        headers: Optional[dict] = None,
+        verify: Union[str, bool] = True,
+        stream: bool = False,
+    ) -> HTTP2Response:
+        client = self._client(verify)
+        with _translate_errors():
+            request = client.build_request(
+                method,
+                url,
+                params=params,
+                content=data if isinstance(data, (str, bytes)) else None,
+                data=data if isinstance(data, dict) else None,
+                json=json,
+                headers=headers,
+            )
+            response = client.send(request, stream=stream)
+        return HTTP2Response(response)
+
+    def get(self, url: str, **kwargs) -> HTTP2Response:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> HTTP2Response:
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> HTTP2Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> HTTP2Response:
+        return self.request("PUT", url, **kwargs)
+
+    def close(self) -> None:
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients = {}
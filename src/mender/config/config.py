@@ -13,24 +13,64 @@
 #    limitations under the License.
 import json
 import logging as log
-from typing import Optional
+from typing import Any, List, Optional
 
 
 class NoConfigurationFileError(Exception):
     pass
 
 
+def _boolean(key: str, value: Any, default: bool) -> bool:
+    """Parse the JSON boolean, or the string "true" or "false", 'value' of 'key'"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    log.error(f"Invalid {key}: {value!r}. Expected true, or false. Using {default}")
+    return default
+
+
 class Config:
     """A dictionary for storing Mender configuration values"""
 
     ServerURL = ""
+    Servers: List[Any] = []
     RootfsPartA = ""
     RootfsPartB = ""
+    RootfsStreamInstall = False
+    RootfsDirectIO = False
     TenantToken = ""
     InventoryPollIntervalSeconds = ""
+    InventoryCollectors: List[str] = []
     UpdatePollIntervalSeconds = ""
     RetryPollIntervalSeconds = ""
     ServerCertificate = ""
+    ArtifactVerifyKey = ""
+    HTTPTransport = "requests"
+    ConnectTimeoutSeconds = 30
+    ReadTimeoutSeconds = 60
+    DownloadStallSeconds = 60
+    DownloadMinSpeedBytes = 1024
+    DownloadRetries = 3
+    ArtifactCacheSizeMB = 0
+    PeerListenAddress = ""
+    PeerURLs: List[str] = []
+    UpdateNice = 10
+    UpdateIOClass = "best-effort"
+    UpdateIOPriority = 7
+    UpdateCgroup = ""
+    UpdateCPUMax = ""
+    UpdateMemoryMax = ""
+    UpdateIOMax = ""
+    UpdatePauseLoadAverage = 0.0
+    UpdatePausePressure = 0.0
+    UpdatePauseMaxSeconds = 60
+    MetricsEnabled = False
+    MetricsTextfile = ""
+    MetricsListenAddress = ""
+    MetricsExportIntervalSeconds = 15
+    TracingFile = ""
+    TracingOTLPFile = ""
 
     def __init__(self, global_conf: dict, local_conf: dict):
         vals = {**global_conf, **local_conf}
@@ -39,18 +79,38 @@ class Config:
             if k == "ServerURL":
                 log.debug(f"ServerURL: {v}")
                 self.ServerURL = v
+            elif k == "Servers":
+                log.debug(f"Servers: {v}")
+                self.Servers = (
+                    [u.strip() for u in v.split(",") if u.strip()]
+                    if isinstance(v, str)
+                    else list(v)
+                )
             elif k == "RootfsPartA":
                 log.debug(f"RootfsPartA: {v}")
                 self.RootfsPartA = v
             elif k == "RootfsPartB":
                 log.debug(f"RootfsPartB: {v}")
                 self.RootfsPartB = v
+            elif k == "RootfsStreamInstall":
+                log.debug(f"RootfsStreamInstall: {v}")
+                self.RootfsStreamInstall = _boolean(k, v, Config.RootfsStreamInstall)
+            elif k == "RootfsDirectIO":
+                log.debug(f"RootfsDirectIO: {v}")
+                self.RootfsDirectIO = _boolean(k, v, Config.RootfsDirectIO)
             elif k == "TenantToken":
                 log.debug(f"TenantToken: {v}")
                 self.TenantToken = v
             elif k == "InventoryPollIntervalSeconds":
                 log.debug(f"InventoryPollInvervalSeconds: {v}")
                 self.InventoryPollIntervalSeconds = v
+            elif k == "InventoryCollectors":
+                log.debug(f"InventoryCollectors: {v}")
+                self.InventoryCollectors = (
+                    [c.strip() for c in v.split(",") if c.strip()]
+                    if isinstance(v, str)
+                    else list(v)
+                )
             elif k == "UpdatePollIntervalSeconds":
                 log.debug(f"UpdatePollIntervalSeconds: {v}")
                 self.UpdatePollIntervalSeconds = v
@@ -60,6 +120,88 @@ class Config:
             elif k == "ServerCertificate":
                 log.debug(f"ServerCertificate: {v}")
                 self.ServerCertificate = v
+            elif k == "ArtifactVerifyKey":
+                log.debug(f"ArtifactVerifyKey: {v}")
+                self.ArtifactVerifyKey = v
+            elif k == "HTTPTransport":
+                log.debug(f"HTTPTransport: {v}")
+                self.HTTPTransport = v
+            elif k == "ConnectTimeoutSeconds":
+                log.debug(f"ConnectTimeoutSeconds: {v}")
+                self.ConnectTimeoutSeconds = v
+            elif k == "ReadTimeoutSeconds":
+                log.debug(f"ReadTimeoutSeconds: {v}")
+                self.ReadTimeoutSeconds = v
+            elif k == "DownloadStallSeconds":
+                log.debug(f"DownloadStallSeconds: {v}")
+                self.DownloadStallSeconds = v
+            elif k == "DownloadMinSpeedBytes":
+                log.debug(f"DownloadMinSpeedBytes: {v}")
+                self.DownloadMinSpeedBytes = v
+            elif k == "DownloadRetries":
+                log.debug(f"DownloadRetries: {v}")
+                self.DownloadRetries = v
+            elif k == "ArtifactCacheSizeMB":
+                log.debug(f"ArtifactCacheSizeMB: {v}")
+                self.ArtifactCacheSizeMB = v
+            elif k == "PeerListenAddress":
+                log.debug(f"PeerListenAddress: {v}")
+                self.PeerListenAddress = v
+            elif k == "PeerURLs":
+                log.debug(f"PeerURLs: {v}")
+                self.PeerURLs = (
+                    [u.strip() for u in v.split(",") if u.strip()]
+                    if isinstance(v, str)
+                    else list(v)
+                )
+            elif k == "UpdateNice":
+                log.debug(f"UpdateNice: {v}")
+                self.UpdateNice = v
+            elif k == "UpdateIOClass":
+                log.debug(f"UpdateIOClass: {v}")
+                self.UpdateIOClass = v
+            elif k == "UpdateIOPriority":
+                log.debug(f"UpdateIOPriority: {v}")
+                self.UpdateIOPriority = v
+            elif k == "UpdateCgroup":
+                log.debug(f"UpdateCgroup: {v}")
+                self.UpdateCgroup = v
+            elif k == "UpdateCPUMax":
+                log.debug(f"UpdateCPUMax: {v}")
+                self.UpdateCPUMax = v
+            elif k == "UpdateMemoryMax":
+                log.debug(f"UpdateMemoryMax: {v}")
+                self.UpdateMemoryMax = v
+            elif k == "UpdateIOMax":
+                log.debug(f"UpdateIOMax: {v}")
+                self.UpdateIOMax = v
+            elif k == "UpdatePauseLoadAverage":
+                log.debug(f"UpdatePauseLoadAverage: {v}")
+                self.UpdatePauseLoadAverage = v
+            elif k == "UpdatePausePressure":
+                log.debug(f"UpdatePausePressure: {v}")
+                self.UpdatePausePressure = v
+            elif k == "UpdatePauseMaxSeconds":
+                log.debug(f"UpdatePauseMaxSeconds: {v}")
+                self.UpdatePauseMaxSeconds = v
+            elif k == "MetricsEnabled":
+                log.debug(f"MetricsEnabled: {v}")
+                self.MetricsEnabled = _boolean(k, v, Config.MetricsEnabled)
+            elif k == "MetricsTextfile":
+                log.debug(f"MetricsTextfile: {v}")
+                self.MetricsTextfile = v
+            elif k == "MetricsListenAddress":
+                log.debug(f"MetricsListenAddress: {v}")
+                self.MetricsListenAddress = v
+            elif k == "MetricsExportIntervalSeconds":
+                log.debug(f"MetricsExportIntervalSeconds: {v}")
+                self.MetricsExportIntervalSeconds = v
+            elif k == "TracingFile":
+                log.debug(f"TracingFile: {v}")
+                self.TracingFile = v
+            elif k == "TracingOTLPFile":
+                log.debug(f"TracingOTLPFile: {v}")
+                self.TracingOTLPFile = v
             else:
                 log.error(f"The key {k} is not recognized by the Python client")
 
@@ -0,0 +1,64 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import json
+import logging as log
+import os
+from typing import Any, Optional
+
+
+def write(path: str, data: str, mode: int = 0o600) -> None:
+    """Atomically replace the file at 'path' with 'data'
+
+    The data is written to a temporary file next to 'path', which is then
+    renamed over it, so that a reader, or a crash, never sees a partial file.
+    """
+    tmp_path = path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, "w") as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+
+
+def read(path: str) -> Optional[str]:
+    """Return the contents of the file at 'path', or None if it does not exist"""
+    try:
+        with open(path) as fh:
+            return fh.read()
+    except FileNotFoundError:
+        return None
+
+
+def remove(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def write_json(path: str, data: Any) -> None:
+    write(path, json.dumps(data))
+
+
+def read_json(path: str) -> Optional[Any]:
+    """Return the JSON data stored at 'path', or None if missing or corrupt"""
+    raw = read(path)
+    if raw is None:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        log.error(f"The data stored in {path} is corrupt. Ignoring it")
+        return None
@@ -0,0 +1,341 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Keep the update work from disturbing the applications on the device
+
+The download, and the install script, run with a lower CPU (nice), and I/O
+(ionice), priority than the applications. The install script can further be
+confined to a cgroup v2, with CPU, I/O, and memory limits. The download pauses
+while the device is busy, as told by the load average, or the pressure stall
+information (PSI) of the CPU, and the I/O.
+"""
+import contextlib
+import ctypes
+import ctypes.util
+import functools
+import logging as log
+import os
+import os.path
+import platform
+import shutil
+import subprocess
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+import mender.metrics.metrics as metrics
+
+IOPRIO_CLASSES = {"none": 0, "realtime": 1, "best-effort": 2, "idle": 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+
+# The ioprio_set syscall numbers, ioprio_get being the next one
+_IOPRIO_SET = {
+    "x86_64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "riscv64": 30,
+    "armv6l": 314,
+    "armv7l": 314,
+    "ppc64le": 273,
+}
+_IOPRIO_SET_NR = _IOPRIO_SET.get(platform.machine())
+
+# How often the load is checked while the download is paused
+PAUSE_POLL_INTERVAL = 1.0
+
+
+@functools.lru_cache(maxsize=None)
+def _syscall() -> Optional[Callable[..., int]]:
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        return libc.syscall
+    except (OSError, AttributeError):
+        return None
+
+
+def get_ioprio() -> Optional[int]:
+    """Return the I/O priority of the calling thread, None if not supported"""
+    syscall = _syscall()
+    if _IOPRIO_SET_NR is None or syscall is None:
+        return None
+    prio = syscall(_IOPRIO_SET_NR + 1, IOPRIO_WHO_PROCESS, 0)
+    return None if prio < 0 else prio
+
+
+def set_ioprio(prio: int, pid: int = 0) -> bool:
+    """Set the I/O priority of the thread 'pid', the calling thread by default"""
+    syscall = _syscall()
+    if _IOPRIO_SET_NR is None or syscall is None:
+        return False
+    return syscall(_IOPRIO_SET_NR, IOPRIO_WHO_PROCESS, pid, prio) == 0
+
+
+def read_load_average(path: str = "/proc/loadavg") -> float:
+    """Return the 1 minute load average, per CPU"""
+    with open(path) as fh:
+        return float(fh.read().split()[0]) / (os.cpu_count() or 1)
+
+
+def read_pressure(directory: str = "/proc/pressure") -> float:
+    """Return the highest 'some avg10' pressure of the CPU, and the I/O, in %"""
+    highest = 0.0
+    for resource in ("cpu", "io"):
+        with open(os.path.join(directory, resource)) as fh:
+            for line in fh:
+                fields = dict(f.split("=", 1) for f in line.split()[1:] if "=" in f)
+                if line.startswith("some") and "avg10" in fields:
+                    highest = max(highest, float(fields["avg10"]))
+    return highest
+
+
+class Governor:
+    """The resource controls of the update work, see configure()
+
+    Usage::
+
+      governor = configure(config)
+      with governor.lowered_priority():
+          download(pause=governor.pause)
+      governor.run(install_script, check=True)
+    """
+
+    def __init__(
+        self,
+        nice: int = 0,
+        io_class: str = "",
+        io_priority: int = 7,
+        cgroup: str = "",
+        cgroup_limits: Optional[Dict[str, str]] = None,
+        max_load: float = 0,
+        max_pressure: float = 0,
+        max_pause: float = 60,
+        load: Callable[[], float] = read_load_average,
+        pressure: Callable[[], float] = read_pressure,
+    ):
+        self.nice = nice
+        self.ioprio = None
+        if io_class in IOPRIO_CLASSES and io_class != "none":
+            self.ioprio = (IOPRIO_CLASSES[io_class] << IOPRIO_CLASS_SHIFT) | max(
+                0, min(7, io_priority)
+            )
+        self.cgroup = cgroup
+        self.cgroup_limits = cgroup_limits or {}
+        self.max_load = max_load
+        self.max_pressure = max_pressure
+        self.max_pause = max_pause
+        self.load = load
+        self.pressure = pressure
+        self._checked = 0.0
+
+    @contextlib.contextmanager
+    def lowered_priority(self) -> Iterator[None]:
+        """Lower the CPU, and I/O, priority of the calling thread for the block
+
+        The threads started in the block inherit the lowered priority.
+        """
+        niceness = os.getpriority(os.PRIO_PROCESS, 0)
+        ioprio = get_ioprio() if self.ioprio is not None else None
+        try:
+            if self.nice:
+                os.setpriority(os.PRIO_PROCESS, 0, min(19, niceness + self.nice))
+            if self.ioprio is not None and not set_ioprio(self.ioprio):
+                log.debug("Unable to set the I/O priority of the update work")
+        except OSError as e:
+            log.warning(f"Unable to lower the priority of the update work: {e}")
+        try:
+            yield
+        finally:
+            try:
+                if self.nice:
+                    # Raising the priority back requires CAP_SYS_NICE
+                    os.setpriority(os.PRIO_PROCESS, 0, niceness)
+                if ioprio is not None:
+                    set_ioprio(ioprio)
+            except OSError as e:
+                log.warning(f"Unable to restore the priority of the daemon: {e}")
+
+    def busy(self) -> Optional[str]:
+        """Return why the device is too busy for the update work, if it is"""
+        try:
+            if self.max_load:
+                load = self.load()
+                if load > self.max_load:
+                    return f"load average {load:.2f} per CPU"
+            if self.max_pressure:
+                pressure = self.pressure()
+                if pressure > self.max_pressure:
+                    return f"pressure stall {pressure:.1f}%"
+        except (OSError, ValueError, IndexError) as e:
+            log.debug(f"Unable to read the load of the device: {e}")
+        return None
+
+    def pause(self) -> float:
+        """Wait, for at most 'max_pause' seconds, while the device is busy
+
+        The load is checked at most every PAUSE_POLL_INTERVAL. Returns the time
+        paused.
+        """
+        if not self.max_load and not self.max_pressure:
+            return 0
+        now = time.monotonic()
+        if now - self._checked < PAUSE_POLL_INTERVAL:
+            return 0
+        self._checked = now
+        reason = self.busy()
+        if not reason:
+            return 0
+        log.info(f"Pausing the update work, the device is busy: {reason}")
+        start = time.monotonic()
+        deadline = start + self.max_pause
+        while time.monotonic() < deadline:
+            time.sleep(min(PAUSE_POLL_INTERVAL, max(0, deadline - time.monotonic())))
+            if not self.busy():
+                break
+        paused = time.monotonic() - start
+        metrics.UPDATE_PAUSED_SECONDS.inc(paused)
+        log.info(f"Resuming the update work after {paused:.0f}s")
+        return paused
+
+    def setup_cgroup(self) -> Optional[str]:
+        """Create the cgroup, with its limits, and return the path of its procs"""
+        if not self.cgroup:
+            return None
+        try:
+            os.makedirs(self.cgroup, exist_ok=True)
+        except OSError as e:
+            log.error(f"Failed to create the cgroup {self.cgroup}: {e}")
+            return None
+        controllers = " ".join(
+            "+" + name.split(".")[0] for name in sorted(self.cgroup_limits)
+        )
+        if controllers:
+            parent = os.path.join(
+                os.path.dirname(self.cgroup), "cgroup.subtree_control"
+            )
+            try:
+                with open(parent, "w") as fh:
+                    fh.write(controllers)
+            except OSError as e:
+                log.warning(f"Failed to enable the controllers '{controllers}': {e}")
+        for name, value in sorted(self.cgroup_limits.items()):
+            try:
+                with open(os.path.join(self.cgroup, name), "w") as fh:
+                    fh.write(value)
+            except OSError as e:
+                log.error(f"Failed to set {name} of {self.cgroup} to '{value}': {e}")
+        procs = os.path.join(self.cgroup, "cgroup.procs")
+        if not os.path.exists(procs):
+            log.error(f"{self.cgroup} is not in a cgroup v2 hierarchy")
+            return None
+        return procs
+
+    def run(self, args: List[str], check: bool = False, **kwargs):
+        """subprocess.run() 'args', confined
+
+        No code may run between the fork and the exec, in a daemon with threads.
+        The subprocess thus lowers its priority by running through nice, and
+        ionice, and is moved into the cgroup by the daemon once started. The
+        priorities nice, or ionice, is not installed for are set by the daemon
+        too.
+        """
+        procs = self.setup_cgroup()
+        nice, ioprio, prefix = self.nice, self.ioprio, []
+        if nice and shutil.which("nice"):
+            prefix += ["nice", "-n", str(nice)]
+            nice = 0
+        if ioprio is not None and shutil.which("ionice"):
+            io_class = ioprio >> IOPRIO_CLASS_SHIFT
+            prefix += ["ionice", "-c", str(io_class)]
+            if io_class != IOPRIO_CLASSES["idle"]:
+                prefix += ["-n", str(ioprio & 7)]
+            ioprio = None
+        input_ = kwargs.pop("input", None)
+        if input_ is not None:
+            kwargs["stdin"] = subprocess.PIPE
+        with subprocess.Popen(prefix + list(args), **kwargs) as proc:
+            self._confine(proc.pid, procs, nice, ioprio)
+            try:
+                stdout, stderr = proc.communicate(input_)
+            except BaseException:
+                proc.kill()
+                raise
+        if check and proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, args, stdout, stderr)
+        return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+
+    def _confine(
+        self, pid: int, procs: Optional[str], nice: int, ioprio: Optional[int]
+    ) -> None:
+        """Move the process 'pid' into the cgroup, and lower its priority"""
+        if procs:
+            try:
+                with open(procs, "w") as fh:
+                    fh.write(str(pid))
+            except OSError as e:
+                # Rather run the install script unconfined
+                log.warning(f"Failed to move the process {pid} into {procs}: {e}")
+        try:
+            if nice:
+                niceness = os.getpriority(os.PRIO_PROCESS, pid)
+                os.setpriority(os.PRIO_PROCESS, pid, min(19, niceness + nice))
+            if ioprio is not None and not set_ioprio(ioprio, pid):
+                log.debug(f"Unable to set the I/O priority of the process {pid}")
+        except OSError as e:
+            log.warning(f"Unable to lower the priority of the process {pid}: {e}")
+
+    def release_cgroup(self) -> None:
+        """Remove the cgroup, once the install script, and its children, are done"""
+        if not self.cgroup:
+            return
+        try:
+            os.rmdir(self.cgroup)
+        except OSError as e:
+            log.debug(f"Unable to remove the cgroup {self.cgroup}: {e}")
+
+
+def _number(config, name: str, kind):
+    value = getattr(config, name)
+    try:
+        return kind(value or 0)
+    except (TypeError, ValueError):
+        log.error(f"Invalid {name}: {value}. Ignoring it")
+        return kind(0)
+
+
+def configure(config) -> Governor:
+    """Return the Governor given by the Update* settings of the configuration"""
+    if config.UpdateIOClass and config.UpdateIOClass not in IOPRIO_CLASSES:
+        log.error(
+            f"Invalid UpdateIOClass: {config.UpdateIOClass}. "
+            f"Available: {', '.join(IOPRIO_CLASSES)}"
+        )
+    limits = {
+        name: str(value)
+        for name, value in (
+            ("cpu.max", config.UpdateCPUMax),
+            ("io.max", config.UpdateIOMax),
+            ("memory.max", config.UpdateMemoryMax),
+        )
+        if value
+    }
+    return Governor(
+        nice=_number(config, "UpdateNice", int),
+        io_class=config.UpdateIOClass,
+        io_priority=_number(config, "UpdateIOPriority", int),
+        cgroup=config.UpdateCgroup,
+        cgroup_limits=limits,
+        max_load=_number(config, "UpdatePauseLoadAverage", float),
+        max_pressure=_number(config, "UpdatePausePressure", float),
+        max_pause=_number(config, "UpdatePauseMaxSeconds", float),
+    )
@@ -0,0 +1,239 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Write a rootfs-image payload straight to the inactive partition
+
+The image is written as it streams in from the Artifact, in large aligned
+blocks, optionally bypassing the page cache with O_DIRECT, and flushed to the
+device once at the end. Afterwards, the written data is read back from the
+device, and compared to what was written.
+"""
+import errno
+import hashlib
+import logging as log
+import mmap
+import os
+from typing import Optional
+
+import mender.artifact.artifact as artifact
+import mender.pipeline.pipeline as pipeline
+
+PAYLOAD_TYPE = "rootfs-image"
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# O_DIRECT requires the offset, length, and memory of a write to be aligned to
+# the logical block size of the device, which is at most the page size
+ALIGNMENT = mmap.PAGESIZE
+
+
+class InstallError(Exception):
+    pass
+
+
+def active_partition(part_a: str, part_b: str) -> Optional[str]:
+    """Return the partition mounted as the root filesystem, if one of them is"""
+    root_device = os.stat("/").st_dev
+    for part in (part_a, part_b):
+        try:
+            if part and os.stat(part).st_rdev == root_device:
+                return part
+        except OSError:
+            continue
+    return None
+
+
+def inactive_partition(part_a: str, part_b: str) -> Optional[str]:
+    """Return the partition not mounted as the root filesystem"""
+    active = active_partition(part_a, part_b)
+    if active is None:
+        log.error(
+            f"Unable to determine the active partition among {part_a} and {part_b}"
+        )
+        return None
+    return part_b if active == part_a else part_a
+
+
+class RootfsInstaller:
+    """Write an image to a block device, or a plain image file
+
+    Usage::
+
+      with RootfsInstaller("/dev/mmcblk0p3") as installer:
+          for data in stream:
+              installer.write(data)
+      installer.verify()
+    """
+
+    def __init__(
+        self,
+        device: str,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        direct: bool = False,
+    ):
+        if block_size % ALIGNMENT:
+            raise ValueError(f"The block size must be a multiple of {ALIGNMENT}")
+        self.device = device
+        self.block_size = block_size
+        self.direct = direct
+        self.fd = -1
+        # mmap'ed memory is page aligned, as required by O_DIRECT
+        self.buffer = mmap.mmap(-1, block_size)
+        self.buffered = 0
+        self.offset = 0
+        self.sha256 = hashlib.sha256()
+
+    def __enter__(self) -> "RootfsInstaller":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self) -> None:
+        flags = os.O_WRONLY
+        if not os.path.exists(self.device):
+            # A plain image file, for testing
+            flags |= os.O_CREAT
+        if self.direct and hasattr(os, "O_DIRECT"):
+            try:
+                self.fd = os.open(self.device, flags | os.O_DIRECT, 0o600)
+                log.info(f"Writing the rootfs to {self.device} with O_DIRECT")
+                return
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+                log.info(f"O_DIRECT is not supported for {self.device}")
+                self.direct = False
+        self.fd = os.open(self.device, flags, 0o600)
+        log.info(f"Writing the rootfs to {self.device}")
+
+    def write(self, data: bytes) -> None:
+        self.sha256.update(data)
+        view = memoryview(data)
+        while view:
+            n = min(len(view), self.block_size - self.buffered)
+            self.buffer[self.buffered : self.buffered + n] = view[:n]
+            self.buffered += n
+            view = view[n:]
+            if self.buffered == self.block_size:
+                self._flush_block(self.block_size)
+
+    def _flush_block(self, length: int) -> None:
+        written = 0
+        block = memoryview(self.buffer)[:length]
+        while written < length:
+            written += os.pwrite(self.fd, block[written:], self.offset + written)
+        block.release()
+        self.offset += length
+        self.buffered = 0
+
+    def close(self) -> None:
+        """Write the remaining data, and flush it all to the device, once"""
+        if self.buffered:
+            tail = self.buffered
+            aligned = tail - tail % ALIGNMENT
+            if aligned:
+                remainder = bytes(self.buffer[aligned:tail])
+                self._flush_block(aligned)
+            else:
+                remainder = bytes(self.buffer[:tail])
+            self.buffered = 0
+            if remainder:
+                self._write_unaligned(remainder)
+        os.fsync(self.fd)
+        os.close(self.fd)
+        self.fd = -1
+        log.info(f"Wrote {self.offset} bytes to {self.device}")
+
+    def _write_unaligned(self, data: bytes) -> None:
+        if self.direct:
+            # The unaligned tail can not be written with O_DIRECT
+            fd = os.open(self.device, os.O_WRONLY)
+            try:
+                os.pwrite(fd, data, self.offset)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        else:
+            os.pwrite(self.fd, data, self.offset)
+        self.offset += len(data)
+
+    def abort(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+    def verify(self) -> None:
+        """Read the written data back from the device, and compare it"""
+        sha256 = hashlib.sha256()
+        fd = os.open(self.device, os.O_RDONLY)
+        try:
+            if hasattr(os, "posix_fadvise"):
+                # Read from the device, and not the page cache
+                os.posix_fadvise(fd, 0, self.offset, os.POSIX_FADV_DONTNEED)
+            remaining = self.offset
+            while remaining:
+                data = os.read(fd, min(remaining, self.block_size))
+                if not data:
+                    break
+                sha256.update(data)
+                remaining -= len(data)
+        finally:
+            os.close(fd)
+        if sha256.hexdigest() != self.hexdigest():
+            raise InstallError(
+                f"The data read back from {self.device} does not match the written data"
+            )
+        log.info(f"Verified the {self.offset} bytes written to {self.device}")
+
+
+def install(
+    reader: artifact.Reader,
+    device: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    direct: bool = False,
+) -> None:
+    """Stream the rootfs-image payload of the Artifact from 'reader' to 'device'
+
+    Raises InstallError, or artifact.ArtifactError, on failure.
+    """
+    header = reader.header or reader.read_header()
+    if header.payload_type(0) != PAYLOAD_TYPE:
+        raise InstallError(
+            f"Unsupported payload type: {header.payload_type(0)}. "
+            f"Only {PAYLOAD_TYPE} can be written to the partition"
+        )
+    files = 0
+    installer = RootfsInstaller(device, block_size, direct)
+    for payload_file in reader.payload_files():
+        files += 1
+        if payload_file.index != 0 or files > 1:
+            raise InstallError("A rootfs-image Artifact must have a single file")
+        # The writes to the device overlap the reads, and the verification
+        with installer, pipeline.Stage("write", installer.write) as writer:
+            while True:
+                data = payload_file.read(block_size)
+                if not data:
+                    break
+                writer.put(data)
+    if not files:
+        raise InstallError("The Artifact has no rootfs image")
+    # The payload checksum was verified by the reader against the manifest, and
+    # the reader and the installer saw the same bytes
+    installer.verify()
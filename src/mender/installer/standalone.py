@@ -0,0 +1,257 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Install an Artifact from a local file, or a URL, without a Mender server
+
+This is the 'install' command, for provisioning devices in the factory, and at
+offline sites, from a local mirror. The Artifact takes the same paths as in a
+deployment: the signature and the compatibility are checked, a rootfs-image is
+streamed straight to the inactive partition if RootfsStreamInstall is set, and
+the work runs under the resource controls of the configuration.
+"""
+import logging as log
+import os.path
+import sys
+import threading
+import time
+from typing import Callable, Dict, Optional, TextIO
+
+import mender.artifact.artifact as artifact
+import mender.client.deployments as deployments
+import mender.datastore.datastore as datastore
+import mender.governor.governor as governor
+import mender.installer.rootfs as rootfs
+import mender.pipeline.pipeline as pipeline
+import mender.scripts.runner as installscriptrunner
+import mender.settings.settings as settings
+import mender.statemachine.statemachine as statemachine
+
+# How often the progress is printed, in seconds
+PROGRESS_INTERVAL = 1.0
+
+MiB = 1024 * 1024
+
+
+class Progress:
+    """Print the bytes transferred, and the throughput, every 'interval' seconds
+
+    The lines are printed from a thread of its own, while in the 'with' block,
+    at a steady pace whatever the size of the chunks the bytes are counted in::
+
+      with Progress(total) as progress:
+          download(..., on_received=progress.update)
+      progress.finish()
+    """
+
+    def __init__(
+        self,
+        total: Optional[int] = None,
+        out: TextIO = sys.stderr,
+        interval: float = PROGRESS_INTERVAL,
+    ):
+        self.total = total
+        self.out = out
+        self.interval = interval
+        self.done = 0
+        self.start = time.monotonic()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "Progress":
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._print, name="progress", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _print(self) -> None:
+        while not self._stop.wait(self.interval):
+            print(self.line(time.monotonic()), file=self.out, flush=True)
+
+    def update(self, done: int) -> None:
+        self.done = done
+
+    def line(self, now: float) -> str:
+        line = f"{self.done / MiB:.1f} MiB"
+        if self.total:
+            percent = 100 * self.done // self.total
+            line += f" / {self.total / MiB:.1f} MiB ({percent}%)"
+        return line + f", {self.throughput(now) / MiB:.1f} MiB/s"
+
+    def throughput(self, now: float) -> float:
+        return self.done / max(now - self.start, 1e-6)
+
+    def finish(self) -> None:
+        now = time.monotonic()
+        print(
+            f"Transferred {self.done / MiB:.1f} MiB in {now - self.start:.1f}s "
+            f"({self.throughput(now) / MiB:.1f} MiB/s)",
+            file=self.out,
+            flush=True,
+        )
+
+
+def is_url(source: str) -> bool:
+    return source.startswith(("http://", "https://"))
+
+
+def stream_partition(config, header: artifact.Header) -> Optional[str]:
+    """The partition to stream the rootfs-image in the Artifact to, if any"""
+    if not config.RootfsStreamInstall:
+        return None
+    if header.payload_type(0) != rootfs.PAYLOAD_TYPE:
+        return None
+    return rootfs.inactive_partition(config.RootfsPartA, config.RootfsPartB)
+
+
+def install(
+    source: str,
+    config,
+    provides: Optional[Dict[str, str]] = None,
+    out: TextIO = sys.stderr,
+) -> bool:
+    """Install the Artifact at 'source', a path, or an http(s) URL
+
+    'provides' describes the device, for the compatibility check, and defaults
+    to the installed Artifact, and the device type. The progress is printed to
+    'out'.
+    """
+    if provides is None:
+        provides = statemachine.device_provides()
+    verify = statemachine.artifact_verifier(config)
+    update_governor = governor.configure(config)
+    with update_governor.lowered_priority():
+        if is_url(source):
+            target = fetch(source, config, provides, verify, update_governor.pause, out)
+        else:
+            target = read(source, config, provides, verify, out)
+    if not target:
+        return False
+    # There is no deployment, and thus no lockfile, nor anything for
+    # 'mender report' to report
+    return installscriptrunner.run_sub_updater(None, target, update_governor)
+
+
+def read(
+    path: str,
+    config,
+    provides: Dict[str, str],
+    verify: Optional[deployments.Verify],
+    out: TextIO,
+) -> Optional[str]:
+    """Check the local Artifact at 'path', and stream its rootfs-image, if set to
+
+    Returns the partition the rootfs-image was written to, or 'path', for the
+    install script to install from.
+    """
+    try:
+        progress = Progress(os.path.getsize(path), out)
+        with progress, open(path, "rb") as fh, pipeline.Prefetcher(
+            "read", fh, deployments.MAX_CHUNK_SIZE, progress=progress.update
+        ) as raw:
+            reader = artifact.Reader(raw, verify=verify)
+            header = reader.read_header()
+            artifact.check_compatibility(header, provides)
+            partition = stream_partition(config, header)
+            if partition:
+                rootfs.install(reader, partition, direct=config.RootfsDirectIO)
+            elif verify:
+                # The payload checksums are verified as they are read
+                for _ in reader.payload_files():
+                    pass
+    except (artifact.ArtifactError, rootfs.InstallError, OSError) as e:
+        log.error(f"Failed to install the Artifact {path}: {e}")
+        return None
+    if partition or verify:
+        progress.finish()
+    return partition or path
+
+
+def fetch(
+    url: str,
+    config,
+    provides: Dict[str, str],
+    verify: Optional[deployments.Verify],
+    pause: Callable[[], float],
+    out: TextIO,
+) -> Optional[str]:
+    """Download the Artifact at 'url', the way a deployment is downloaded
+
+    Returns the partition the rootfs-image was streamed to, or the path of the
+    downloaded Artifact.
+    """
+    deployment = deployments.DeploymentInfo(
+        {"id": "", "artifact": {"artifact_name": "", "source": {"uri": url}}}
+    )
+    try:
+        checked = deployments.preflight(
+            deployment, config.ServerCertificate, verify=verify
+        )
+        if checked:
+            artifact.check_compatibility(checked[0], provides)
+    except artifact.ArtifactError as e:
+        log.error(f"The Artifact {url} can not be installed: {e}")
+        return None
+    progress = Progress(checked[1] if checked else None, out)
+    limits = statemachine.download_limits(config)
+    # Without the header, the compatibility is checked once downloaded
+    partition = stream_partition(config, checked[0]) if checked else None
+    if partition:
+        with progress:
+            streamed = deployments.download_rootfs(
+                deployment,
+                partition,
+                config.ServerCertificate,
+                direct=config.RootfsDirectIO,
+                verify=verify,
+                pause=pause,
+                progress=progress.update,
+                **limits,
+            )
+        if not streamed:
+            return None
+        progress.finish()
+        return partition
+    artifact_path = os.path.join(settings.PATHS.artifact_download, "artifact.mender")
+    # The previous Artifact may be a hardlink into the cache
+    datastore.remove(artifact_path)
+    with progress:
+        downloaded = deployments.download(
+            deployment,
+            artifact_path,
+            config.ServerCertificate,
+            verify=verify,
+            pause=pause,
+            on_received=progress.update,
+            **limits,
+        )
+    if not downloaded:
+        return None
+    progress.update(os.path.getsize(artifact_path))
+    progress.finish()
+    if not checked:
+        try:
+            with open(artifact_path, "rb") as fh:
+                header = artifact.Reader(fh).read_header()
+            artifact.check_compatibility(header, provides)
+        except (artifact.ArtifactError, OSError) as e:
+            log.error(f"The Artifact {url} can not be installed: {e}")
+            datastore.remove(artifact_path)
+            return None
+    return artifact_path
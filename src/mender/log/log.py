@@ -11,30 +11,52 @@
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
+import datetime
+import json
 import logging as log
 import logging.handlers
 import os
 import os.path
+from typing import List, Optional
 
 import mender.settings.settings as settings
 
 
+def _timestamp(created: float) -> str:
+    return datetime.datetime.utcfromtimestamp(created).isoformat() + "Z"
+
+
+class DeploymentLogFormatter(logging.Formatter):
+    """Format the records as the JSON messages of the deployment log API"""
+
+    def format(self, record):
+        return json.dumps(
+            {
+                "timestamp": _timestamp(record.created),
+                "level": record.levelname,
+                "message": record.getMessage(),
+            }
+        )
+
+
 class DeploymentLogHandler(logging.FileHandler):
     def __init__(self):
         self.enabled = False
         self.log_dir = settings.PATHS.deployment_log
         filename = os.path.join(self.log_dir, "deployment.log")
         super().__init__(filename=filename)
+        self.setFormatter(DeploymentLogFormatter())
 
     def handle(self, record):
         if self.enabled:
             super().handle(record)
 
-    def enable(self):
+    def enable(self, reset=True):
         self.enabled = True
         filename = os.path.join(self.log_dir, "deployment.log")
-        # Reset the log file
-        super().__init__(filename, mode="w")
+        # Reset the log file, unless resuming a deployment
+        super().__init__(filename, mode="w" if reset else "a")
+        self.setFormatter(DeploymentLogFormatter())
 
     def disable(self):
         self.enabled = False
@@ -50,3 +72,28 @@ def add_sub_updater_log(log_file):
             f"The log_file: {log_file} was not found.\
             No logs from the sub-updater will be reported."
         )
+
+
+def read_deployment_log(log_file: Optional[str] = None) -> List[dict]:
+    """Return the messages of the deployment log, as sent to the server"""
+    log_file = log_file or os.path.join(settings.PATHS.deployment_log, "deployment.log")
+    messages = []
+    try:
+        with open(log_file) as fh:
+            for line in fh:
+                line = line.rstrip("\n")
+                if not line:
+                    continue
+                try:
+                    messages.append(json.loads(line))
+                except ValueError:
+                    messages.append(
+                        {
+                            "timestamp": _timestamp(os.path.getmtime(log_file)),
+                            "level": "INFO",
+                            "message": line,
+                        }
+                    )
+    except FileNotFoundError:
+        log.error(f"The deployment log: {log_file} was not found")
+    return messages
@@ -11,18 +11,25 @@
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
+# pylint: disable=import-outside-toplevel
+#
+# The modules pulling in requests and cryptography are imported by the commands
+# which need them, and not at the top of this file, so that commands like
+# 'show-artifact' start fast, and do not pay for them. This is guarded by
+# tests/unit/test_mender.py, and can be measured with
+# tests/benchmark/importtime.py
 import argparse
 import logging as log
+import logging.handlers
+import os.path
 import sys
 
-import mender.bootstrap.bootstrap as bootstrap
-import mender.client.authorize as authorize
-import mender.client.deployments as deployments
 import mender.settings.settings as settings
-import mender.statemachine.statemachine as statemachine
 
 
 def run_daemon(args):
+    import mender.statemachine.statemachine as statemachine
+
     log.info("Running daemon...")
     if args.data:
         log.info(f"Data store set to: {args.data}")
@@ -41,6 +48,8 @@ def show_artifact(_):
 
 
 def run_bootstrap(args):
+    import mender.bootstrap.bootstrap as bootstrap
+
     log.info("Bootstrapping...")
     if args.data:
         log.info(f"Custom data store set to: {args.data}")
@@ -55,20 +64,26 @@ def run_version(_):
 
 
 def report(args):
-    context = statemachine.Context()
-    context = statemachine.Init().run(context)
-    jwt = authorize.request(
-        context.config.ServerURL,
-        context.config.TenantToken,
-        context.identity_data,
-        context.private_key,
-        context.config.ServerCertificate,
-    )
-    if not jwt:
-        log.error("Failed to authorize with the Mender server")
+    import sqlite3
+
+    import mender.client.deployments as deployments
+    import mender.log.log as menderlog
+    import mender.oneshot.oneshot as oneshot
+    import mender.outbox.outbox as outbox
+
+    if args.data:
+        settings.PATHS = settings.Path(data_store=args.data)
+    if args.success:
+        log.info("Reporting a successful update to the Mender server")
+        status = deployments.STATUS_SUCCESS
+    elif args.failure:
+        log.info("Reporting a failed update to the Mender server")
+        status = deployments.STATUS_FAILURE
+    else:
+        log.error("No report status given")
         sys.exit(1)
     try:
-        with open(settings.Path().lockfile_path) as f:
+        with open(settings.PATHS.lockfile_path) as f:
             deployment_id = f.read()
             if not deployment_id:
                 log.error("No deployment ID found in the lockfile")
@@ -76,33 +91,135 @@ def report(args):
     except FileNotFoundError:
         log.error("No update in progress...")
         sys.exit(1)
-    if args.success:
-        log.info("Reporting a successful update to the Mender server")
-        if not deployments.report(
-            context.config.ServerURL,
-            deployments.STATUS_SUCCESS,
-            deployment_id,
-            context.config.ServerCertificate,
-            jwt,
-        ):
-            log.error("Failed to report the update status to the Mender server")
-            sys.exit(1)
-    elif args.failure:
-        log.info("Reporting a failed update to the Mender server")
-        if not deployments.report(
-            context.config.ServerURL,
-            deployments.STATUS_FAILURE,
-            deployment_id,
+    context = oneshot.load()
+    try:
+        # Queue the report first, so that the daemon delivers it if this fails
+        box = outbox.Outbox(settings.PATHS.outbox)
+        box.status(deployment_id, status)
+        if status == deployments.STATUS_FAILURE:
+            box.log(deployment_id, menderlog.read_deployment_log())
+        delivered = oneshot.with_authorization(
+            context,
+            lambda JWT: box.flush(
+                lambda report: deployments.deliver(
+                    context.server_url,
+                    context.config.ServerCertificate,
+                    JWT,
+                    report,
+                )
+            ),
+        )
+    except sqlite3.Error as e:
+        # Such as a locked, read-only, or corrupt database
+        log.error(f"Failed to use the report outbox {settings.PATHS.outbox}: {e}")
+        sys.exit(1)
+    if not delivered:
+        log.error(
+            "Failed to report the update status to the Mender server. "
+            "The daemon will retry delivering it"
+        )
+        sys.exit(1)
+
+
+def check_update(args):
+    import mender.client.deployments as deployments
+    import mender.oneshot.oneshot as oneshot
+    import mender.scripts.artifactinfo as artifactinfo
+    import mender.scripts.devicetype as devicetype
+
+    if args.data:
+        settings.PATHS = settings.Path(data_store=args.data)
+    context = oneshot.load()
+    device_type = devicetype.get(settings.PATHS.device_type)
+    artifact_name = artifactinfo.get(settings.PATHS.artifact_info)
+    deployment = oneshot.with_authorization(
+        context,
+        lambda JWT: deployments.request(
+            context.server_url,
+            JWT,
+            device_type=device_type,
+            artifact_name=artifact_name,
+            server_certificate=context.config.ServerCertificate,
+        ),
+    )
+    if not deployment:
+        print("No update available")
+        return
+    print(f"deployment_id={deployment.ID}")
+    print(f"artifact_name={deployment.artifact_name}")
+    print(f"artifact_uri={deployment.artifact_uri}")
+
+
+def send_inventory(args):
+    import mender.client.inventory as client_inventory
+    import mender.oneshot.oneshot as oneshot
+    import mender.scripts.aggregator.inventory as inventory
+
+    if args.data:
+        settings.PATHS = settings.Path(data_store=args.data)
+    context = oneshot.load()
+    inventory_data = inventory.aggregate(
+        settings.PATHS.inventory_scripts,
+        settings.PATHS.device_type,
+        settings.PATHS.artifact_info,
+        plugin_path=settings.PATHS.plugins,
+        enabled_collectors=context.config.InventoryCollectors,
+    )
+    if not oneshot.with_authorization(
+        context,
+        lambda JWT: client_inventory.request(
+            context.server_url,
+            JWT,
+            inventory_data,
             context.config.ServerCertificate,
-            jwt,
-        ):
-            log.error("Failed to report the update status to the Mender server")
-            sys.exit(1)
-    else:
-        log.error("No report status given")
+        ),
+    ):
+        log.error("Failed to upload the inventory to the Mender server")
         sys.exit(1)
 
 
+def install(args):
+    import mender.installer.standalone as standalone
+    import mender.oneshot.oneshot as oneshot
+
+    if args.data:
+        settings.PATHS = settings.Path(data_store=args.data)
+    context = oneshot.load()
+    log.info(f"Installing the Artifact {args.artifact}")
+    if not standalone.install(args.artifact, context.config):
+        log.error(f"Failed to install the Artifact {args.artifact}")
+        sys.exit(1)
+    log.info("The Artifact is installed")
+
+
+def run_simulator(args):
+    import mender.simulator.simulator as simulator
+
+    log.info(f"Simulating {args.devices} devices against {args.server_url}")
+    behavior = simulator.Behavior(
+        inventory_interval=args.inventory_interval,
+        update_interval=args.update_interval,
+        retry_interval=args.retry_interval,
+        jitter=args.jitter,
+        install_failure_rate=args.install_failure_rate,
+        download=not args.no_download,
+        device_type=args.device_type,
+    )
+    stats = simulator.run(
+        args.devices,
+        args.duration,
+        args.server_url,
+        tenant_token=args.tenant_token,
+        server_certificate=args.server_certificate,
+        behavior=behavior,
+        processes=args.processes,
+        workers=args.workers,
+        keys=args.keys,
+        key_dir=args.data if os.path.isdir(args.data) else None,
+    )
+    print(stats.report(args.duration))
+
+
 def setup_log(args):
     level = {
         "debug": log.DEBUG,
@@ -115,7 +232,7 @@ def setup_log(args):
     handlers.append(log.StreamHandler())
     # TODO - setup this for the device, see:
     # https://docs.python.org/3/library/logging.handlers.html#sysloghandler
-    syslogger = log.NullHandler() if args.no_syslog else log.handlers.SysLogHandler()
+    syslogger = log.NullHandler() if args.no_syslog else logging.handlers.SysLogHandler()
     handlers.append(syslogger)
     if args.log_file:
         handlers.append(log.FileHandler(args.log_file))
@@ -148,6 +265,15 @@ def main():
         help="Print the current Artifact name to the command line and exit.",
     )
     show_artifact_parser.set_defaults(func=show_artifact)
+    check_update_parser = subcommand_parser.add_parser(
+        "check-update",
+        help="Check for an update once, print the deployment if any, and exit.",
+    )
+    check_update_parser.set_defaults(func=check_update)
+    send_inventory_parser = subcommand_parser.add_parser(
+        "send-inventory", help="Upload the inventory once and exit."
+    )
+    send_inventory_parser.set_defaults(func=send_inventory)
     report_parser = subcommand_parser.add_parser(
         "report", help="Report the update status",
     )
@@ -164,6 +290,74 @@ def main():
         default=False,
         action="store_true",
     )
+    install_parser = subcommand_parser.add_parser(
+        "install",
+        help="Install an Artifact from a file, or a URL, without the Mender "
+        "server, and exit.",
+    )
+    install_parser.set_defaults(func=install)
+    install_parser.add_argument(
+        "artifact", help="Path, or http(s) URL, of the Artifact", metavar="ARTIFACT"
+    )
+    simulate_parser = subcommand_parser.add_parser(
+        "simulate",
+        help="Simulate a fleet of devices against a Mender server, and print "
+        "the request latency and error statistics.",
+    )
+    simulate_parser.set_defaults(func=run_simulator)
+    simulate_parser.add_argument(
+        "--server-url", required=True, help="URL of the Mender server"
+    )
+    simulate_parser.add_argument("--tenant-token", default="", help="Tenant token")
+    simulate_parser.add_argument(
+        "--server-certificate", default="", help="Server certificate FILE"
+    )
+    simulate_parser.add_argument(
+        "--devices", type=int, default=100, help="Number of virtual devices"
+    )
+    simulate_parser.add_argument(
+        "--duration", type=float, default=60, help="Seconds to run the simulation"
+    )
+    simulate_parser.add_argument(
+        "--processes", type=int, default=1, help="Number of processes"
+    )
+    simulate_parser.add_argument(
+        "--workers", type=int, default=32, help="Request threads per process"
+    )
+    simulate_parser.add_argument(
+        "--keys",
+        type=int,
+        default=1,
+        help="Number of RSA keys shared among the devices. "
+        "The keys are stored in the data DIRECTORY",
+    )
+    simulate_parser.add_argument(
+        "--inventory-interval", type=float, default=28800, help="Seconds"
+    )
+    simulate_parser.add_argument(
+        "--update-interval", type=float, default=1800, help="Seconds"
+    )
+    simulate_parser.add_argument(
+        "--retry-interval", type=float, default=300, help="Seconds"
+    )
+    simulate_parser.add_argument(
+        "--jitter", type=float, default=0.1, help="Random fraction of an interval"
+    )
+    simulate_parser.add_argument(
+        "--install-failure-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the updates reported as failed",
+    )
+    simulate_parser.add_argument(
+        "--no-download",
+        default=False,
+        action="store_true",
+        help="Report the update statuses without downloading the Artifact",
+    )
+    simulate_parser.add_argument(
+        "--device-type", default="simulated-device", help="Device type"
+    )
     #
     # Options
     #
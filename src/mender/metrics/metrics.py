@@ -0,0 +1,352 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import contextlib
+import logging as log
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Registry:
+    """Holds all the metrics exported by the client
+
+    A disabled registry drops every update on the floor, so that the
+    instrumentation costs no more than a function call and an attribute lookup.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.metrics: List["Metric"] = []
+
+    def register(self, metric: "Metric") -> None:
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        """Render all the metrics in the Prometheus text exposition format"""
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        for metric in self.metrics:
+            metric.reset()
+
+
+# Global singleton
+REGISTRY = Registry()
+
+
+def _format_labels(labels: LabelSet) -> str:
+    if not labels:
+        return ""
+    escaped = []
+    for k, v in labels:
+        v = v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{k}="{v}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, registry: Optional[Registry] = None
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.registry = registry or REGISTRY
+        self._lock = threading.Lock()
+        self._values: Dict[LabelSet, float] = {}
+        self.registry.register(self)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+            for labels, value in values
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not self.registry.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not self.registry.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+        registry: Optional[Registry] = None,
+    ):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._observations: Dict[LabelSet, List[float]] = {}
+        super().__init__(name, documentation, registry)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._observations = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        if not self.registry.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # Layout: [bucket counts..., sum]
+            obs = self._observations.get(key)
+            if obs is None:
+                obs = self._observations[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    obs[i] += 1
+                    break
+            obs[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the wall-clock duration of the with-block in seconds"""
+        if not self.registry.enabled:
+            yield
+            return
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        obs = self._observations.get(tuple(sorted(labels.items())))
+        return sum(obs[:-1]) if obs else 0
+
+    def sum(self, **labels: str) -> float:
+        obs = self._observations.get(tuple(sorted(labels.items())))
+        return obs[-1] if obs else 0.0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            observations = sorted(
+                (labels, list(obs)) for labels, obs in self._observations.items()
+            )
+        lines = []
+        for labels, obs in observations:
+            cumulative = 0
+            for bound, count in zip(self.buckets, obs):
+                cumulative += count
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {obs[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+#
+# The metrics exported by the client
+#
+
+STATE_DURATION = Histogram(
+    "mender_state_duration_seconds", "Time spent running a state-machine state."
+)
+STATE_TRANSITIONS = Counter(
+    "mender_state_transitions_total", "Number of state-machine states entered."
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "mender_http_request_duration_seconds",
+    "Latency of the requests to the Mender server, per endpoint.",
+)
+HTTP_REQUESTS = Counter(
+    "mender_http_requests_total",
+    "Number of requests to the Mender server, per endpoint and status code.",
+)
+SERVER_LATENCY = Gauge(
+    "mender_server_latency_seconds",
+    "Moving average of the latency of the requests to each Mender server.",
+)
+SERVER_SWITCHES = Counter(
+    "mender_server_switches_total", "Number of switches to another Mender server."
+)
+HTTP_BYTES_SENT = Counter(
+    "mender_http_sent_bytes_total", "Number of request body bytes sent, per endpoint."
+)
+DOWNLOAD_BYTES = Counter(
+    "mender_download_bytes_total", "Number of Artifact bytes downloaded."
+)
+DOWNLOAD_THROUGHPUT = Gauge(
+    "mender_download_throughput_bytes_per_second",
+    "Average throughput of the last Artifact download.",
+)
+PEER_BYTES = Counter(
+    "mender_peer_bytes_total",
+    "Number of Artifact bytes served to, and downloaded from, the peers, "
+    "per direction.",
+)
+DOWNLOAD_STALLS = Counter(
+    "mender_download_stalls_total",
+    "Number of Artifact downloads aborted for progressing too slowly.",
+)
+PIPELINE_QUEUE_DEPTH = Gauge(
+    "mender_pipeline_queue_depth",
+    "Number of chunks waiting in front of a download pipeline stage, per stage.",
+)
+UPDATE_PAUSED_SECONDS = Counter(
+    "mender_update_paused_seconds_total",
+    "Time the downloads spent paused, waiting for the device to be less busy.",
+)
+RETRIES = Counter(
+    "mender_retries_total", "Number of retried operations, per operation."
+)
+SCRIPT_DURATION = Histogram(
+    "mender_script_duration_seconds",
+    "Runtime of the identity and inventory scripts, per script.",
+)
+
+
+#
+# Exporters
+#
+
+
+def write_textfile(path: str, registry: Registry = REGISTRY) -> None:
+    """Atomically write the metrics to 'path' for the node_exporter textfile collector"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fh:
+        fh.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+class _TextfileWriter(threading.Thread):
+    def __init__(self, path: str, interval: float, registry: Registry):
+        super().__init__(name="metrics-textfile", daemon=True)
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+
+    def run(self) -> None:
+        while True:
+            try:
+                write_textfile(self.path, self.registry)
+            except OSError as e:
+                log.error(f"Failed to write the metrics textfile {self.path}: {e}")
+            time.sleep(self.interval)
+
+
+def serve(address: str, port: int, registry: Registry = REGISTRY):
+    """Serve the metrics on http://address:port/metrics from a background thread"""
+    # pylint: disable=import-outside-toplevel
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            log.debug(f"metrics: {self.address_string()} {format % args}")
+
+    server = HTTPServer((address, port), Handler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="metrics-http", daemon=True
+    )
+    thread.start()
+    return server
+
+
+_exporters_started = False
+
+
+def configure(config, registry: Registry = REGISTRY) -> None:
+    """Enable the registry, and start the exporters, as given by the configuration"""
+    global _exporters_started  # pylint: disable=global-statement
+    registry.enabled = bool(config.MetricsEnabled)
+    if not registry.enabled:
+        log.debug("Metrics are disabled")
+        return
+    if _exporters_started:
+        return
+    _exporters_started = True
+    if config.MetricsTextfile:
+        log.info(f"Writing metrics to the textfile: {config.MetricsTextfile}")
+        _TextfileWriter(
+            config.MetricsTextfile,
+            float(config.MetricsExportIntervalSeconds),
+            registry,
+        ).start()
+    if config.MetricsListenAddress:
+        host, _, port = config.MetricsListenAddress.rpartition(":")
+        try:
+            serve(host or "127.0.0.1", int(port), registry)
+            log.info(f"Serving metrics on http://{host}:{port}/metrics")
+        except (OSError, ValueError) as e:
+            log.error(
+                f"Failed to serve metrics on {config.MetricsListenAddress}: {e}"
+            )
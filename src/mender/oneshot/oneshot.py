@@ -0,0 +1,129 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Support for the one-shot commands (check-update, send-inventory, report)
+
+The one-shot commands reuse the identity data, and the JWT, stored in the data
+store by the daemon, so that a command costs a single request to the server.
+Only if the stored state is missing, or the server rejects the stored JWT, is
+the identity script run, the key loaded, and a new JWT requested.
+"""
+# pylint: disable=import-outside-toplevel
+import logging as log
+from typing import Callable, Optional, TypeVar
+
+import mender.client
+import mender.client.servers as servers
+import mender.config.config as config
+import mender.datastore.datastore as datastore
+import mender.settings.settings as settings
+from mender.client import HTTPUnathorized
+
+T = TypeVar("T")
+
+
+class Context:
+    """The subset of the state-machine context needed by the one-shot commands"""
+
+    def __init__(self):
+        self.config = config.Config({}, {})
+        self.identity_data: Optional[dict] = None
+        # The server which issued the JWT
+        self.server_url = ""
+        self.JWT: Optional[str] = None
+        # True if the JWT was requested by this command, and not loaded
+        self.fresh_JWT = False
+
+
+def load() -> Context:
+    """Load the configuration, and the identity data and JWT from the data store"""
+    context = Context()
+    try:
+        context.config = config.load(
+            local_path=settings.PATHS.local_conf,
+            global_path=settings.PATHS.global_conf,
+        )
+    except config.NoConfigurationFileError:
+        log.error("No configuration files found for the device.")
+    mender.client.configure(context.config)
+    context.identity_data = datastore.read_json(settings.PATHS.identity_data)
+    context.JWT = datastore.read(settings.PATHS.authtoken)
+    server_url = datastore.read(settings.PATHS.auth_server)
+    if server_url in servers.SERVERS.urls:
+        context.server_url = server_url
+    else:
+        context.server_url = servers.SERVERS.select()
+    return context
+
+
+def authorize(context: Context) -> bool:
+    """Request a new JWT, and store it for subsequent commands to reuse"""
+    import mender.bootstrap.bootstrap as bootstrap
+    import mender.client.authorize as client_authorize
+    import mender.scripts.aggregator.identity as identity
+
+    if not context.identity_data:
+        context.identity_data = identity.aggregate(
+            path=settings.PATHS.identity_scripts, plugin_path=settings.PATHS.plugins
+        )
+        datastore.write_json(settings.PATHS.identity_data, context.identity_data)
+    private_key = bootstrap.key_already_generated(settings.PATHS.key)
+    if not private_key:
+        private_key = bootstrap.now(private_key_path=settings.PATHS.key)
+    # The preferred server first, and the others if it fails
+    for server_url in servers.SERVERS.candidates() or [""]:
+        context.JWT = client_authorize.request(
+            server_url,
+            context.config.TenantToken,
+            context.identity_data,
+            private_key,
+            context.config.ServerCertificate,
+            cache_path=settings.PATHS.auth_request,
+        )
+        if context.JWT:
+            context.server_url = server_url
+            break
+    if not context.JWT:
+        return False
+    context.fresh_JWT = True
+    datastore.write(settings.PATHS.authtoken, context.JWT)
+    datastore.write(settings.PATHS.auth_server, context.server_url)
+    return True
+
+
+def with_authorization(context: Context, request: Callable[[str], T]) -> Optional[T]:
+    """Run 'request' with the stored JWT, and re-authorize if it is rejected
+
+    'request' is given the JWT, and signals a rejected JWT by raising
+    HTTPUnathorized. The request is then retried once with a new JWT, unless
+    the JWT used was just issued. Any other failure is returned as is, as a new
+    JWT would not help. Returns None if no JWT was accepted.
+    """
+    if not context.JWT and not authorize(context):
+        log.error("Failed to authorize with the Mender server")
+        return None
+    try:
+        return request(context.JWT)
+    except HTTPUnathorized:
+        if context.fresh_JWT:
+            log.error("The Mender server rejected the new JWT")
+            return None
+    log.info("The stored JWT was not accepted. Re-authorizing...")
+    if not authorize(context):
+        log.error("Failed to authorize with the Mender server")
+        return None
+    try:
+        return request(context.JWT)
+    except HTTPUnathorized:
+        log.error("The Mender server rejected the new JWT")
+        return None
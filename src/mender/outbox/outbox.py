@@ -0,0 +1,223 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Durable outbox for the deployment status and log reports
+
+The reports are stored in an SQLite database in the data store, and delivered
+to the server from a background thread, so that the state-machine never waits
+on the server, and a report survives a lost connection, and a restart of the
+client. A status replaces the status for the same deployment still waiting to
+be delivered, as the server only needs the latest.
+"""
+import json
+import logging as log
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+import mender.metrics.metrics as metrics
+
+KIND_STATUS = "status"
+KIND_LOG = "log"
+
+BATCH_SIZE = 50
+MIN_BACKOFF = 5
+MAX_BACKOFF = 600
+# How often the outbox is checked for reports added by other processes, such as
+# the one-shot report command, while the worker has nothing to do
+IDLE_INTERVAL = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    deployment_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+class Report:
+    def __init__(self, ID: int, deployment_id: str, kind: str, payload: Any):
+        self.ID = ID
+        self.deployment_id = deployment_id
+        self.kind = kind
+        self.payload = payload
+
+    def __repr__(self):
+        return f"Report({self.ID}, {self.deployment_id}, {self.kind})"
+
+
+# Delivers a report, and returns True once the server has it, or has rejected it
+# for good, and False if it is to be retried
+Sender = Callable[[Report], bool]
+
+
+class Outbox:
+    """The reports waiting to be delivered, stored in the database at 'path'
+
+    Usage::
+
+      box = Outbox(settings.PATHS.outbox)
+      box.start(send)
+      box.status(deployment_id, "downloading")
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute(_SCHEMA)
+        self._worker: Optional["_Worker"] = None
+
+    def close(self) -> None:
+        self.stop()
+        with self._lock:
+            self._db.close()
+
+    def _add(self, deployment_id: str, kind: str, payload: Any) -> None:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Only the latest report of a kind is of interest to the server
+                self._db.execute(
+                    "DELETE FROM reports WHERE deployment_id = ? AND kind = ?",
+                    (deployment_id, kind),
+                )
+                self._db.execute(
+                    "INSERT INTO reports (deployment_id, kind, payload, created) "
+                    "VALUES (?, ?, ?, ?)",
+                    (deployment_id, kind, json.dumps(payload), time.time()),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        self.wake()
+
+    def wake(self) -> None:
+        """Deliver the queued reports now, rather than after the retry backoff"""
+        if self._worker:
+            self._worker.wake()
+
+    def status(self, deployment_id: str, status: str) -> None:
+        """Queue the deployment status, replacing the one waiting, if any"""
+        self._add(deployment_id, KIND_STATUS, {"status": status})
+
+    def log(self, deployment_id: str, messages: List[dict]) -> None:
+        """Queue the deployment log, replacing the one waiting, if any"""
+        self._add(deployment_id, KIND_LOG, {"messages": messages})
+
+    def pending(self, limit: int = -1) -> List[Report]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, deployment_id, kind, payload FROM reports "
+                "ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [Report(ID, d, k, json.loads(p)) for ID, d, k, p in rows]
+
+    def _delivered(self, report: Report) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM reports WHERE id = ?", (report.ID,))
+
+    def _failed(self, report: Report) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE reports SET attempts = attempts + 1 WHERE id = ?",
+                (report.ID,),
+            )
+
+    def flush(self, send: Sender, batch_size: int = BATCH_SIZE) -> bool:
+        """Deliver the reports in order, and return True if all were delivered
+
+        The delivery stops at the first report which fails, as the following
+        ones are then likely to fail as well.
+        """
+        while True:
+            reports = self.pending(batch_size)
+            if not reports:
+                return True
+            for report in reports:
+                if not send(report):
+                    self._failed(report)
+                    return False
+                self._delivered(report)
+                log.debug(f"Delivered {report}")
+
+    def start(self, send: Sender) -> None:
+        """Deliver the reports from a background thread, retrying with backoff"""
+        if self._worker is None:
+            self._worker = _Worker(self, send)
+            self._worker.start()
+
+    def stop(self) -> None:
+        if self._worker:
+            self._worker.stop()
+            self._worker = None
+
+
+class _Worker(threading.Thread):
+    def __init__(
+        self,
+        outbox: Outbox,
+        send: Sender,
+        min_backoff: Optional[float] = None,
+        max_backoff: Optional[float] = None,
+    ):
+        super().__init__(name="outbox", daemon=True)
+        self.outbox = outbox
+        self.send = send
+        self.min_backoff = min_backoff or MIN_BACKOFF
+        self.max_backoff = max_backoff or MAX_BACKOFF
+        self._wake = threading.Event()
+        self._stopped = False
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._wake.set()
+        self.join()
+
+    def run(self) -> None:
+        backoff = self.min_backoff
+        timeout: float = 0
+        while True:
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._stopped:
+                return
+            try:
+                delivered = self.outbox.flush(self.send)
+            except Exception as e:  # pylint: disable=broad-except
+                log.error(f"Failed to deliver the queued reports: {e}")
+                delivered = False
+            if delivered:
+                backoff = self.min_backoff
+                timeout = IDLE_INTERVAL
+                continue
+            metrics.RETRIES.inc(operation="report")
+            # Spread the retries of a fleet coming back online
+            timeout = backoff * random.uniform(0.5, 1.0)
+            backoff = min(backoff * 2, self.max_backoff)
+            log.info(f"Retrying the delivery of the queued reports in {timeout:.0f}s")
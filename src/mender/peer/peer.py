@@ -0,0 +1,175 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Share the cached Artifacts with the other devices on the local network
+
+A device with PeerListenAddress set serves the Artifacts in its cache, by the
+sha256 of their manifest, on http://<address>/artifacts/<digest>, honouring
+Range requests. A device with PeerURLs set tries to download an Artifact from
+those peers, in order, before the Artifact URI of the deployment.
+
+The peers are not trusted: the Artifact downloaded from a peer is verified
+against the manifest digest, which comes from the header fetched from the
+server, and the checksums of the payloads in the manifest, before it is used.
+"""
+import logging as log
+import os
+import os.path
+import re
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import List, Optional
+
+import mender.cache.cache as artifactcache
+import mender.client.deployments as deployments
+import mender.datastore.datastore as datastore
+import mender.metrics.metrics as metrics
+
+_PATH_RE = re.compile(r"^/artifacts/([0-9a-f]{64})$")
+_RANGE_RE = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    """http.server.ThreadingHTTPServer, which requires Python 3.7"""
+
+    daemon_threads = True
+
+
+def artifact_url(peer: str, digest: str) -> str:
+    return f"{peer.rstrip('/')}/artifacts/{digest}"
+
+
+def serve(
+    cache: artifactcache.ArtifactCache, address: str, port: int
+) -> HTTPServer:
+    """Serve the Artifacts in 'cache' on http://address:port from a background thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            m = _PATH_RE.match(self.path)
+            path = cache.lookup(m.group(1)) if m else None
+            try:
+                fh = open(path, "rb") if path else None
+            except OSError:
+                fh = None
+            if fh is None:
+                self.send_error(404)
+                return
+            with fh:
+                self._send(fh, os.fstat(fh.fileno()).st_size)
+
+        def _send(self, fh, size: int) -> None:
+            start, end = 0, size - 1
+            m = _RANGE_RE.match(self.headers.get("Range") or "")
+            if m:
+                start = int(m.group(1))
+                end = min(int(m.group(2)), end) if m.group(2) else end
+                if start > end:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+            length = end - start + 1
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(length))
+            self.end_headers()
+            if not length:
+                return
+            try:
+                sent = self.connection.sendfile(fh, start, length)
+            except OSError as e:
+                log.debug(f"peer: {self.address_string()} went away: {e}")
+                return
+            metrics.PEER_BYTES.inc(sent, direction="served")
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            log.debug(f"peer: {self.address_string()} {format % args}")
+
+    server = _Server((address, port), Handler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="peer-http", daemon=True
+    )
+    thread.start()
+    return server
+
+
+def fetch(
+    peers: List[str],
+    digest: str,
+    artifact_path: str,
+    server_certificate: str,
+    verify: Optional[deployments.Verify] = None,
+    **kwargs,
+) -> bool:
+    """Download the Artifact with the manifest 'digest' from the first peer having it
+
+    The Artifact is verified against 'digest', and with 'verify', as it is
+    downloaded. 'kwargs' are passed on to deployments.download(). Returns False,
+    leaving nothing at 'artifact_path', if no peer provided a valid Artifact,
+    whatever the peers served.
+    """
+    for peer in peers:
+        url = artifact_url(peer, digest)
+        log.info(f"Trying to download the Artifact from the peer: {peer}")
+        deployment = deployments.DeploymentInfo(
+            {"id": "", "artifact": {"artifact_name": "", "source": {"uri": url}}}
+        )
+        try:
+            valid = deployments.download(
+                deployment,
+                artifact_path,
+                server_certificate,
+                verify=verify,
+                digest=digest,
+                **kwargs,
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            # Nothing a peer serves may fail the update, which falls back to
+            # the server
+            log.error(f"Failed to download the Artifact from the peer {peer}: {e}")
+            valid = False
+        if valid:
+            metrics.PEER_BYTES.inc(
+                os.path.getsize(artifact_path), direction="downloaded"
+            )
+            log.info(f"Downloaded the Artifact from the peer: {peer}")
+            return True
+        datastore.remove(artifact_path)
+    return False
+
+
+_server: Optional[HTTPServer] = None
+
+
+def configure(config, cache: Optional[artifactcache.ArtifactCache]) -> None:
+    """Start serving the Artifact cache, as given by the configuration"""
+    global _server  # pylint: disable=global-statement
+    if not config.PeerListenAddress or _server is not None:
+        return
+    if cache is None:
+        log.error("Sharing the Artifacts with the peers requires ArtifactCacheSizeMB")
+        return
+    host, _, port = config.PeerListenAddress.rpartition(":")
+    try:
+        _server = serve(cache, host or "0.0.0.0", int(port))
+        log.info(f"Sharing the cached Artifacts with the peers on {host}:{port}")
+    except (OSError, ValueError) as e:
+        log.error(f"Failed to share the Artifacts on {config.PeerListenAddress}: {e}")
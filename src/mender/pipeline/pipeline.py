@@ -0,0 +1,242 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Overlap the stages of a download in threads, connected by bounded queues
+
+A download goes through up to three stages: reading from the network,
+verifying, and decompressing, the Artifact, and writing to the disk. Run one
+after the other, the network sits idle while the disk is busy, and the other
+way around. Instead, the network reads are prefetched by a Prefetcher thread,
+and the writes are handed to a Stage thread, so that all three stages run at
+once. Socket reads, disk writes, hashlib, and zlib, all release the GIL.
+
+The queues between the stages hold at most QUEUE_DEPTH chunks, which bounds the
+memory used, and makes a fast stage wait for a slow one. The number of chunks
+waiting in each queue is exported as the mender_pipeline_queue_depth metric:
+the stage after a full queue is the bottleneck.
+"""
+import io
+import queue
+import threading
+from typing import Any, BinaryIO, Callable, Optional
+
+import mender.metrics.metrics as metrics
+
+# The number of chunks a queue between two stages holds
+QUEUE_DEPTH = 4
+
+# Marks the end of the chunks in a queue
+_END = object()
+
+
+class _Failure:
+    """An exception raised in a stage, forwarded through the queue"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class Stage:
+    """Feed the chunks given to put() to 'consume', in a thread of its own
+
+    An exception raised by 'consume' is raised again by the next put(), or by
+    close(). Usage::
+
+      with Stage("write", fh.write) as writer:
+          for data in response.iter_content(chunk_size):
+              writer.put(data)
+    """
+
+    def __init__(
+        self, name: str, consume: Callable[[Any], None], depth: int = QUEUE_DEPTH
+    ):
+        self.name = name
+        self.consume = consume
+        self.queue: queue.Queue = queue.Queue(depth)
+        self.error: Optional[BaseException] = None
+        self._thread = threading.Thread(
+            target=self._run, name=f"pipeline-{name}", daemon=True
+        )
+
+    def __enter__(self) -> "Stage":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._stop()
+
+    def _run(self) -> None:
+        while True:
+            chunk = self.queue.get()
+            metrics.PIPELINE_QUEUE_DEPTH.set(self.queue.qsize(), stage=self.name)
+            if chunk is _END:
+                return
+            if self.error is not None:
+                continue  # Drain the queue, so that put() does not block
+            try:
+                self.consume(chunk)
+            except BaseException as e:  # pylint: disable=broad-except
+                self.error = e
+
+    def put(self, chunk: Any) -> None:
+        if self.error is not None:
+            raise self.error
+        self.queue.put(chunk)
+        metrics.PIPELINE_QUEUE_DEPTH.set(self.queue.qsize(), stage=self.name)
+
+    def _stop(self) -> None:
+        self.queue.put(_END)
+        self._thread.join()
+
+    def close(self) -> None:
+        """Wait for the chunks put so far to be consumed"""
+        self._stop()
+        if self.error is not None:
+            raise self.error
+
+
+class _QueueReader(io.RawIOBase):
+    """A file object reading the chunks in 'queue', up to _END"""
+
+    def __init__(self, name: str, chunks: queue.Queue):
+        super().__init__()
+        self.name = name
+        self.queue = chunks
+        self.eof = False
+        self._buffer = memoryview(b"")
+        self._error: Optional[BaseException] = None
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        """Fill 'b', short only at the end of the data, or before an error"""
+        filled = 0
+        while filled < len(b):
+            if not self._buffer:
+                if self._error is not None and not filled:
+                    error, self._error = self._error, None
+                    raise error
+                if self.eof:
+                    break
+                item = self.queue.get()
+                metrics.PIPELINE_QUEUE_DEPTH.set(self.queue.qsize(), stage=self.name)
+                if item is _END or isinstance(item, _Failure):
+                    self.eof = True
+                    if isinstance(item, _Failure):
+                        # Raised once the data read before it is returned
+                        self._error = item.error
+                    continue
+                self._buffer = memoryview(item)
+            n = min(len(b) - filled, len(self._buffer))
+            b[filled : filled + n] = self._buffer[:n]
+            self._buffer = self._buffer[n:]
+            filled += n
+        return filled
+
+
+class StreamStage(Stage):
+    """Like Stage, but 'consume' is called once, with a file object to read from
+
+    Usage::
+
+      with StreamStage("verify", lambda f: artifact.Reader(f).read_header()) as v:
+          for data in response.iter_content(chunk_size):
+              v.put(data)
+    """
+
+    def _run(self) -> None:
+        fileobj = _QueueReader(self.name, self.queue)
+        try:
+            self.consume(fileobj)
+        except BaseException as e:  # pylint: disable=broad-except
+            self.error = e
+        # Drain what 'consume' did not read, so that put() does not block
+        while not fileobj.eof and self.queue.get() is not _END:
+            pass
+        metrics.PIPELINE_QUEUE_DEPTH.set(0, stage=self.name)
+
+
+class Prefetcher(_QueueReader):
+    """Read 'fileobj' ahead, in 'chunk_size' chunks, from a thread of its own
+
+    The exceptions raised reading 'fileobj' are raised again by read() here, in
+    order. 'pause', if given, is called before every read, and 'progress' after
+    it, with the number of bytes read so far. Usage::
+
+      with Prefetcher("verify", response.raw, 64 * 1024) as fileobj:
+          artifact.Reader(fileobj)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fileobj: BinaryIO,
+        chunk_size: int,
+        depth: int = QUEUE_DEPTH,
+        pause: Optional[Callable[[], Any]] = None,
+        progress: Optional[Callable[[int], Any]] = None,
+    ):
+        super().__init__(name, queue.Queue(depth))
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.progress = progress
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"pipeline-{name}", daemon=True
+        )
+
+    def __enter__(self) -> "Prefetcher":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _put(self, item: Any) -> bool:
+        """Queue 'item', unless the reader went away"""
+        while not self._stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            metrics.PIPELINE_QUEUE_DEPTH.set(self.queue.qsize(), stage=self.name)
+            return True
+        return False
+
+    def _run(self) -> None:
+        done = 0
+        while True:
+            try:
+                if self.pause:
+                    self.pause()
+                data = self.fileobj.read(self.chunk_size)
+                if data and self.progress:
+                    done += len(data)
+                    self.progress(done)
+            except BaseException as e:  # pylint: disable=broad-except
+                self._put(_Failure(e))
+                return
+            if not data:
+                self._put(_END)
+                return
+            if not self._put(data):
+                return
+
+    def close(self) -> None:
+        self._stopped.set()
+        super().close()
@@ -11,65 +11,167 @@
 #    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
+import io
 import logging as log
+import os
+import os.path
+import signal
 import subprocess
+import tempfile
+import threading
+import time
 
-from typing import Dict, List
+from typing import BinaryIO, Dict, List
+
+import mender.metrics.metrics as metrics
+
+# The limits on the output of a single script, or file, keeping the memory used
+# by a misbehaving script bounded
+MAX_OUTPUT_SIZE = 1024 * 1024
+MAX_KEYS = 1024
+# How long a script is given to finish, in seconds
+SCRIPT_TIMEOUT = 100
+
+
+class ScriptOutputError(Exception):
+    """The output exceeds the limits"""
+
+
+def read_key_values(
+    fileobj: BinaryIO,
+    unique_keys: bool = False,
+    max_size: int = MAX_OUTPUT_SIZE,
+    max_keys: int = MAX_KEYS,
+) -> Dict[str, List[str]]:
+    """Parse the 'key=value' lines read from 'fileobj', one line at a time
+
+    Only the first '=' separates the key from the value. Raises
+    ScriptOutputError if more than 'max_size' bytes, or more than 'max_keys'
+    different keys, are read.
+    """
+    vals: Dict[str, List[str]] = {}
+    remaining = max_size
+    while True:
+        # Never buffer more than the remaining allowance, even without newlines
+        raw = fileobj.readline(remaining + 1)
+        if not raw:
+            return vals
+        remaining -= len(raw)
+        if remaining < 0:
+            raise ScriptOutputError(f"More than {max_size} bytes of output")
+        line = raw.decode(errors="replace").strip()
+        if line == "":
+            continue
+        key, sep, val = line.partition("=")
+        if not sep or not key:
+            log.debug(f"Skipping line without a key=value pair: {line}")
+            continue
+        if key not in vals and len(vals) >= max_keys:
+            raise ScriptOutputError(f"More than {max_keys} keys")
+        if unique_keys:
+            vals[key] = [val]
+        else:
+            vals.setdefault(key, []).append(val)
 
 
 class ScriptKeyValueAggregator:
     """Handles the parsing of the output from any Mender identity of inventory scripts.
 
     These scripts support key=value pairs, with one output per line maximum.
-    Multiple lines with a matching key are aggregated into an array."""
+    Multiple lines with a matching key are aggregated into an array. The output
+    is parsed as it is read, and limited to 'max_size' bytes, and 'max_keys'
+    keys."""
 
-    def __init__(self, script_path: str):
+    def __init__(
+        self,
+        script_path: str,
+        max_size: int = MAX_OUTPUT_SIZE,
+        max_keys: int = MAX_KEYS,
+        timeout: float = SCRIPT_TIMEOUT,
+    ):
         self.script_path = script_path
+        self.max_size = max_size
+        self.max_keys = max_keys
+        self.timeout = timeout
         self.vals: Dict[str, List[str]] = {}
 
     def run(self) -> dict:
-        try:
-            output = subprocess.run(
-                self.script_path,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=100,
-                check=True,
-            )
-            data = output.stdout.decode()
-            return self.parse(data)
-        except subprocess.CalledProcessError as e:
-            errout = ", stderr: " + e.stderr.decode() if e.stderr else ""
-            log.error(
-                f"Failed to aggregate key-value pairs from {self.script_path}.\
-                Script returned: {e.returncode}{errout}"
-            )
-            return {}
-        log.error("Unhandled error occurred in the script key-value aggregator")
-        return {}
+        self.vals = {}
+        with tempfile.TemporaryFile() as stderr, metrics.SCRIPT_DURATION.time(
+            script=os.path.basename(self.script_path)
+        ):
+            try:
+                # In a session of its own, so that the processes it started,
+                # and which hold on to its output, are killed with it
+                proc = subprocess.Popen(
+                    self.script_path,
+                    stdout=subprocess.PIPE,
+                    stderr=stderr,
+                    start_new_session=True,
+                )
+            except OSError as e:
+                log.error(f"Failed to run {self.script_path}: {e}")
+                return {}
+            timed_out = threading.Event()
 
-    def collect(self, unique_keys: bool = False) -> Dict[str, List[str]]:
-        with open(self.script_path) as fh:
-            data = fh.read()
-            return self.parse(data, unique_keys)
+            def kill():
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
 
-    def parse(self, data: str, unique_keys: bool = False) -> Dict[str, List[str]]:
-        for line in data.split("\n"):
-            if line == "":
-                continue
-            arr = line.strip().split("=")
-            if len(arr) < 2:
-                log.debug("Skipping line without output")
-                continue
-            if len(arr) > 2:
+            def expire():
+                timed_out.set()
+                kill()
+
+            deadline = time.monotonic() + self.timeout
+            timer = threading.Timer(self.timeout, expire)
+            timer.start()
+            try:
+                vals = read_key_values(
+                    proc.stdout, max_size=self.max_size, max_keys=self.max_keys
+                )
+            except ScriptOutputError as e:
+                kill()
+                log.error(f"Ignoring the output of {self.script_path}: {e}")
+                return {}
+            finally:
+                timer.cancel()
+                proc.stdout.close()
+                # The script may close its output, and keep running
+                try:
+                    returncode = proc.wait(max(0, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    expire()
+                    returncode = proc.wait()
+            if timed_out.is_set():
+                log.error(f"{self.script_path} timed out after {self.timeout}s")
+                return {}
+            if returncode != 0:
+                stderr.seek(0)
+                errout = stderr.read(4096).decode(errors="replace")
+                errout = ", stderr: " + errout if errout else ""
                 log.error(
-                    f"script: {self.script_path} output line: {line}\
-                    is improperly formatted with more than one '=' sign. Skipping."
+                    f"Failed to aggregate key-value pairs from {self.script_path}. "
+                    f"Script returned: {returncode}{errout}"
                 )
-                continue
-            key, val = arr[0], arr[1]
-            if unique_keys:
-                self.vals[key] = [val]
-            else:
-                self.vals.setdefault(key, []).append(val)
+                return {}
+        self.vals = vals
+        return self.vals
+
+    def collect(self, unique_keys: bool = False) -> Dict[str, List[str]]:
+        with open(self.script_path, "rb") as fh:
+            return self._read(fh, unique_keys)
+
+    def parse(self, data: str, unique_keys: bool = False) -> Dict[str, List[str]]:
+        return self._read(io.BytesIO(data.encode()), unique_keys)
+
+    def _read(self, fileobj: BinaryIO, unique_keys: bool) -> Dict[str, List[str]]:
+        try:
+            self.vals = read_key_values(
+                fileobj, unique_keys, max_size=self.max_size, max_keys=self.max_keys
+            )
+        except ScriptOutputError as e:
+            log.error(f"Ignoring the contents of {self.script_path}: {e}")
+            self.vals = {}
         return self.vals
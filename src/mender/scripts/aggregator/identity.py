@@ -16,11 +16,13 @@ import os
 import logging as log
 
 from mender.scripts.aggregator.aggregator import ScriptKeyValueAggregator
+import mender.scripts.aggregator.plugins as plugins
 
 
-def aggregate(path=""):
-    """Runs the identity script in 'path', and parses the 'key=value' pairs
-    into a data-structure ready for passing it on to the Mender server"""
+def aggregate(path="", plugin_path=""):
+    """Runs the identity script in 'path', and the identity plugins, and parses
+    the 'key=value' pairs into a data-structure ready for passing it on to the
+    Mender server"""
     log.info("Aggregating the device identity attributes...")
     log.debug(f"Aggregating from: {path}")
     identity_data = {}
@@ -31,5 +33,7 @@ def aggregate(path=""):
             log.error("The identity-script at {path} is not accessible")
     else:
         log.error(f"{path} not found. No identity can be collected")
+    for plugin in plugins.plugins(plugins.IDENTITY, plugin_path):
+        identity_data.update(plugin.run())
     log.debug(f"Aggregated identity data: {identity_data}")
     return identity_data
@@ -15,20 +15,40 @@
 import logging as log
 import os
 import os.path as path
-from typing import List
+from typing import List, Sequence
 
 from mender.scripts.aggregator.aggregator import ScriptKeyValueAggregator
+import mender.scripts.aggregator.plugins as plugins
+import mender.scripts.collectors as collectors
 import mender.scripts.artifactinfo as artifactinfo
 import mender.scripts.devicetype as devicetype
 
 
-def aggregate(script_path: str, device_type_path: str, artifact_info_path: str) -> dict:
-    """Runs all the inventory scripts in 'path', and parses the 'key=value' pairs
-    into a data-structure ready for passing it on to the Mender server"""
+def aggregate(
+    script_path: str,
+    device_type_path: str,
+    artifact_info_path: str,
+    plugin_path: str = "",
+    enabled_collectors: Sequence[str] = (),
+) -> dict:
+    """Runs all the inventory scripts in 'path', the inventory plugins, and the
+    built-in collectors enabled, and parses the 'key=value' pairs into a
+    data-structure ready for passing it on to the Mender server
+
+    The scripts replaced by the enabled collectors are not run."""
     log.info(f"Aggregating inventory data from {script_path}")
     keyvals: dict = {}
+    builtin = collectors.enabled(enabled_collectors)
+    replaced = {collectors.SCRIPT_PREFIX + name for name, _ in builtin}
     for inventory_script in inventory_scripts(script_path):
+        if path.basename(inventory_script.script_path) in replaced:
+            log.debug(f"{inventory_script.script_path} is replaced by a collector")
+            continue
         keyvals.update(inventory_script.run())
+    for name, collector in builtin:
+        keyvals.update(plugins.PluginAggregator(f"collector {name}", collector).run())
+    for plugin in plugins.plugins(plugins.INVENTORY, plugin_path):
+        keyvals.update(plugin.run())
     device_type = devicetype.get(device_type_path)
     log.info(f"Found the device type: {device_type}")
     if device_type:
@@ -0,0 +1,279 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Inventory, and identity, providers running as Python callables in the daemon
+
+A plugin is a callable taking no arguments, and returning the attributes as a
+dictionary of strings, or lists of strings. Plugins are found in:
+
+* The entry points in the 'mender.inventory', and 'mender.identity', groups of
+  the installed packages
+* The '*.py' modules in the plugin directory (/usr/share/mender/plugins),
+  defining an 'inventory', and/or an 'identity', function
+
+Plugins are run next to the scripts, in a thread of their own, and are subject
+to the same timeout and output limits as the scripts. A plugin raising an
+exception, timing out, or returning too much data, is ignored for the cycle. A
+plugin which has timed out is not run again until its previous run returns.
+
+Loading a plugin, importing its module, is subject to the same timeout, as the
+module level code of a plugin can hang just as well as its function.
+"""
+import functools
+import importlib.util
+import logging as log
+import os
+import os.path
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+import mender.metrics.metrics as metrics
+from mender.scripts.aggregator.aggregator import (
+    MAX_KEYS,
+    MAX_OUTPUT_SIZE,
+    SCRIPT_TIMEOUT,
+    ScriptOutputError,
+)
+
+INVENTORY = "inventory"
+IDENTITY = "identity"
+
+ENTRY_POINT_GROUPS = {INVENTORY: "mender.inventory", IDENTITY: "mender.identity"}
+
+Plugin = Callable[[], Dict[str, Any]]
+
+# The plugin modules loaded from the plugin directory, by path, with their mtime
+_modules: Dict[str, Tuple[float, Any]] = {}
+# The plugins loaded from the entry points, by name
+_loaded: Dict[str, Plugin] = {}
+# The plugin runs which have timed out, and are still running
+_hung: Dict[str, threading.Thread] = {}
+_lock = threading.Lock()
+
+
+class PluginTimeout(Exception):
+    """The plugin did not return in time"""
+
+
+def normalize(
+    data: Dict[str, Any], max_size: int = MAX_OUTPUT_SIZE, max_keys: int = MAX_KEYS
+) -> Dict[str, List[str]]:
+    """Return the attributes as lists of strings, like the scripts' attributes
+
+    Raises ScriptOutputError if the attributes exceed the limits of the scripts.
+    """
+    if not isinstance(data, dict):
+        raise ScriptOutputError(f"Expected a dictionary, got {type(data).__name__}")
+    if len(data) > max_keys:
+        raise ScriptOutputError(f"More than {max_keys} keys")
+    vals: Dict[str, List[str]] = {}
+    size = 0
+    for key, value in data.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        vals[str(key)] = [str(v) for v in values]
+        # The size of the attributes as 'key=value' lines
+        size += sum(len(key) + len(v) + 2 for v in vals[str(key)])
+        if size > max_size:
+            raise ScriptOutputError(f"More than {max_size} bytes of attributes")
+    return vals
+
+
+class PluginAggregator:
+    """Run the plugin 'function', with the interface of ScriptKeyValueAggregator"""
+
+    def __init__(
+        self,
+        name: str,
+        function: Plugin,
+        max_size: int = MAX_OUTPUT_SIZE,
+        max_keys: int = MAX_KEYS,
+        timeout: float = SCRIPT_TIMEOUT,
+    ):
+        self.name = name
+        self.function = function
+        self.max_size = max_size
+        self.max_keys = max_keys
+        self.timeout = timeout
+
+    def __repr__(self) -> str:
+        return f"PluginAggregator({self.name})"
+
+    def run(self) -> Dict[str, List[str]]:
+        if _busy(self.name):
+            log.error(f"The plugin {self.name} is still running. Skipping it")
+            return {}
+        try:
+            with metrics.SCRIPT_DURATION.time(script=self.name):
+                data = _call(self.name, self.function, self.timeout)
+        except PluginTimeout:
+            log.error(f"The plugin {self.name} timed out after {self.timeout}s")
+            return {}
+        except Exception as e:  # pylint: disable=broad-except
+            log.error(f"The plugin {self.name} failed: {e}")
+            return {}
+        try:
+            return normalize(data, self.max_size, self.max_keys)
+        except ScriptOutputError as e:
+            log.error(f"Ignoring the attributes from the plugin {self.name}: {e}")
+            return {}
+
+
+def _call(name: str, function: Callable[[], Any], timeout: float) -> Any:
+    """Call 'function' in a thread of its own, and return its result
+
+    Raises PluginTimeout if it does not return within 'timeout' seconds, and
+    whatever 'function' raises.
+    """
+    result: Dict[str, Any] = {}
+
+    def target():
+        try:
+            result["data"] = function()
+        except Exception as e:  # pylint: disable=broad-except
+            result["error"] = e
+
+    thread = threading.Thread(target=target, name=f"plugin {name}")
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        # A thread can not be killed. Keep track of it instead
+        _track(name, thread)
+        raise PluginTimeout(f"Timed out after {timeout}s")
+    if "error" in result:
+        raise result["error"]
+    return result.get("data")
+
+
+def _load(name: str, load: Callable[[], Any], timeout: float) -> Any:
+    """Load the plugin 'name' with 'load', within 'timeout' seconds
+
+    Returns None if loading the plugin failed, timed out, or the previous load,
+    which has timed out, is still running.
+    """
+    if _busy(name):
+        log.error(f"The plugin {name} is still loading. Skipping it")
+        return None
+    try:
+        return _call(name, load, timeout)
+    except PluginTimeout:
+        log.error(f"Loading the plugin {name} timed out after {timeout}s")
+    except Exception as e:  # pylint: disable=broad-except
+        log.error(f"Failed to load the plugin {name}: {e}")
+    return None
+
+
+def _track(name: str, thread: threading.Thread) -> None:
+    with _lock:
+        _hung[name] = thread
+
+
+def _busy(name: str) -> bool:
+    with _lock:
+        thread = _hung.get(name)
+        if thread is not None and not thread.is_alive():
+            del _hung[name]
+            thread = None
+        return thread is not None
+
+
+@functools.lru_cache(maxsize=None)
+def _entry_points(kind: str) -> Tuple[Any, ...]:
+    """Return the entry points of the plugins of 'kind'
+
+    The installed packages are only scanned once, as installing a plugin
+    requires restarting the daemon anyway.
+    """
+    # pylint: disable=import-outside-toplevel
+    try:
+        from importlib.metadata import entry_points as find
+    except ImportError:  # Python < 3.8
+        try:
+            from importlib_metadata import entry_points as find  # type: ignore
+        except ImportError:
+            return ()
+    group = ENTRY_POINT_GROUPS[kind]
+    found = find()
+    if hasattr(found, "select"):
+        return tuple(found.select(group=group))
+    return tuple(found.get(group, []))
+
+
+def entry_points(
+    kind: str, timeout: float = SCRIPT_TIMEOUT
+) -> Tuple[Tuple[str, Plugin], ...]:
+    """Return the plugins of 'kind' registered as entry points
+
+    An entry point is loaded until it loads successfully, once per cycle.
+    """
+    providers = []
+    for ep in _entry_points(kind):
+        name = f"{ENTRY_POINT_GROUPS[kind]}:{ep.name}"
+        with _lock:
+            function = _loaded.get(name)
+        if function is None:
+            function = _load(name, ep.load, timeout)
+            if function is None:
+                continue
+            with _lock:
+                _loaded[name] = function
+        providers.append((name, function))
+    return tuple(providers)
+
+
+def _load_module(path: str):
+    """Load, or reload if it changed, the plugin module at 'path'"""
+    mtime = os.stat(path).st_mtime
+    with _lock:
+        loaded = _modules.get(path)
+        if loaded and loaded[0] == mtime:
+            return loaded[1]
+    name = "mender_plugin_" + os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)  # type: ignore
+    with _lock:
+        _modules[path] = (mtime, module)
+    return module
+
+
+def directory_plugins(
+    kind: str, plugin_dir: str, timeout: float = SCRIPT_TIMEOUT
+) -> List[Tuple[str, Plugin]]:
+    """Return the plugins of 'kind' defined by the modules in 'plugin_dir'"""
+    if not plugin_dir or not os.path.isdir(plugin_dir):
+        return []
+    providers = []
+    for f in sorted(os.listdir(plugin_dir)):
+        path = os.path.join(plugin_dir, f)
+        if not f.endswith(".py") or not os.path.isfile(path):
+            continue
+        module = _load(path, functools.partial(_load_module, path), timeout)
+        function = getattr(module, kind, None)
+        if callable(function):
+            providers.append((path, function))
+    return providers
+
+
+def plugins(
+    kind: str, plugin_dir: str, timeout: float = SCRIPT_TIMEOUT
+) -> List[PluginAggregator]:
+    """Return all the plugins of 'kind', INVENTORY or IDENTITY
+
+    :param timeout: the timeout of loading, and of running, each plugin
+    """
+    return [
+        PluginAggregator(name, function, timeout=timeout)
+        for name, function in list(entry_points(kind, timeout))
+        + directory_plugins(kind, plugin_dir, timeout)
+    ]
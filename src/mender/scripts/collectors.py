@@ -0,0 +1,285 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Built-in inventory collectors, replacing the inventory scripts in support/
+
+Each collector produces the same attributes as the script of the same name
+(mender-inventory-<name>), by reading the kernel interfaces, and files, directly
+instead of spawning processes. The collectors are enabled one by one through
+the InventoryCollectors setting, and the matching scripts are then skipped.
+"""
+import fnmatch
+import glob
+import logging as log
+import os
+import os.path
+import re
+import socket
+import struct
+from typing import Callable, Dict, List, Optional, Tuple
+
+Attributes = Dict[str, List[str]]
+
+SCRIPT_PREFIX = "mender-inventory-"
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, errors="replace") as fh:
+            return fh.read()
+    except OSError:
+        return None
+
+
+def _first_line(data: Optional[str]) -> str:
+    """The value a script echoing "key=$(cat file)" ends up with"""
+    return (data or "").rstrip("\n").split("\n")[0]
+
+
+def hostinfo(
+    cpuinfo: str = "/proc/cpuinfo",
+    version: str = "/proc/version",
+    meminfo: str = "/proc/meminfo",
+    hostname: str = "/etc/hostname",
+) -> Attributes:
+    attributes: Attributes = {}
+    previous = None
+    for line in (_read(cpuinfo) or "").splitlines():
+        # grep 'model name' | uniq | awk -F': ' '{print $2}'
+        if "model name" not in line or line == previous:
+            continue
+        previous = line
+        fields = line.split(": ")
+        attributes.setdefault("cpu_model", []).append(
+            fields[1] if len(fields) > 1 else ""
+        )
+    attributes["kernel"] = [_first_line(_read(version))]
+    for line in (_read(meminfo) or "").splitlines():
+        if "MemTotal" in line:
+            fields = line.split()
+            match = re.match(r"\d+", fields[1] if len(fields) > 1 else "")
+            attributes.setdefault("mem_total_kB", []).append(
+                match.group() if match else "0"
+            )
+    attributes["hostname"] = [_first_line(_read(hostname))]
+    return attributes
+
+
+# Netlink, for listing the addresses without running 'ip addr show'
+RTM_GETADDR = 22
+RTM_NEWADDR = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+
+_NLMSGHDR = struct.Struct("=IHHII")
+_IFADDRMSG = struct.Struct("=BBBBI")
+_RTATTR = struct.Struct("=HH")
+
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def addresses() -> List[Tuple[int, int, str]]:
+    """Return the (interface index, family, address/prefix) of all the addresses
+
+    The addresses are listed in the order of the kernel, like 'ip addr show'.
+    """
+    result = []
+    with socket.socket(
+        socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE
+    ) as sock:
+        request = _NLMSGHDR.pack(
+            _NLMSGHDR.size + _IFADDRMSG.size,
+            RTM_GETADDR,
+            NLM_F_REQUEST | NLM_F_DUMP,
+            1,
+            0,
+        ) + _IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+        sock.sendto(request, (0, 0))
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + _NLMSGHDR.size <= len(data):
+                length, kind, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+                if kind == NLMSG_DONE:
+                    return result
+                if kind == NLMSG_ERROR:
+                    raise OSError("Netlink error while listing the addresses")
+                if kind == RTM_NEWADDR:
+                    message = data[offset + _NLMSGHDR.size : offset + length]
+                    result.append(_parse_address(message))
+                offset += _align(length)
+
+
+def _parse_address(message: bytes) -> Tuple[int, int, str]:
+    family, prefix, _, _, index = _IFADDRMSG.unpack_from(message)
+    attributes = {}
+    offset = _IFADDRMSG.size
+    while offset + _RTATTR.size <= len(message):
+        length, kind = _RTATTR.unpack_from(message, offset)
+        if length < _RTATTR.size:
+            break
+        attributes[kind] = message[offset + _RTATTR.size : offset + length]
+        offset += _align(length)
+    # 'ip' shows the local address, which only differs on point-to-point links
+    address = attributes.get(IFA_LOCAL, attributes.get(IFA_ADDRESS, b""))
+    return index, family, f"{socket.inet_ntop(family, address)}/{prefix}"
+
+
+def network(
+    sys_class_net: str = "/sys/class/net",
+    list_addresses: Callable[[], List[Tuple[int, int, str]]] = addresses,
+) -> Attributes:
+    attributes: Attributes = {}
+    try:
+        found = list_addresses()
+    except (OSError, AttributeError, ValueError) as e:
+        # AttributeError: AF_NETLINK is only available on Linux
+        log.error(f"Failed to list the network addresses: {e}")
+        found = []
+    by_name: Dict[str, List[Tuple[int, str]]] = {}
+    for index, family, address in found:
+        try:
+            by_name.setdefault(socket.if_indextoname(index), []).append(
+                (family, address)
+            )
+        except OSError:
+            continue
+    for devpath in sorted(glob.glob(os.path.join(sys_class_net, "*"))):
+        dev = os.path.basename(devpath)
+        if dev == "lo":
+            continue
+        mac = _read(os.path.join(devpath, "address"))
+        if mac and mac.strip("\n"):
+            attributes.setdefault(f"mac_{dev}", []).append(_first_line(mac))
+        attributes.setdefault("network_interfaces", []).append(dev)
+        # 'ip addr show' lists the IPv4 addresses of an interface first
+        for family, key in ((socket.AF_INET, "ipv4"), (socket.AF_INET6, "ipv6")):
+            for address_family, address in by_name.get(dev, []):
+                if address_family == family:
+                    attributes.setdefault(f"{key}_{dev}", []).append(address)
+    return attributes
+
+
+_OS_RELEASE = re.compile(r'^(PRETTY_NAME|NAME|VERSION)=(?:"([^"]*)"|([^" ]*))')
+
+
+def _unquote(value: str) -> str:
+    if len(value) > 1 and value[0] == value[-1] == "'":
+        return value[1:-1]
+    return value
+
+
+def os_name(
+    os_release: Tuple[str, ...] = ("/etc/os-release", "/usr/lib/os-release"),
+    lsb_release: str = "/etc/lsb-release",
+    issue: str = "/etc/issue",
+) -> Attributes:
+    # The variables carry over from one file to the next, as in the script
+    variables: Dict[str, str] = {}
+    for path in os_release:
+        data = _read(path)
+        if data is None:
+            continue
+        for line in data.splitlines():
+            match = _OS_RELEASE.match(line)
+            if match:
+                quoted, plain = match.group(2), match.group(3)
+                variables[match.group(1)] = (
+                    quoted if quoted is not None else _unquote(plain)
+                )
+        if variables.get("PRETTY_NAME"):
+            return {"os": [variables["PRETTY_NAME"]]}
+        if variables.get("NAME") and variables.get("VERSION"):
+            return {"os": [f"{variables['NAME']} {variables['VERSION']}"]}
+    # What 'lsb_release -sd' prints
+    for line in (_read(lsb_release) or "").splitlines():
+        if line.startswith("DISTRIB_DESCRIPTION="):
+            description = line.partition("=")[2].strip('"')
+            if description:
+                return {"os": [description]}
+    description = _first_line(_read(issue))
+    if description:
+        return {"os": [description]}
+    return {"os": ["unknown"]}
+
+
+def rootfs_type(mounts: str = "/proc/mounts") -> Attributes:
+    for line in (_read(mounts) or "").splitlines():
+        if " / " in line and not line.startswith("rootfs"):
+            fields = line.split()
+            if len(fields) > 2:
+                return {"rootfs_type": [fields[2]]}
+    return {"rootfs_type": ["Unknown"]}
+
+
+def bootloader_integration(
+    root: str = "/", machine: Optional[str] = None
+) -> Attributes:
+    machine = machine or os.uname().machine
+
+    def matches(*patterns: str) -> bool:
+        return any(fnmatch.fnmatchcase(machine, p) for p in patterns)  # type: ignore
+
+    if os.path.isdir(os.path.join(root, "boot/efi/EFI/BOOT/mender_grubenv1")):
+        if matches("arm*", "aarch*"):
+            integration = "uboot_uefi_grub"
+        elif matches("*86*"):
+            integration = "uefi_grub"
+        else:
+            integration = "unknown_uefi_grub"
+    elif os.path.isdir(os.path.join(root, "boot/grub/mender_grubenv1")):
+        integration = "bios_grub" if matches("*86*") else "unknown_grub"
+    elif os.path.exists(os.path.join(root, "etc/fw_env.config")):
+        integration = "uboot"
+    else:
+        integration = "unknown"
+    return {"mender_bootloader_integration": [integration]}
+
+
+def update_modules(modules_dir: str = "/usr/share/mender/modules") -> Attributes:
+    modules = [
+        os.path.basename(path)
+        for path in sorted(glob.glob(os.path.join(modules_dir, "*", "*")))
+        if os.access(path, os.X_OK)
+    ]
+    return {"update_modules": modules or [""]}
+
+
+COLLECTORS: Dict[str, Callable[[], Attributes]] = {
+    "bootloader-integration": bootloader_integration,
+    "hostinfo": hostinfo,
+    "network": network,
+    "os": os_name,
+    "rootfs-type": rootfs_type,
+    "update-modules": update_modules,
+}
+
+
+def enabled(names) -> List[Tuple[str, Callable[[], Attributes]]]:
+    """Return the collectors in 'names', ignoring, and logging, unknown names"""
+    collectors = []
+    for name in names or []:
+        if name in COLLECTORS:
+            collectors.append((name, COLLECTORS[name]))
+        else:
+            log.error(
+                f"Unknown inventory collector: {name}. "
+                f"Available: {', '.join(sorted(COLLECTORS))}"
+            )
+    return collectors
@@ -13,25 +13,44 @@
 #    limitations under the License.
 import subprocess
 import logging as log
+from typing import Optional
 
 import mender.settings.settings as settings
+from mender.governor.governor import Governor
 
 
-def run_sub_updater(deployment_id: str) -> bool:
-    """run_sub_updater runs the /usr/share/mender/install script"""
+def run_sub_updater(
+    deployment_id: Optional[str],
+    artifact_path: Optional[str] = None,
+    governor: Optional[Governor] = None,
+) -> bool:
+    """run_sub_updater runs the /usr/share/mender/install script
+
+    The script is given the path to the downloaded Artifact, or the partition
+    the rootfs-image has already been written to. The 'governor' lowers the
+    priority of the script, and confines it to its cgroup, if configured.
+    Without a 'deployment_id', such as for the standalone install, no update
+    lockfile is written, as there is no deployment for the daemon to wait for,
+    nor for 'mender report' to report.
+    """
     log.info("Running the sub-updater script at /usr/share/mender/install")
     try:
-        # Store the deployment ID in the update lockfile
-        with open(settings.PATHS.lockfile_path, "w") as f:
-            f.write(deployment_id)
-        subprocess.run(
+        if deployment_id is not None:
+            # Store the deployment ID in the update lockfile
+            with open(settings.PATHS.lockfile_path, "w") as f:
+                f.write(deployment_id)
+        (governor.run if governor else subprocess.run)(
             [
                 "/usr/share/mender/install",
-                settings.PATHS.artifact_download + "/artifact.mender",
+                artifact_path
+                or settings.PATHS.artifact_download + "/artifact.mender",
             ],
             check=True,
         )
         return True
     except subprocess.CalledProcessError as e:
         log.error(f"Failed to run the install script '/var/lib/mender/install' {e}")
+    finally:
+        if governor:
+            governor.release_cgroup()
     return False
@@ -0,0 +1,93 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Verify the signature of the Artifact manifest, as made by mender-artifact
+
+The manifest lists the sha256 of every other member of the Artifact, so its
+signature covers the whole Artifact. 'manifest.sig' holds the base64 encoded
+signature of the manifest, with either:
+
+* RSA - PKCS#1 v1.5, SHA256
+* ECDSA - SHA256, encoded as r and s, concatenated, or as DER
+"""
+import base64
+import binascii
+import functools
+import logging as log
+from typing import Callable
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+
+import mender.artifact.artifact as artifact
+
+
+@functools.lru_cache(maxsize=None)
+def load_verify_key(path: str):
+    """Load, and parse, the public key at 'path', once for the daemon's lifetime
+
+    Raises artifact.ArtifactError if the key can not be used.
+    """
+    try:
+        with open(path, "rb") as fh:
+            key = serialization.load_pem_public_key(fh.read(), default_backend())
+    except (OSError, ValueError) as e:
+        raise artifact.ArtifactError(
+            f"Failed to load the Artifact verification key {path}: {e}"
+        ) from e
+    if not isinstance(key, (rsa.RSAPublicKey, ec.EllipticCurvePublicKey)):
+        raise artifact.ArtifactError(
+            f"Unsupported Artifact verification key type: {type(key).__name__}"
+        )
+    log.info(f"Loaded the Artifact verification key {path}")
+    return key
+
+
+def _ecdsa_der(key: ec.EllipticCurvePublicKey, signature: bytes) -> bytes:
+    """Return the DER encoding of a signature given as r and s, concatenated"""
+    size = (key.curve.key_size + 7) // 8
+    if len(signature) != 2 * size:
+        return signature  # Presumably DER already
+    return encode_dss_signature(
+        int.from_bytes(signature[:size], "big"), int.from_bytes(signature[size:], "big")
+    )
+
+
+def verify(key, manifest: bytes, signature: bytes) -> None:
+    """Verify the base64 encoded 'signature' of the 'manifest'
+
+    Raises artifact.ArtifactError if the signature does not match.
+    """
+    try:
+        raw = base64.b64decode(signature.strip(), validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise artifact.ArtifactError(f"Malformed Artifact signature: {e}") from e
+    try:
+        if isinstance(key, rsa.RSAPublicKey):
+            key.verify(raw, manifest, padding.PKCS1v15(), hashes.SHA256())
+        else:
+            key.verify(_ecdsa_der(key, raw), manifest, ec.ECDSA(hashes.SHA256()))
+    except (InvalidSignature, ValueError) as e:
+        raise artifact.ArtifactError("The Artifact signature is invalid") from e
+
+
+def verifier(path: str) -> Callable[[bytes, bytes], None]:
+    """Return a function verifying a manifest signature with the key at 'path'"""
+
+    def verify_manifest(manifest: bytes, signature: bytes) -> None:
+        verify(load_verify_key(path), manifest, signature)
+
+    return verify_manifest
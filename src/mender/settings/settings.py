@@ -41,17 +41,26 @@ class Path:
             self.data_dir, "identity", "mender-device-identity"
         )
         self.inventory_scripts = os.path.join(self.data_dir, "inventory")
+        self.plugins = os.path.join(self.data_dir, "plugins")
         self.key = os.path.join(self.data_store, self.key_filename)
         self.key_path = self.data_store
+        self.auth_request = os.path.join(self.data_store, "auth-request.json")
 
         self.artifact_info = os.path.join(self.conf, "artifact_info")
         self.device_type = os.path.join(self.data_store, "device_type")
 
         self.artifact_download = self.data_store
+        self.artifact_cache = os.path.join(self.data_store, "artifact-cache")
 
         self.deployment_log = self.data_store
 
         self.lockfile_path = self.data_store + "/update.lock"
+        self.update_checkpoint = os.path.join(self.data_store, "update.json")
+
+        self.outbox = os.path.join(self.data_store, "outbox.sqlite")
+        self.authtoken = os.path.join(self.data_store, "authtoken")
+        self.auth_server = os.path.join(self.data_store, "authtoken-server")
+        self.identity_data = os.path.join(self.data_store, "identity.json")
 
 
 # Global singleton
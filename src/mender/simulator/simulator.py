@@ -0,0 +1,407 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Simulate a fleet of devices against a Mender server from one process
+
+Every virtual device has its own identity and schedule, and runs the
+authorize, inventory, and update check requests of the real client, and goes
+through a download and the status reports when a deployment is available to
+it. The devices share the RSA keys from a small pool, and the HTTP connection
+pool, so that a device costs little more than the requests it makes.
+"""
+import heapq
+import logging as log
+import multiprocessing
+import os
+import os.path
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import mender.client
+import mender.client.authorize as authorize
+import mender.client.deployments as deployments
+import mender.client.inventory as client_inventory
+import mender.security.key as key
+from mender.client import HTTPUnathorized
+
+OP_AUTHORIZE = "authorize"
+OP_INVENTORY = "inventory"
+OP_UPDATE_CHECK = "update_check"
+OP_DOWNLOAD = "download"
+OP_REPORT = "report"
+
+
+class Behavior:
+    """How the virtual devices behave
+
+    :param inventory_interval: seconds in between inventory uploads
+    :param update_interval: seconds in between update checks
+    :param retry_interval: seconds before retrying a failed authorization
+    :param jitter: fraction of an interval a device randomly deviates from it
+    :param install_failure_rate: fraction of the installs which fail
+    :param download: download the Artifact, or only report the statuses
+    """
+
+    def __init__(
+        self,
+        inventory_interval: float = 28800,
+        update_interval: float = 1800,
+        retry_interval: float = 300,
+        jitter: float = 0.1,
+        install_failure_rate: float = 0.0,
+        download: bool = True,
+        device_type: str = "simulated-device",
+        artifact_name: str = "simulated-release",
+    ):
+        self.inventory_interval = inventory_interval
+        self.update_interval = update_interval
+        self.retry_interval = retry_interval
+        self.jitter = jitter
+        self.install_failure_rate = install_failure_rate
+        self.download = download
+        self.device_type = device_type
+        self.artifact_name = artifact_name
+
+
+class Stats:
+    """Thread-safe latency and error accounting per operation"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, op: str, latency: float, ok: bool) -> None:
+        with self.lock:
+            self.latencies.setdefault(op, []).append(latency)
+            if not ok:
+                self.errors[op] = self.errors.get(op, 0) + 1
+
+    def merge(self, other: "Stats") -> None:
+        with self.lock:
+            for op, latencies in other.latencies.items():
+                self.latencies.setdefault(op, []).extend(latencies)
+            for op, errors in other.errors.items():
+                self.errors[op] = self.errors.get(op, 0) + errors
+
+    def __getstate__(self):
+        return {"latencies": self.latencies, "errors": self.errors}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.__dict__.update(state)
+
+    def summary(self) -> Dict[str, dict]:
+        summary = {}
+        for op, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            summary[op] = {
+                "count": len(latencies),
+                "errors": self.errors.get(op, 0),
+                "p50": _percentile(latencies, 0.50),
+                "p95": _percentile(latencies, 0.95),
+                "p99": _percentile(latencies, 0.99),
+                "max": latencies[-1],
+            }
+        return summary
+
+    def report(self, duration: float) -> str:
+        lines = [
+            f"{'operation':14} {'count':>8} {'errors':>7} {'req/s':>8} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+        ]
+        for op, s in self.summary().items():
+            lines.append(
+                f"{op:14} {s['count']:8} {s['errors']:7} {s['count'] / duration:8.1f} "
+                f"{s['p50'] * 1000:8.1f} {s['p95'] * 1000:8.1f} "
+                f"{s['p99'] * 1000:8.1f} {s['max'] * 1000:8.1f}"
+            )
+        return "\n".join(lines)
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def key_pool(size: int, key_dir: Optional[str] = None) -> list:
+    """Load, or generate, 'size' private keys to be shared among the devices
+
+    The keys are stored in 'key_dir' if given, so that subsequent simulations
+    do not have to pay for the RSA key generation again.
+    """
+    keys = []
+    for i in range(size):
+        path = os.path.join(key_dir, f"simulator-{i}.pem") if key_dir else None
+        if path and os.path.exists(path):
+            keys.append(key.load_key(path))
+            continue
+        private_key = key.generate_key()
+        if path:
+            key.store_key(private_key, path)
+        keys.append(private_key)
+    return keys
+
+
+class VirtualDevice:
+    def __init__(
+        self,
+        index: int,
+        private_key,
+        server_url: str,
+        tenant_token: str,
+        server_certificate: str,
+        behavior: Behavior,
+        stats: Stats,
+    ):
+        self.index = index
+        self.private_key = private_key
+        self.server_url = server_url
+        self.tenant_token = tenant_token
+        self.server_certificate = server_certificate
+        self.behavior = behavior
+        self.stats = stats
+        self.mac = ":".join(
+            f"{b:02x}" for b in (0x02, 0x00) + tuple(index.to_bytes(4, "big"))
+        )
+        self.identity = {"mac": self.mac}
+        self.artifact_name = behavior.artifact_name
+        self.jwt: Optional[str] = None
+        self.next_inventory = 0.0
+        self.next_update_check = 0.0
+
+    def _interval(self, interval: float) -> float:
+        return interval * (1 + random.uniform(-1, 1) * self.behavior.jitter)
+
+    def _timed(self, op: str, fn, *args, **kwargs):
+        start = time.monotonic()
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = bool(result)
+            return result
+        finally:
+            self.stats.record(op, time.monotonic() - start, ok)
+
+    def step(self, now: float) -> float:
+        """Run the actions due at 'now', and return when the device is due next"""
+        try:
+            if not self.jwt:
+                self.jwt = self._timed(
+                    OP_AUTHORIZE,
+                    authorize.request,
+                    self.server_url,
+                    self.tenant_token,
+                    self.identity,
+                    self.private_key,
+                    self.server_certificate,
+                )
+                if not self.jwt:
+                    return now + self._interval(self.behavior.retry_interval)
+            if now >= self.next_inventory:
+                self._timed(
+                    OP_INVENTORY,
+                    client_inventory.request,
+                    self.server_url,
+                    self.jwt,
+                    {
+                        "device_type": self.behavior.device_type,
+                        "artifact_name": self.artifact_name,
+                        "mac": self.mac,
+                    },
+                    self.server_certificate,
+                )
+                self.next_inventory = now + self._interval(
+                    self.behavior.inventory_interval
+                )
+            if now >= self.next_update_check:
+                self.check_update()
+                self.next_update_check = now + self._interval(
+                    self.behavior.update_interval
+                )
+        except HTTPUnathorized:
+            self.jwt = None
+            return now
+        return min(self.next_inventory, self.next_update_check)
+
+    def check_update(self) -> None:
+        start = time.monotonic()
+        try:
+            deployment = deployments.request(
+                self.server_url,
+                self.jwt,
+                device_type={"device_type": self.behavior.device_type},
+                artifact_name={"artifact_name": self.artifact_name},
+                server_certificate=self.server_certificate,
+            )
+        except Exception:
+            self.stats.record(OP_UPDATE_CHECK, time.monotonic() - start, False)
+            raise
+        # No update available is a successful check as well
+        self.stats.record(OP_UPDATE_CHECK, time.monotonic() - start, True)
+        if deployment:
+            self.update(deployment)
+
+    def _report(self, status: str, deployment_id: str) -> bool:
+        return self._timed(
+            OP_REPORT,
+            deployments.report,
+            self.server_url,
+            status,
+            deployment_id,
+            self.server_certificate,
+            self.jwt,
+        )
+
+    def update(self, deployment: deployments.DeploymentInfo) -> None:
+        self._report(deployments.STATUS_DOWNLOADING, deployment.ID)
+        if self.behavior.download:
+            ok = self._timed(
+                OP_DOWNLOAD,
+                deployments.download,
+                deployment,
+                os.devnull,
+                self.server_certificate,
+            )
+            if not ok:
+                self._report(deployments.STATUS_FAILURE, deployment.ID)
+                return
+        if random.random() < self.behavior.install_failure_rate:
+            self._report(deployments.STATUS_FAILURE, deployment.ID)
+            return
+        if self._report(deployments.STATUS_SUCCESS, deployment.ID):
+            self.artifact_name = deployment.artifact_name
+
+
+class Simulator:
+    """Schedule the virtual devices on a pool of worker threads"""
+
+    def __init__(self, devices: List[VirtualDevice], workers: int, stats: Stats):
+        self.devices = devices
+        self.workers = workers
+        self.stats = stats
+
+    def run(self, duration: float) -> Stats:
+        start = time.monotonic()
+        deadline = start + duration
+        # Spread the start-up of the devices over the first second
+        queue = [
+            (start + random.random(), device.index, device) for device in self.devices
+        ]
+        heapq.heapify(queue)
+        done: List[tuple] = []
+        done_lock = threading.Lock()
+
+        def run_device(device: VirtualDevice) -> None:
+            try:
+                due = device.step(time.monotonic())
+            except Exception as e:  # pylint: disable=broad-except
+                log.error(f"Virtual device {device.index} failed: {e}")
+                due = time.monotonic() + device.behavior.retry_interval
+            with done_lock:
+                done.append((due, device.index, device))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                with done_lock:
+                    for item in done:
+                        heapq.heappush(queue, item)
+                    done.clear()
+                while queue and queue[0][0] <= now:
+                    _, _, device = heapq.heappop(queue)
+                    executor.submit(run_device, device)
+                wait = queue[0][0] - now if queue else 0.1
+                time.sleep(max(0.001, min(wait, 0.1, deadline - now)))
+        return self.stats
+
+
+def _run_slice(
+    indices: range,
+    key_dir: Optional[str],
+    keys: int,
+    workers: int,
+    duration: float,
+    server_url: str,
+    tenant_token: str,
+    server_certificate: str,
+    behavior: Behavior,
+) -> Stats:
+    mender.client.configure_session(pool_size=workers)
+    pool = key_pool(keys, key_dir)
+    stats = Stats()
+    devices = [
+        VirtualDevice(
+            i,
+            pool[i % len(pool)],
+            server_url,
+            tenant_token,
+            server_certificate,
+            behavior,
+            stats,
+        )
+        for i in indices
+    ]
+    return Simulator(devices, workers, stats).run(duration)
+
+
+def run(
+    devices: int,
+    duration: float,
+    server_url: str,
+    tenant_token: str = "",
+    server_certificate: str = "",
+    behavior: Optional[Behavior] = None,
+    processes: int = 1,
+    workers: int = 32,
+    keys: int = 1,
+    key_dir: Optional[str] = None,
+) -> Stats:
+    """Simulate 'devices' devices for 'duration' seconds, and return the stats
+
+    The devices are split evenly over 'processes' processes, each running the
+    requests of its devices on 'workers' threads.
+    """
+    behavior = behavior or Behavior()
+    if key_dir:
+        # Generate the keys once, up front, for all the processes to load
+        key_pool(keys, key_dir)
+    slices = [range(i, devices, processes) for i in range(processes)]
+    args = [
+        (
+            indices,
+            key_dir,
+            keys,
+            workers,
+            duration,
+            server_url,
+            tenant_token,
+            server_certificate,
+            behavior,
+        )
+        for indices in slices
+    ]
+    if processes == 1:
+        return _run_slice(*args[0])
+    stats = Stats()
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.starmap(_run_slice, args):
+            stats.merge(result)
+    return stats
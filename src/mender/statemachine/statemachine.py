@@ -13,20 +13,36 @@
 #    limitations under the License.
 import logging as log
 import os.path
+import shutil
+import sqlite3
+import threading
 import time
+from typing import Callable, Dict, Optional
 
+import mender.artifact.artifact as artifact
 import mender.bootstrap.bootstrap as bootstrap
+import mender.cache.cache as artifactcache
+import mender.client
 from mender.client import HTTPUnathorized
 import mender.client.authorize as authorize
 import mender.client.deployments as deployments
 import mender.client.inventory as client_inventory
+import mender.client.servers as servers
 import mender.config.config as config
+import mender.datastore.datastore as datastore
+import mender.governor.governor as governor
+import mender.installer.rootfs as rootfs
+import mender.log.log as menderlog
+import mender.metrics.metrics as metrics
+import mender.outbox.outbox as outbox
 import mender.scripts.aggregator.identity as identity
 import mender.scripts.aggregator.inventory as inventory
 import mender.scripts.artifactinfo as artifactinfo
 import mender.scripts.devicetype as devicetype
 import mender.scripts.runner as installscriptrunner
+import mender.security.signature as signature
 import mender.settings.settings as settings
+import mender.tracing.tracing as tracing
 
 from mender.log.log import DeploymentLogHandler
 
@@ -36,6 +52,12 @@ class Context:
 
     def __init__(self):
         self.private_key = None
+        # The server authorized with, and the JWTs issued by each server
+        self.server_url = ""
+        self.JWT: Optional[str] = None
+        self.JWTs: Dict[str, str] = {}
+        # The progress of the update in progress, if any
+        self.checkpoint: Optional[dict] = None
 
 
 class State:
@@ -46,6 +68,20 @@ class State:
         pass
 
 
+def run_state(state: State, context):
+    """Run the given state, and record the time spent in it"""
+    name = type(state).__name__
+    metrics.STATE_TRANSITIONS.inc(state=name)
+    with tracing.span(f"state {name}", state=name) as span:
+        with metrics.STATE_DURATION.time(state=name):
+            next_state = state.run(context)
+        if isinstance(next_state, State):
+            span.set(next_state=type(next_state).__name__)
+        elif not next_state and next_state is not None:
+            span.outcome = tracing.OUTCOME_FAILED
+        return next_state
+
+
 class Init(State):
     def run(self, context, force_bootstrap=False):
         log.debug("InitState: run()")
@@ -56,25 +92,194 @@ class Init(State):
                 global_path=settings.PATHS.global_conf,
             )
             log.info(f"Loaded configuration: {context.config}")
+            metrics.configure(context.config)
+            tracing.configure(context.config)
+            mender.client.configure(context.config)
+            if context.config.PeerListenAddress:
+                # pylint: disable=import-outside-toplevel
+                import mender.peer.peer as peer
+
+                peer.configure(
+                    context.config,
+                    artifactcache.configure(
+                        context.config, settings.PATHS.artifact_cache
+                    ),
+                )
         except config.NoConfigurationFileError:
             log.error(
                 "No configuration files found for the device."
                 "Most likely, the device will not be functional."
             )
-        identity_data = identity.aggregate(path=settings.PATHS.identity_scripts)
+        identity_data = identity.aggregate(
+            path=settings.PATHS.identity_scripts, plugin_path=settings.PATHS.plugins
+        )
         context.identity_data = identity_data
+        persist(datastore.write_json, settings.PATHS.identity_data, identity_data)
         private_key = bootstrap.now(
             force_bootstrap=force_bootstrap, private_key_path=settings.PATHS.key
         )
         context.private_key = private_key
+        try:
+            context.outbox = outbox.Outbox(settings.PATHS.outbox)
+            context.outbox.start(sender(context))
+        except sqlite3.Error as e:
+            log.error(f"Failed to open the report outbox {settings.PATHS.outbox}: {e}")
+            context.outbox = None
         log.debug(f"Init set context to: {context}")
         return context
 
 
+def persist(write, path, data):
+    """Store the daemon state for the one-shot commands to reuse"""
+    try:
+        write(path, data)
+    except OSError as e:
+        log.error(f"Failed to store {path}: {e}")
+
+
+def sender(context):
+    """Deliver the reports in the outbox with the current JWT of the context"""
+
+    def send(report: outbox.Report) -> bool:
+        if not getattr(context, "JWT", None):
+            return False
+        try:
+            return deployments.deliver(
+                context.server_url,
+                context.config.ServerCertificate,
+                context.JWT,
+                report,
+            )
+        except HTTPUnathorized:
+            # The state-machine re-authorizes on its next request
+            return False
+
+    return send
+
+
+def report(context, status: str) -> None:
+    """Queue the deployment status, and the log of a failure, for delivery"""
+    deployment_id = context.deployment.ID
+    if getattr(context, "outbox", None):
+        try:
+            context.outbox.status(deployment_id, status)
+            if status == deployments.STATUS_FAILURE:
+                context.outbox.log(deployment_id, menderlog.read_deployment_log())
+            return
+        except sqlite3.Error as e:
+            log.error(f"Failed to queue the deployment status '{status}': {e}")
+    if not deployments.report(
+        context.server_url,
+        status,
+        deployment_id,
+        context.config.ServerCertificate,
+        context.JWT,
+    ):
+        log.error(
+            f"Failed to report the deployment status '{status}' to the Mender server"
+        )
+
+
+#
+# Checkpoints - The progress of the update in progress is stored on every
+# transition, for the update to be resumed after a crash, or a power loss
+#
+
+# The states resumed before the install script has finished
+RESUMED_BEFORE_INSTALL = ("Download", "ArtifactInstall")
+
+
+def new_checkpoint(deployment: deployments.DeploymentInfo) -> dict:
+    return {
+        "state": "Download",
+        "deployment": {
+            "id": deployment.ID,
+            "artifact_name": deployment.artifact_name,
+            "artifact_uri": deployment.artifact_uri,
+        },
+        "artifact_digest": None,
+        "download_offset": 0,
+        "verified": False,
+        "rootfs_partition": None,
+    }
+
+
+def load_checkpoint() -> Optional[dict]:
+    checkpoint = datastore.read_json(settings.PATHS.update_checkpoint)
+    if checkpoint is None:
+        return None
+    try:
+        if checkpoint["state"] in UPDATE_STATES and checkpoint["deployment"]["id"]:
+            return checkpoint
+    except (KeyError, TypeError):
+        pass
+    log.error(f"Ignoring the invalid update checkpoint: {checkpoint}")
+    return None
+
+
+def save_checkpoint(context, **changes) -> None:
+    context.checkpoint.update(changes)
+    persist(datastore.write_json, settings.PATHS.update_checkpoint, context.checkpoint)
+
+
+def clear_checkpoint(context) -> None:
+    context.checkpoint = None
+    datastore.remove(settings.PATHS.update_checkpoint)
+
+
+def resume(context, checkpoint: dict) -> None:
+    """Restore the deployment in progress from the checkpoint"""
+    deployment = checkpoint["deployment"]
+    log.info(
+        f"Resuming the deployment {deployment['id']} from the {checkpoint['state']} state"
+    )
+    context.deployment = deployments.DeploymentInfo(
+        {
+            "id": deployment["id"],
+            "artifact": {
+                "artifact_name": deployment["artifact_name"],
+                "source": {"uri": deployment["artifact_uri"]},
+            },
+        }
+    )
+    context.checkpoint = checkpoint
+    context.resumed = True
+    context.rootfs_partition = checkpoint.get("rootfs_partition")
+    context.artifact_header = None
+    tracing.set_deployment(deployment["id"])
+    if getattr(context, "deployment_log_handler", None):
+        context.deployment_log_handler.enable(reset=False)
+
+
+def refresh_deployment(context) -> None:
+    """Ask the server for a fresh link to the Artifact of the resumed deployment
+
+    The stored link may have expired while the client was down. It is kept if
+    the server does not return the same deployment.
+    """
+    deployment = deployments.request(
+        context.server_url,
+        context.JWT,
+        device_type=devicetype.get(settings.PATHS.device_type),
+        artifact_name=artifactinfo.get(settings.PATHS.artifact_info),
+        server_certificate=context.config.ServerCertificate,
+    )
+    if deployment and deployment.ID == context.deployment.ID:
+        context.deployment = deployment
+        save_checkpoint(
+            context,
+            deployment=new_checkpoint(deployment)["deployment"],
+        )
+
+
 ##########################################
 
 
 def run():
+    checkpoint = load_checkpoint()
+    if checkpoint and checkpoint["state"] in RESUMED_BEFORE_INSTALL:
+        # The install was interrupted, and is run again once the update resumes
+        datastore.remove(settings.PATHS.lockfile_path)
     while os.path.exists(settings.PATHS.lockfile_path):
         log.info(
             "A deployment is currently in progress, the client will go to sleep for 60 seconds"
@@ -101,6 +306,9 @@ class StateMachine:
         logger.addHandler(deployment_log_handler)
         self.context.deployment_log_handler = deployment_log_handler
         self.context.deployment_log_handler.disable()
+        checkpoint = load_checkpoint()
+        if checkpoint:
+            resume(self.context, checkpoint)
         while True:
             self.unauthorized_machine.run(self.context)
             self.authorized_machine.run(self.context)
@@ -118,13 +326,20 @@ class Authorize(State):
         log.info("Authorizing...")
         log.debug(f"Current context: {context}")
         time.sleep(3)
-        return authorize.request(
-            context.config.ServerURL,
-            context.config.TenantToken,
-            context.identity_data,
-            context.private_key,
-            context.config.ServerCertificate,
-        )
+        # The preferred server first, and the others if it fails
+        for server_url in servers.SERVERS.candidates() or [""]:
+            JWT = authorize.request(
+                server_url,
+                context.config.TenantToken,
+                context.identity_data,
+                context.private_key,
+                context.config.ServerCertificate,
+                cache_path=settings.PATHS.auth_request,
+            )
+            if JWT:
+                context.server_url = server_url
+                return JWT
+        return None
 
 
 class Idle(State):
@@ -142,12 +357,16 @@ class UnauthorizedStateMachine(StateMachine):
 
     def run(self, context):
         while True:
-            JWT = Authorize().run(context)
+            JWT = run_state(Authorize(), context)
             if JWT:
                 context.JWT = JWT
+                context.JWTs[context.server_url] = JWT
                 context.authorized = True
+                persist_authorization(context)
+                wake_outbox(context)
                 return
-            Idle().run(context)
+            metrics.RETRIES.inc(operation="authorize")
+            run_state(Idle(), context)
 
 
 class AuthorizedStateMachine(StateMachine):
@@ -160,15 +379,58 @@ class AuthorizedStateMachine(StateMachine):
     def run(self, context):
         while context.authorized:
             try:
+                if context.checkpoint:
+                    # Resume the update interrupted by a crash, or a reboot
+                    UpdateStateMachine(context.checkpoint).run(context)
                 self.idle_machine.run(context)  # Idle returns when an update is ready
+                if not context.authorized:
+                    # Authorize with the server switched to
+                    return
                 UpdateStateMachine().run(
                     context
                 )  # Update machine runs when idle detects an update
             except HTTPUnathorized:
+                context.JWTs.pop(context.server_url, None)
                 context.authorized = False
                 return
 
 
+def persist_authorization(context) -> None:
+    """Store the JWT, and the server which issued it, for the one-shot commands"""
+    persist(datastore.write, settings.PATHS.authtoken, context.JWT)
+    persist(datastore.write, settings.PATHS.auth_server, context.server_url)
+
+
+def wake_outbox(context) -> None:
+    """Deliver the queued reports, held back by a rejected JWT, with the new one"""
+    if getattr(context, "outbox", None):
+        context.outbox.wake()
+
+
+def switch_server(context) -> bool:
+    """Switch to the server preferred by its latency, and health, if it changed
+
+    The other servers are probed first, when due, for their latency.
+
+    The JWT issued by the server is reused, if there is one. Returns False if
+    the client has to authorize with the server first.
+    """
+    for url in servers.SERVERS.due_probes(context.server_url):
+        authorize.probe(url, context.config.ServerCertificate)
+    server_url = servers.SERVERS.select(context.server_url)
+    if not server_url or server_url == context.server_url:
+        return True
+    log.info(f"Switching from the server {context.server_url} to {server_url}")
+    metrics.SERVER_SWITCHES.inc()
+    JWT = context.JWTs.get(server_url)
+    if not JWT:
+        return False
+    context.server_url, context.JWT = server_url, JWT
+    persist_authorization(context)
+    wake_outbox(context)
+    return True
+
+
 # Should transitions always go through the external state-machine, to verify and
 # catch de-authorizations (?)
 #
@@ -184,18 +446,19 @@ class SyncInventory(State):
             settings.PATHS.inventory_scripts,
             settings.PATHS.device_type,
             settings.PATHS.artifact_info,
+            plugin_path=settings.PATHS.plugins,
+            enabled_collectors=context.config.InventoryCollectors,
         )
         if inventory_data:
             log.debug(f"aggreated inventory data: {inventory_data}")
             client_inventory.request(
-                context.config.ServerURL,
+                context.server_url,
                 context.JWT,
                 inventory_data,
                 context.config.ServerCertificate,
             )
         else:
             log.info("No inventory data found")
-        time.sleep(1)
 
 
 class SyncUpdate(State):
@@ -204,7 +467,7 @@ class SyncUpdate(State):
         device_type = devicetype.get(settings.PATHS.device_type)
         artifact_name = artifactinfo.get(settings.PATHS.artifact_info)
         deployment = deployments.request(
-            context.config.ServerURL,
+            context.server_url,
             context.JWT,
             device_type=device_type,
             artifact_name=artifact_name,
@@ -212,22 +475,112 @@ class SyncUpdate(State):
         )
         if deployment:
             context.deployment = deployment
+            tracing.set_deployment(deployment.ID)
             context.deployment_log_handler.enable()
             return True
-        time.sleep(2)
         return False
 
 
+# The intervals used when not configured, which keep the cadence of the old
+# sequential inventory sync, and update check, cycle
+DEFAULT_INVENTORY_POLL_INTERVAL = 3
+DEFAULT_UPDATE_POLL_INTERVAL = 2
+
+
+def poll_interval(value, default: float) -> float:
+    """Return the configured interval 'value' in seconds, or 'default' if unset"""
+    if value in ("", None):
+        return default
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        log.error(f"Invalid poll interval: {value}. Using {default} seconds")
+        return default
+
+
+class InventorySync(threading.Thread):
+    """Sync the inventory every 'interval' seconds, while resumed
+
+    A single thread syncs for the whole daemon, next to the update checks, so
+    that a slow inventory script, or inventory upload, never delays the
+    detection of a deployment, and never overlaps another sync. The syncs are
+    paused outside of Idle. A JWT rejected by the server is recorded in
+    'rejected_JWT', for the state machine to authorize again.
+    """
+
+    def __init__(self, context, interval: float):
+        super().__init__(name="inventory", daemon=True)
+        self.context = context
+        self.interval = interval
+        self.rejected_JWT: Optional[str] = None
+        self._resumed = threading.Event()
+        self._stopped = threading.Event()
+
+    def resume(self) -> None:
+        self._resumed.set()
+
+    def pause(self) -> None:
+        """Start no new sync, without waiting for a sync in progress"""
+        self._resumed.clear()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._resumed.set()
+
+    def run(self) -> None:
+        while True:
+            self._resumed.wait()
+            if self._stopped.is_set():
+                return
+            JWT = self.context.JWT
+            try:
+                run_state(SyncInventory(), self.context)
+            except HTTPUnathorized:
+                log.error("The Mender server rejected the JWT")
+                self.rejected_JWT = JWT
+                # Resumed by Idle, once authorized again
+                self.pause()
+                continue
+            except Exception as e:  # pylint: disable=broad-except
+                log.error(f"Failed to sync the inventory: {e}")
+            self._stopped.wait(self.interval)
+
+
 class IdleStateMachine(AuthorizedStateMachine):
+    """Check for updates, while syncing the inventory in the background"""
+
     def __init__(self):
-        pass
+        self.inventory_sync: Optional[InventorySync] = None
 
     def run(self, context):
-        while context.authorized:
-            SyncInventory().run(context)
-            if SyncUpdate().run(context):
-                # Update available
-                return
+        if not self.inventory_sync:
+            self.inventory_sync = InventorySync(
+                context,
+                poll_interval(
+                    context.config.InventoryPollIntervalSeconds,
+                    DEFAULT_INVENTORY_POLL_INTERVAL,
+                ),
+            )
+            self.inventory_sync.start()
+        update_interval = poll_interval(
+            context.config.UpdatePollIntervalSeconds, DEFAULT_UPDATE_POLL_INTERVAL
+        )
+        try:
+            while context.authorized:
+                rejected = self.inventory_sync.rejected_JWT
+                if rejected is not None and rejected == context.JWT:
+                    # Handled by the AuthorizedStateMachine, as for an update check
+                    raise HTTPUnathorized()
+                self.inventory_sync.resume()
+                if not switch_server(context):
+                    context.authorized = False
+                    return
+                if run_state(SyncUpdate(), context):
+                    # Update available
+                    return
+                time.sleep(update_interval)
+        finally:
+            self.inventory_sync.pause()
 
 
 #
@@ -235,35 +588,220 @@ class IdleStateMachine(AuthorizedStateMachine):
 #
 
 
+def device_provides() -> Dict[str, str]:
+    provides = {}
+    for data in (
+        devicetype.get(settings.PATHS.device_type),
+        artifactinfo.get(settings.PATHS.artifact_info),
+    ):
+        for k, v in (data or {}).items():
+            provides[k] = v[0] if isinstance(v, list) else v
+    return provides
+
+
+def preflight(context) -> bool:
+    """Check the Artifact header, before committing to downloading the Artifact
+
+    Only the leading members of the Artifact are fetched. Returns False if the
+    Artifact is not compatible with the device, or does not fit in the data
+    store.
+    """
+    try:
+        checked = deployments.preflight(
+            context.deployment,
+            context.config.ServerCertificate,
+            verify=artifact_verifier(context.config),
+        )
+        if checked is None:
+            # Unable to tell, leave it to the download
+            return True
+        header, size = checked
+        context.artifact_header = header
+        digest = artifactcache.manifest_digest(header)
+        if context.checkpoint["artifact_digest"] != digest:
+            # A partial download of another Artifact can not be resumed
+            save_checkpoint(context, artifact_digest=digest, download_offset=0)
+        if header.artifact_name != context.deployment.artifact_name:
+            raise artifact.ArtifactError(
+                f"The Artifact name {header.artifact_name} does not match "
+                f"the deployment: {context.deployment.artifact_name}"
+            )
+        artifact.check_compatibility(header, device_provides())
+        streamed = (
+            context.config.RootfsStreamInstall
+            and header.payload_type(0) == rootfs.PAYLOAD_TYPE
+        )
+        if size and not streamed:
+            try:
+                free = shutil.disk_usage(settings.PATHS.artifact_download).free
+            except OSError as e:
+                log.debug(f"Unable to determine the free space: {e}")
+                free = size
+            if size > free:
+                raise artifact.ArtifactError(
+                    f"The Artifact ({size} bytes) does not fit in "
+                    f"{settings.PATHS.artifact_download} ({free} bytes free)"
+                )
+    except artifact.ArtifactError as e:
+        log.error(f"The deployment {context.deployment.ID} can not be installed: {e}")
+        return False
+    return True
+
+
 class Download(State):
     def run(self, context):
         log.info("Running the Download state...")
-        if deployments.download(
-            context.deployment,
-            artifact_path=os.path.join(
-                settings.PATHS.artifact_download, "artifact.mender"
-            ),
-            server_certificate=context.config.ServerCertificate,
-        ):
-            if not deployments.report(
-                context.config.ServerURL,
-                deployments.STATUS_DOWNLOADING,
-                context.deployment.ID,
-                context.config.ServerCertificate,
-                context.JWT,
-            ):
-                log.error(
-                    "Failed to report the deployment status 'downloading' to the Mender server"
+        context.rootfs_partition = None
+        context.artifact_header = None
+        if getattr(context, "resumed", False):
+            context.resumed = False
+            refresh_deployment(context)
+        if not preflight(context):
+            report(context, deployments.STATUS_FAILURE)
+            return ArtifactFailure()
+        downloaded = None
+        update_governor = governor.configure(context.config)
+        with update_governor.lowered_priority():
+            if context.config.RootfsStreamInstall:
+                partition = rootfs.inactive_partition(
+                    context.config.RootfsPartA, context.config.RootfsPartB
                 )
+                if partition:
+                    downloaded = deployments.download_rootfs(
+                        context.deployment,
+                        partition,
+                        server_certificate=context.config.ServerCertificate,
+                        direct=context.config.RootfsDirectIO,
+                        verify=artifact_verifier(context.config),
+                        pause=update_governor.pause,
+                        **download_limits(context.config),
+                    )
+                    if downloaded:
+                        context.rootfs_partition = partition
+                        save_checkpoint(
+                            context, rootfs_partition=partition, verified=True
+                        )
+            if downloaded is None:
+                downloaded = download(context, update_governor.pause)
+        if downloaded:
+            report(context, deployments.STATUS_DOWNLOADING)
             return ArtifactInstall()
+        report(context, deployments.STATUS_FAILURE)
         return ArtifactFailure()
 
 
+def artifact_verifier(config) -> Optional[deployments.Verify]:
+    """Verify the Artifact signatures with ArtifactVerifyKey, if it is set"""
+    if not config.ArtifactVerifyKey:
+        return None
+    return signature.verifier(config.ArtifactVerifyKey)
+
+
+def download_limits(config) -> Dict[str, float]:
+    """The stall detection settings of the Artifact downloads"""
+    try:
+        return {
+            "min_speed": float(config.DownloadMinSpeedBytes),
+            "stall_window": float(config.DownloadStallSeconds),
+            "retries": int(config.DownloadRetries),
+        }
+    except (TypeError, ValueError) as e:
+        log.error(f"Invalid download stall settings: {e}. Not detecting stalls")
+        return {}
+
+
+def download(context, pause: Optional[Callable[[], float]] = None) -> bool:
+    """Download the Artifact to the data store, or take it from the cache
+
+    A fresh download is first tried from the PeerURLs, if any. A download
+    interrupted by a crash, or a power loss, is resumed from the last
+    checkpoint, and verified in full once complete.
+    """
+    artifact_path = os.path.join(settings.PATHS.artifact_download, "artifact.mender")
+    cache = artifactcache.configure(context.config, settings.PATHS.artifact_cache)
+    digest = context.checkpoint["artifact_digest"]
+    name = context.deployment.artifact_name
+    if cache and digest:
+        try:
+            if cache.get(name, digest, artifact_path):
+                save_checkpoint(context, verified=True)
+                return True
+        except OSError as e:
+            log.error(f"Failed to use the cached Artifact {name}: {e}")
+    offset = context.checkpoint["download_offset"] if digest else 0
+    try:
+        if offset > os.path.getsize(artifact_path):
+            offset = 0
+    except OSError:
+        offset = 0
+    if not offset:
+        # The previous Artifact may be a hardlink into the cache
+        datastore.remove(artifact_path)
+    verify = artifact_verifier(context.config)
+    if not offset and digest and context.config.PeerURLs:
+        # pylint: disable=import-outside-toplevel
+        import mender.peer.peer as peer
+
+        if peer.fetch(
+            context.config.PeerURLs,
+            digest,
+            artifact_path,
+            context.config.ServerCertificate,
+            verify,
+            pause=pause,
+            **download_limits(context.config),
+        ):
+            save_checkpoint(context, verified=True)
+            add_to_cache(context, cache, artifact_path)
+            return True
+        log.info("No peer has the Artifact. Downloading it from the server")
+    if not deployments.download(
+        context.deployment,
+        artifact_path=artifact_path,
+        server_certificate=context.config.ServerCertificate,
+        offset=offset,
+        progress=lambda downloaded: save_checkpoint(
+            context, download_offset=downloaded
+        ),
+        # Verified as it is downloaded, or in full once a resumed download is
+        # complete
+        verify=verify,
+        digest=digest,
+        pause=pause,
+        **download_limits(context.config),
+    ):
+        return False
+    # The download is complete, and the file may now become a cache hardlink
+    save_checkpoint(context, download_offset=0)
+    if digest:
+        save_checkpoint(context, verified=True)
+    add_to_cache(context, cache, artifact_path)
+    return True
+
+
+def add_to_cache(
+    context, cache: Optional[artifactcache.ArtifactCache], artifact_path: str
+) -> None:
+    digest = context.checkpoint["artifact_digest"]
+    name = context.deployment.artifact_name
+    if cache and digest:
+        try:
+            # Verified against the digest already, as it was downloaded
+            cache.add(name, digest, artifact_path, verified=True)
+        except OSError as e:
+            log.error(f"Failed to cache the Artifact {name}: {e}")
+
+
 class ArtifactInstall(State):
     def run(self, context):
         log.info("Running the ArtifactInstall state...")
-        if installscriptrunner.run_sub_updater(context.deployment.ID):
+        if installscriptrunner.run_sub_updater(
+            context.deployment.ID,
+            context.rootfs_partition,
+            governor.configure(context.config),
+        ):
             return ArtifactReboot()
+        report(context, deployments.STATUS_FAILURE)
         return ArtifactFailure()
 
 
@@ -310,10 +848,32 @@ class _UpdateDone(State):
 
 # The update state-machine is the most advanced machine we need
 class UpdateStateMachine(AuthorizedStateMachine):
-    def __init__(self):
+    def __init__(self, checkpoint: Optional[dict] = None):
         self.current_state = Download()
+        if checkpoint:
+            self.current_state = UPDATE_STATES[checkpoint["state"]]()
 
     def run(self, context):
+        if not context.checkpoint:
+            context.checkpoint = new_checkpoint(context.deployment)
         while self.current_state != _UpdateDone():
-            self.current_state = self.current_state.run(context)
+            save_checkpoint(context, state=type(self.current_state).__name__)
+            self.current_state = run_state(self.current_state, context)
             time.sleep(1)
+        clear_checkpoint(context)
+        tracing.set_deployment(None)
+
+
+# The states an update can be resumed from
+UPDATE_STATES = {
+    state.__name__: state
+    for state in (
+        Download,
+        ArtifactInstall,
+        ArtifactReboot,
+        ArtifactCommit,
+        ArtifactRollback,
+        ArtifactRollbackReboot,
+        ArtifactFailure,
+    )
+}
@@ -0,0 +1,257 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import contextlib
+import json
+import logging as log
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "error"
+OUTCOME_FAILED = "failed"
+
+KIND_INTERNAL = "internal"
+KIND_CLIENT = "client"
+
+# The size at which a span file is rotated, keeping the previous one as <path>.1
+MAX_FILE_SIZE = 16 * 1024 * 1024
+
+Sink = Callable[["Span"], None]
+
+_sinks: List[Sink] = []
+_local = threading.local()
+_process_trace_id = os.urandom(16).hex()
+_deployment_id: Optional[str] = None
+
+
+class Span:
+    """A timed operation, such as a state run, or a request to the server
+
+    All spans started while a deployment is in progress carry its ID, and share
+    a trace ID derived from it, so that a deployment can be followed from the
+    update check, and until the install has finished.
+
+    'start' and 'end' are the wall-clock times, for the exported spans, while
+    the duration is measured on the monotonic clock, which is not stepped by
+    the clock being set, such as by NTP on boot.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        kind: str = KIND_INTERNAL,
+        parent: Optional["Span"] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.name = name
+        self.kind = kind
+        self.deployment_id = _deployment_id
+        self.trace_id = _trace_id(_deployment_id)
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes: Dict[str, Any] = attributes or {}
+        self.outcome = OUTCOME_OK
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self._monotonic_start = time.monotonic()
+        self._monotonic_end: Optional[float] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def finish(self) -> None:
+        self.end = time.time()
+        self._monotonic_end = time.monotonic()
+
+    @property
+    def duration(self) -> float:
+        end = self._monotonic_end
+        return (time.monotonic() if end is None else end) - self._monotonic_start
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "deployment_id": self.deployment_id,
+            "start": self.start,
+            "end": self.end,
+            "duration": self.duration,
+            "outcome": self.outcome,
+            "attributes": self.attributes,
+        }
+
+
+def _trace_id(deployment_id: Optional[str]) -> str:
+    if deployment_id:
+        trace_id = deployment_id.replace("-", "").lower()
+        if len(trace_id) == 32:
+            return trace_id
+    return _process_trace_id
+
+
+def set_deployment(deployment_id: Optional[str]) -> None:
+    """Tag all the spans started from now on with 'deployment_id'"""
+    global _deployment_id  # pylint: disable=global-statement
+    _deployment_id = deployment_id
+
+
+def subscribe(sink: Sink) -> None:
+    """Call 'sink' with every finished span"""
+    _sinks.append(sink)
+
+
+def unsubscribe(sink: Sink) -> None:
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+@contextlib.contextmanager
+def span(name: str, kind: str = KIND_INTERNAL, **attributes: Any) -> Iterator[Span]:
+    """Time the with-block, and hand the resulting span over to the sinks
+
+    The outcome is set to 'error' if the block raises, and can otherwise be set
+    by the caller through the yielded span.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    s = Span(name, kind, stack[-1] if stack else None, attributes)
+    stack.append(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.outcome = OUTCOME_ERROR
+        s.set(error=repr(e))
+        raise
+    finally:
+        s.finish()
+        stack.pop()
+        for sink in list(_sinks):
+            try:
+                sink(s)
+            except Exception as e:  # pylint: disable=broad-except
+                log.debug(f"tracing: sink {sink} failed: {e}")
+
+
+#
+# Sinks
+#
+
+
+class JSONLinesSink:
+    """Append every span as a JSON object on a line of its own to 'path'
+
+    Once 'path' reaches 'max_size' bytes, it is rotated to <path>.1, replacing
+    the previous one, so that the spans of a long running daemon take at most
+    twice 'max_size' on the disk.
+    """
+
+    def __init__(self, path: str, max_size: int = MAX_FILE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    def __call__(self, s: Span) -> None:
+        self._write(json.dumps(s.to_dict(), default=str) + "\n")
+
+    def _write(self, line: str) -> None:
+        with self._lock:
+            try:
+                if os.path.getsize(self.path) >= self.max_size:
+                    os.replace(self.path, self.path + ".1")
+            except OSError:
+                pass
+            with open(self.path, "a") as fh:
+                fh.write(line)
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPFileSink(JSONLinesSink):
+    """Append every span to 'path' in the OpenTelemetry OTLP/JSON encoding
+
+    The file can be shipped by the OpenTelemetry Collector's 'otlpjsonfile'
+    receiver, without the client depending on the OpenTelemetry SDK.
+    """
+
+    SERVICE_NAME = "mender-python-client"
+
+    def __call__(self, s: Span) -> None:
+        attributes = dict(s.attributes)
+        if s.deployment_id:
+            attributes["mender.deployment_id"] = s.deployment_id
+        otlp_span = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            # SPAN_KIND_INTERNAL = 1, SPAN_KIND_CLIENT = 3
+            "kind": 3 if s.kind == KIND_CLIENT else 1,
+            "startTimeUnixNano": str(int(s.start * 1e9)),
+            "endTimeUnixNano": str(int((s.end or s.start) * 1e9)),
+            "attributes": [
+                {"key": k, "value": _otlp_value(v)} for k, v in attributes.items()
+            ],
+            # STATUS_CODE_OK = 1, STATUS_CODE_ERROR = 2
+            "status": {"code": 1 if s.outcome == OUTCOME_OK else 2},
+        }
+        if s.parent_id:
+            otlp_span["parentSpanId"] = s.parent_id
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": self.SERVICE_NAME},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {"scope": {"name": "mender"}, "spans": [otlp_span]}
+                    ],
+                }
+            ]
+        }
+        self._write(json.dumps(request) + "\n")
+
+
+_configured = False
+
+
+def configure(config) -> None:
+    """Subscribe the sinks given by the configuration"""
+    global _configured  # pylint: disable=global-statement
+    if _configured:
+        return
+    _configured = True
+    if config.TracingFile:
+        log.info(f"Writing trace spans to: {config.TracingFile}")
+        subscribe(JSONLinesSink(config.TracingFile))
+    if config.TracingOTLPFile:
+        log.info(f"Writing OTLP trace spans to: {config.TracingOTLPFile}")
+        subscribe(OTLPFileSink(config.TracingOTLPFile))
@@ -0,0 +1,277 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""End-to-end performance benchmarks of the client against the local mock server
+
+Runs the real state-machine states, and the real client requests, against
+mockserver.py running in a separate process, and reports per phase the wall
+time, the CPU time, and the RSS of the client::
+
+  $ python tests/benchmark/benchmark.py --save-baseline baseline.json
+  $ python tests/benchmark/benchmark.py --baseline baseline.json
+
+When comparing against a baseline, the exit status is non-zero if any result
+regressed by more than the tolerance.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import socket
+import stat
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+UNIT_DATA = os.path.join(HERE, "..", "unit", "data")
+
+# Result name suffix -> True if higher is better
+HIGHER_IS_BETTER = {"_mb_per_s": True}
+
+
+def rss_kib() -> int:
+    with open("/proc/self/status") as fh:
+        for line in fh:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Phase:
+    """Measure the wall time, CPU time, and RSS of the client over a phase"""
+
+    def __init__(self, name: str, results: Dict[str, float]):
+        self.name = name
+        self.results = results
+
+    def __enter__(self) -> "Phase":
+        self.wall = time.monotonic()
+        self.cpu = cpu_seconds()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.results[f"{self.name}_wall_s"] = time.monotonic() - self.wall
+        self.results[f"{self.name}_cpu_s"] = cpu_seconds() - self.cpu
+        self.results[f"{self.name}_rss_kib"] = rss_kib()
+
+
+def timed(fn: Callable[[], object], iterations: int) -> List[float]:
+    samples = []
+    for _ in range(iterations):
+        start = time.monotonic()
+        fn()
+        samples.append(time.monotonic() - start)
+    return samples
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock_server(artifact_size_mib: int) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(HERE, "mockserver.py"),
+            "--port",
+            str(port),
+            "--artifact-size",
+            str(artifact_size_mib),
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("The mock server did not start")
+
+
+def setup_data_store(data_store: str, server_url: str, transport: str):
+    """Point the client settings to a throw-away data store"""
+    import mender.settings.settings as settings
+
+    paths = settings.Path(data_store=data_store)
+    paths.local_conf = os.path.join(data_store, "local_mender.conf")
+    paths.identity_scripts = os.path.join(data_store, "mender-device-identity")
+    paths.inventory_scripts = os.path.join(data_store, "inventory")
+    paths.artifact_info = os.path.join(data_store, "artifact_info")
+    settings.PATHS = paths
+    with open(paths.global_conf, "w") as fh:
+        json.dump({"ServerURL": server_url, "HTTPTransport": transport}, fh)
+    with open(paths.identity_scripts, "w") as fh:
+        fh.write("#!/bin/sh\necho mac=de:ad:be:ef:00:01\n")
+    os.chmod(paths.identity_scripts, stat.S_IRWXU)
+    shutil.copytree(os.path.join(UNIT_DATA, "inventory"), paths.inventory_scripts)
+    with open(paths.device_type, "w") as fh:
+        fh.write("device_type=qemux86-64\n")
+    with open(paths.artifact_info, "w") as fh:
+        fh.write("artifact_name=release-1\n")
+
+
+def run(args) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    server, server_url = start_mock_server(args.artifact_size)
+    data_store = tempfile.mkdtemp(prefix="mender-benchmark-")
+    try:
+        setup_data_store(data_store, server_url, args.transport)
+        results["startup_rss_kib"] = rss_kib()
+        import mender.client.deployments as deployments
+        import mender.statemachine.statemachine as statemachine
+
+        context = statemachine.Context()
+        # The fixed sleeps in between the states are not what is measured
+        with mock.patch("time.sleep"):
+            with Phase("init", results):
+                context = statemachine.Init().run(context)
+
+            with Phase("auth", results):
+                samples = timed(
+                    lambda: statemachine.run_state(statemachine.Authorize(), context),
+                    args.iterations,
+                )
+            context.JWT = statemachine.Authorize().run(context)
+            assert context.JWT, "Failed to authorize with the mock server"
+            results["auth_latency_median_s"] = statistics.median(samples)
+
+            context.deployment_log_handler = mock.Mock()
+
+            def idle_cycle():
+                statemachine.run_state(statemachine.SyncInventory(), context)
+                statemachine.run_state(statemachine.SyncUpdate(), context)
+
+            with Phase("idle", results):
+                samples = timed(idle_cycle, args.iterations)
+            results["idle_cycle_median_s"] = statistics.median(samples)
+            results["idle_cycle_cpu_s"] = results["idle_cpu_s"] / args.iterations
+
+        deployment = deployments.DeploymentInfo(
+            {
+                "id": "benchmark",
+                "artifact": {
+                    "artifact_name": "release-2",
+                    "source": {"uri": server_url + "/artifacts/release-2.mender"},
+                },
+            }
+        )
+        artifact_path = os.path.join(data_store, "artifact.mender")
+        with Phase("download", results):
+            samples = timed(
+                lambda: deployments.download(deployment, artifact_path, ""),
+                args.downloads,
+            )
+        size_mb = os.path.getsize(artifact_path) / (1024 * 1024)
+        assert size_mb == args.artifact_size, "Incomplete download"
+        results["download_mb_per_s"] = size_mb / statistics.median(samples)
+        results["download_cpu_s_per_mb"] = results["download_cpu_s"] / (
+            size_mb * args.downloads
+        )
+        results["peak_rss_kib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    finally:
+        server.kill()
+        server.wait()
+        shutil.rmtree(data_store, ignore_errors=True)
+    return results
+
+
+def regressions(
+    results: Dict[str, float], baseline: Dict[str, float], tolerance: float
+) -> List[str]:
+    """Return the results which are worse than the baseline by more than 'tolerance'
+
+    Only the rates, latencies and CPU times are compared, as the wall time and
+    the RSS of a whole phase are too noisy to be useful.
+    """
+    failed = []
+    for name, value in sorted(results.items()):
+        if name not in baseline or not baseline[name]:
+            continue
+        if not (
+            name.endswith("_median_s")
+            or name.endswith("_cpu_s")
+            or name.endswith("_cpu_s_per_mb")
+            or name.endswith("_mb_per_s")
+            or name == "peak_rss_kib"
+        ):
+            continue
+        higher_is_better = any(name.endswith(k) for k in HIGHER_IS_BETTER)
+        change = (value - baseline[name]) / baseline[name]
+        if (higher_is_better and change < -tolerance) or (
+            not higher_is_better and change > tolerance
+        ):
+            failed.append(f"{name}: {baseline[name]:.4g} -> {value:.4g}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--downloads", type=int, default=3)
+    parser.add_argument(
+        "--artifact-size", type=int, default=64, help="Artifact size in MiB"
+    )
+    parser.add_argument(
+        "--transport",
+        choices=("requests", "http2"),
+        default="requests",
+        help="The HTTP transport to benchmark",
+    )
+    parser.add_argument("--baseline", help="Compare the results against this file")
+    parser.add_argument("--save-baseline", help="Store the results in this file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed relative regression from the baseline",
+    )
+    parser.add_argument("--verbose", "-v", default=False, action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.CRITICAL)
+
+    results = run(args)
+    for name, value in sorted(results.items()):
+        print(f"{name:32} {value:12.4f}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            failed = regressions(results, json.load(fh), args.tolerance)
+        if failed:
+            print("Regressions:")
+            print("\n".join(failed))
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
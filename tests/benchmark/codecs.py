@@ -0,0 +1,87 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Measure the streaming decompression of an Artifact payload, per codec
+
+Builds a rootfs-image Artifact with each compression, and reads its payload
+through the Artifact reader, discarding the data, as the streaming install
+does. Reports the throughput, and the CPU time per MiB of payload. Run it on
+the target device for the numbers that matter; '--cpu 0' pins the benchmark to
+a single core, to approximate a small ARM board on a bigger host::
+
+  $ python tests/benchmark/codecs.py --size-mb 64 --cpu 0
+"""
+import argparse
+import io
+import os
+import platform
+import resource
+import time
+
+import mender.artifact.artifact as artifact
+import mender.artifact.compression as compression
+
+
+def image(size: int) -> bytes:
+    """A payload which compresses, roughly, like a filesystem image"""
+    blocks = []
+    for i in range(0, size, 8192):
+        # Half random, half empty, blocks
+        blocks.append(os.urandom(4096) + b"\0" * 4096 if i % 16384 else b"\0" * 8192)
+    return b"".join(blocks)[:size]
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(raw: bytes) -> tuple:
+    """Return the (wall, cpu) seconds to read all the payload of 'raw'"""
+    start, start_cpu = time.monotonic(), cpu_seconds()
+    reader = artifact.Reader(io.BytesIO(raw))
+    reader.read_header()
+    for payload_file in reader.payload_files():
+        while payload_file.read(1024 * 1024):
+            pass
+    return time.monotonic() - start, cpu_seconds() - start_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=32)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--cpu", type=int, help="Pin the benchmark to this CPU")
+    args = parser.parse_args()
+
+    if args.cpu is not None:
+        os.sched_setaffinity(0, {args.cpu})
+    size = args.size_mb * 1024 * 1024
+    payload = image(size)
+    print(f"{platform.machine()}, {args.size_mb} MiB payload")
+    print(f"{'codec':6} {'ratio':>6} {'MiB/s':>8} {'CPU s/MiB':>10}")
+    for codec in compression.available():
+        buf = io.BytesIO()
+        artifact.write(
+            buf, "benchmark", ["benchmark"], {"rootfs.ext4": payload}, compression=codec
+        )
+        raw = buf.getvalue()
+        wall, cpu = min(measure(raw) for _ in range(args.runs))
+        print(
+            f"{codec or 'none':6} {size / len(raw):6.1f} "
+            f"{args.size_mb / wall:8.1f} {cpu / args.size_mb:10.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""Measure the import time of the client entry point, and of its heaviest imports
+
+Runs 'python -X importtime' on the entry point a number of times, and reports
+the median cumulative import time of 'mender.mender', and the modules which
+took the longest to import::
+
+  $ python tests/benchmark/importtime.py --module mender.mender --max-ms 50
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Dependencies which only the commands talking to the server should import
+HEAVY_MODULES = ("requests", "urllib3", "cryptography")
+
+
+def importtime(module: str) -> Dict[str, Tuple[int, int]]:
+    """Return {module: (self us, cumulative us)} as reported by -X importtime"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    times = {}
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:") :].split("|")
+        if not fields[0].strip().isdigit():
+            continue  # The header
+        times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="mender.mender")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        help="Fail if the median cumulative import time exceeds this",
+    )
+    args = parser.parse_args()
+
+    samples: List[int] = []
+    for _ in range(args.runs):
+        times = importtime(args.module)
+        samples.append(times[args.module][1])
+    median_ms = statistics.median(samples) / 1000
+    print(f"{args.module}: {median_ms:.1f} ms (median of {args.runs} runs)")
+    print("Slowest imports of the last run (cumulative ms):")
+    for name, (_, cumulative) in sorted(times.items(), key=lambda t: -t[1][1])[
+        : args.top
+    ]:
+        print(f"  {cumulative / 1000:8.1f}  {name}")
+    heavy = sorted(m for m in times if m.split(".")[0] in HEAVY_MODULES)
+    if heavy:
+        print(f"Heavy modules imported: {', '.join(heavy)}")
+        sys.exit(1)
+    if args.max_ms is not None and median_ms > args.max_ms:
+        print(f"The import time exceeds {args.max_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
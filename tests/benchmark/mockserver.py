@@ -0,0 +1,287 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""A local mock of the Mender device API, and an Artifact host
+
+Implements just enough of the server for the client to authorize, push its
+inventory, poll for, download, and report the status of a deployment::
+
+  $ python tests/benchmark/mockserver.py --port 8080 --artifact-size 64
+"""
+import argparse
+import json
+import os
+import re
+import socketserver
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, Optional
+
+API = "/api/devices/v1"
+BLOCK_SIZE = 1024 * 1024
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """http.server.ThreadingHTTPServer, which requires Python 3.7"""
+
+    daemon_threads = True
+
+
+class ArtifactSource:
+    """The bytes served from /artifacts/<name>
+
+    Either a file on disk, or 'size' bytes of a repeated pseudo-random block,
+    which is cheap to serve, and still not compressible.
+    """
+
+    def __init__(self, size: int = 0, path: Optional[str] = None):
+        self.path = path
+        self.size = os.path.getsize(path) if path else size
+        self.block = os.urandom(BLOCK_SIZE) if not path else b""
+
+    def read(self, offset: int, length: int) -> bytes:
+        if self.path:
+            with open(self.path, "rb") as fh:
+                fh.seek(offset)
+                return fh.read(length)
+        start = offset % BLOCK_SIZE
+        data = self.block[start : start + length]
+        while len(data) < length:
+            data += self.block[: length - len(data)]
+        return data
+
+
+class MockServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        artifact: Optional[ArtifactSource] = None,
+        artifact_name: str = "release-2",
+        device_type: str = "qemux86-64",
+    ):
+        self.artifact = artifact or ArtifactSource(size=BLOCK_SIZE)
+        self.artifact_name = artifact_name
+        self.device_type = device_type
+        self.deployment_id: Optional[str] = None
+        self.accept_devices = True
+        # Issued JWT -> device identity
+        self.devices: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self.statuses: Dict[str, list] = {}
+        self.logs: Dict[str, list] = {}
+        self.inventory: Dict[str, list] = {}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def artifact_uri(self) -> str:
+        return f"{self.url}/artifacts/{self.artifact_name}.mender"
+
+    def new_deployment(self) -> str:
+        """Make a deployment available to every device polling from now on"""
+        self.deployment_id = str(uuid.uuid4())
+        return self.deployment_id
+
+    def count(self, endpoint: str) -> None:
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def start(self) -> "MockServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+            def _body(self) -> bytes:
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def _reply(self, code: int, body: bytes = b"", content_type=None):
+                self.send_response(code)
+                if content_type:
+                    self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if body and self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def _device(self) -> Optional[str]:
+                token = (self.headers.get("Authorization") or "")[len("Bearer ") :]
+                device = server.devices.get(token)
+                if device is None:
+                    self._reply(401, b'{"error": "unauthorized"}', "application/json")
+                return device
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                body = self._body()
+                if self.path == API + "/authentication/auth_requests":
+                    server.count("auth_requests")
+                    if not server.accept_devices or not self.headers.get(
+                        "X-MEN-Signature"
+                    ):
+                        self._reply(401, b'{"error": "rejected"}', "application/json")
+                        return
+                    id_data = json.loads(body)["id_data"]
+                    jwt = "mock." + uuid.uuid4().hex + ".jwt"
+                    with server.lock:
+                        server.devices[jwt] = id_data
+                    self._reply(200, jwt.encode(), "application/jwt")
+                    return
+                self._reply(404)
+
+            def do_PUT(self):  # pylint: disable=invalid-name
+                body = self._body()
+                if self.path == API + "/inventory/device/attributes":
+                    server.count("inventory_attributes")
+                    device = self._device()
+                    if device is not None:
+                        with server.lock:
+                            server.inventory[device] = json.loads(body)
+                        self._reply(200)
+                    return
+                m = re.match(
+                    API + r"/deployments/device/deployments/([^/]+)/(status|log)$",
+                    self.path,
+                )
+                if m:
+                    deployment_id, kind = m.groups()
+                    server.count("deployment_" + kind)
+                    if self._device() is None:
+                        return
+                    store = server.statuses if kind == "status" else server.logs
+                    with server.lock:
+                        store.setdefault(deployment_id, []).append(json.loads(body))
+                    self._reply(204)
+                    return
+                self._reply(404)
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                if self.path.startswith(
+                    API + "/deployments/device/deployments/next"
+                ):
+                    server.count("deployments_next")
+                    if self._device() is None:
+                        return
+                    if not server.deployment_id:
+                        self._reply(204)
+                        return
+                    body = json.dumps(
+                        {
+                            "id": server.deployment_id,
+                            "artifact": {
+                                "artifact_name": server.artifact_name,
+                                "source": {"uri": server.artifact_uri},
+                                "device_types_compatible": [server.device_type],
+                            },
+                        }
+                    ).encode()
+                    self._reply(200, body, "application/json")
+                    return
+                if self.path.startswith("/artifacts/"):
+                    server.count("artifact_download")
+                    self._send_artifact()
+                    return
+                self._reply(404)
+
+            do_HEAD = do_GET
+
+            def _send_artifact(self):
+                size = server.artifact.size
+                start, end = 0, size - 1
+                m = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range") or "")
+                if m and m.group(1):
+                    start = int(m.group(1))
+                    end = min(int(m.group(2)), size - 1) if m.group(2) else end
+                    if start >= size:
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{size}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                else:
+                    self.send_response(200)
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(end - start + 1))
+                self.end_headers()
+                if self.command == "HEAD":
+                    return
+                offset = start
+                try:
+                    while offset <= end:
+                        length = min(BLOCK_SIZE, end - offset + 1)
+                        self.wfile.write(server.artifact.read(offset, length))
+                        offset += length
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--artifact-size", type=int, default=16, help="Artifact size in MiB"
+    )
+    parser.add_argument("--artifact", help="Serve this Artifact file instead")
+    parser.add_argument(
+        "--deployment",
+        default=False,
+        action="store_true",
+        help="Make a deployment available right away",
+    )
+    args = parser.parse_args()
+    artifact = ArtifactSource(size=args.artifact_size * BLOCK_SIZE, path=args.artifact)
+    server = MockServer(args.host, args.port, artifact)
+    if args.deployment:
+        server.new_deployment()
+    print(f"Mock Mender server listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+"""The fixtures shared by the unit tests"""
+import io
+
+import pytest
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import mender.artifact.artifact as artifact
+
+
+@pytest.fixture(name="rsa_key")
+def fixture_rsa_key():
+    return rsa.generate_private_key(65537, 2048, default_backend())
+
+
+@pytest.fixture(name="make_artifact")
+def fixture_make_artifact():
+    """Return a function building a single payload Artifact, as bytes
+
+    Usage::
+
+      data = make_artifact({"rootfs.ext4": image}, compression="")
+
+    The keyword arguments are passed on to artifact.write().
+    """
+
+    def make_artifact(files=None, name="release-1", **kwargs) -> bytes:
+        buf = io.BytesIO()
+        if files is None:
+            files = {"rootfs.ext4": b"image"}
+        artifact.write(buf, name, ["qemux86-64"], files, **kwargs)
+        return buf.getvalue()
+
+    return make_artifact
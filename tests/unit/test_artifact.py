@@ -0,0 +1,139 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import io
+import os
+import tarfile
+
+import pytest
+
+import mender.artifact.artifact as artifact
+import mender.artifact.compression as compression
+
+
+def member(raw, name):
+    """The TarInfo of the member 'name' of the Artifact 'raw'"""
+    with tarfile.open(fileobj=io.BytesIO(raw)) as tar:
+        return tar.getmember(name)
+
+
+def rewrite(raw, name, transform):
+    """Return the Artifact 'raw' with the data of its member 'name' transformed"""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=io.BytesIO(raw)) as src, tarfile.open(
+        fileobj=buf, mode="w"
+    ) as dst:
+        for info in src.getmembers():
+            data = src.extractfile(info).read()
+            if info.name == name:
+                data = transform(data)
+                info.size = len(data)
+            dst.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def read_all(raw):
+    reader = artifact.Reader(io.BytesIO(raw))
+    reader.read_header()
+    return [payload_file.read() for payload_file in reader.payload_files()]
+
+
+class TestArtifactReader:
+    @pytest.mark.parametrize("suffix", ["", ".gz", ".xz", ".bz2", ".zst"])
+    def test_read(self, suffix, make_artifact):
+        if suffix not in compression.available():
+            pytest.skip("zstandard is not installed")
+        image = os.urandom(300 * 1024)
+        reader = artifact.Reader(
+            io.BytesIO(make_artifact({"rootfs.ext4": image}, compression=suffix))
+        )
+        header = reader.read_header()
+        assert header.artifact_name == "release-1"
+        assert header.device_types == ["qemux86-64"]
+        assert header.payload_type(0) == "rootfs-image"
+        assert header.compression == suffix
+        files = []
+        for payload_file in reader.payload_files():
+            files.append((payload_file.manifest_name, payload_file.read()))
+        assert files == [("data/0000/rootfs.ext4", image)]
+
+    def test_detect_compression(self, monkeypatch, make_artifact):
+        """The compression is detected from the data, and not from the name"""
+        compress = compression.compress
+        monkeypatch.setattr(
+            compression, "compress", lambda data, _: compress(data, ".xz")
+        )
+        reader = artifact.Reader(
+            io.BytesIO(make_artifact({"rootfs.ext4": b"a" * 4096}, compression=".gz"))
+        )
+        assert reader.read_header().artifact_name == "release-1"
+        assert [f.read() for f in reader.payload_files()] == [b"a" * 4096]
+
+    def test_corrupt_payload(self, make_artifact):
+        raw = make_artifact({"rootfs.ext4": b"a" * 4096}, compression="")
+        # Flip the payload data inside the uncompressed data tar
+        raw = raw.replace(b"a" * 4096, b"b" * 4096)
+        reader = artifact.Reader(io.BytesIO(raw))
+        reader.read_header()
+        with pytest.raises(artifact.ArtifactError, match="Checksum mismatch"):
+            for payload_file in reader.payload_files():
+                payload_file.read()
+
+    def test_not_an_artifact(self):
+        with pytest.raises(artifact.ArtifactError):
+            artifact.Reader(io.BytesIO(b"garbage" * 100)).read_header()
+
+    def test_truncated_after_header(self, make_artifact):
+        raw = make_artifact(compression="")
+        truncated = raw[: member(raw, "data/0000.tar").offset]
+        with pytest.raises(artifact.ArtifactError, match="header lists 1"):
+            read_all(truncated)
+
+    @pytest.mark.parametrize("suffix", ["", ".gz"])
+    def test_truncated_payload(self, make_artifact, suffix):
+        raw = make_artifact({"rootfs.ext4": os.urandom(64 * 1024)}, compression=suffix)
+        data = member(raw, "data/0000.tar" + suffix)
+        truncated = raw[: data.offset_data + data.size // 2]
+        with pytest.raises(artifact.ArtifactError, match="Corrupt"):
+            read_all(truncated)
+
+    def test_truncated_compressed_payload(self, make_artifact):
+        raw = make_artifact({"rootfs.ext4": os.urandom(64 * 1024)}, compression=".gz")
+        # A well-formed Artifact, around a cut off gzip stream
+        raw = rewrite(raw, "data/0000.tar.gz", lambda data: data[: len(data) // 2])
+        with pytest.raises(artifact.ArtifactError, match="Corrupt compressed data"):
+            read_all(raw)
+
+    def test_missing_payload_file(self, make_artifact):
+        raw = make_artifact({"a": b"a", "b": b"b"}, compression="")
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w") as tar:
+            info = tarfile.TarInfo("a")
+            info.size = 1
+            tar.addfile(info, io.BytesIO(b"a"))
+        raw = rewrite(raw, "data/0000.tar", lambda _: buf.getvalue())
+        with pytest.raises(artifact.ArtifactError, match="data/0000/b"):
+            read_all(raw)
+
+    @pytest.mark.parametrize(
+        "name, data, match",
+        [
+            ("version", b'{"format": "mender"', "Corrupt version"),
+            ("version", b"[3]", "not a JSON object"),
+            ("manifest", b"\xff\xfe", "Corrupt manifest"),
+        ],
+    )
+    def test_corrupt_header(self, make_artifact, name, data, match):
+        raw = rewrite(make_artifact(compression=""), name, lambda _: data)
+        with pytest.raises(artifact.ArtifactError, match=match):
+            read_all(raw)
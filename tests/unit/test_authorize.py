@@ -0,0 +1,81 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import base64
+import json
+
+import pytest
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+import mender.client.authorize as authorize
+import mender.datastore.datastore as datastore
+
+ID_DATA = {"mac": "de:ad:be:ef:00:01"}
+
+
+@pytest.fixture(name="signings")
+def fixture_signings(monkeypatch):
+    calls = []
+    sign = authorize.key.sign
+
+    def counted(private_key, data):
+        calls.append(data)
+        return sign(private_key, data)
+
+    monkeypatch.setattr(authorize.key, "sign", counted)
+    return calls
+
+
+class TestSignedRequest:
+    def test_signature(self, rsa_key):
+        body, signature = authorize.signed_request(ID_DATA, "tenant", rsa_key)
+        assert json.loads(body)["id_data"] == json.dumps(ID_DATA)
+        rsa_key.public_key().verify(
+            base64.b64decode(signature),
+            body.encode(),
+            padding.PKCS1v15(),
+            hashes.SHA256(),
+        )
+
+    def test_cached(self, tmpdir, rsa_key, signings):
+        path = str(tmpdir.join("auth-request.json"))
+        first = authorize.signed_request(ID_DATA, "tenant", rsa_key, path)
+        assert authorize.signed_request(ID_DATA, "tenant", rsa_key, path) == first
+        assert len(signings) == 1
+
+    def test_changed_inputs(self, tmpdir, rsa_key, signings):
+        path = str(tmpdir.join("auth-request.json"))
+        other_key = rsa.generate_private_key(65537, 2048, default_backend())
+        authorize.signed_request(ID_DATA, "tenant", rsa_key, path)
+        authorize.signed_request(ID_DATA, "other-tenant", rsa_key, path)
+        authorize.signed_request({"mac": "de:ad:be:ef:00:02"}, "", rsa_key, path)
+        body, _ = authorize.signed_request(ID_DATA, "", other_key, path)
+        assert len(signings) == 4
+        assert json.loads(body)["pubkey"] == authorize.key.public_key(other_key)
+
+    def test_corrupt_cache(self, tmpdir, rsa_key, signings):
+        path = str(tmpdir.join("auth-request.json"))
+        datastore.write(path, "{not json")
+        authorize.signed_request(ID_DATA, "tenant", rsa_key, path)
+        datastore.write_json(path, ["unexpected"])
+        authorize.signed_request(ID_DATA, "tenant", rsa_key, path)
+        assert len(signings) == 2
+        authorize.signed_request(ID_DATA, "tenant", rsa_key, path)
+        assert len(signings) == 2
+
+    def test_not_cached(self, rsa_key, signings):
+        authorize.signed_request(ID_DATA, "tenant", rsa_key)
+        authorize.signed_request(ID_DATA, "tenant", rsa_key)
+        assert len(signings) == 2
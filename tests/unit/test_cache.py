@@ -0,0 +1,138 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import io
+import os
+import tarfile
+
+import pytest
+
+import mender.artifact.artifact as artifact
+import mender.cache.cache as cache
+from mender.config.config import Config
+
+
+@pytest.fixture(name="write_artifact")
+def fixture_write_artifact(make_artifact):
+    """Return a function writing an Artifact to 'path', and returning its digest"""
+
+    def write_artifact(path, name, size=64 * 1024):
+        data = make_artifact({"rootfs.ext4": os.urandom(size)}, name=name)
+        with open(path, "wb") as fh:
+            fh.write(data)
+        return cache.manifest_digest(artifact.Reader(io.BytesIO(data)).read_header())
+
+    return write_artifact
+
+
+class TestArtifactCache:
+    @pytest.fixture
+    def artifact_cache(self, tmpdir):
+        return cache.ArtifactCache(os.path.join(tmpdir, "cache"), 300 * 1024)
+
+    def test_hit(self, tmpdir, artifact_cache, write_artifact):
+        src = os.path.join(tmpdir, "artifact.mender")
+        digest = write_artifact(src, "release-1")
+        dst = os.path.join(tmpdir, "restored.mender")
+        assert not artifact_cache.get("release-1", digest, dst)
+        assert artifact_cache.add("release-1", digest, src)
+        # The download location is reused for the next Artifact
+        os.unlink(src)
+        assert artifact_cache.get("release-1", digest, dst)
+        with open(dst, "rb") as fh:
+            assert (
+                cache.manifest_digest(artifact.Reader(fh).read_header()) == digest
+            )
+
+    def test_wrong_name(self, tmpdir, artifact_cache, write_artifact):
+        src = os.path.join(tmpdir, "artifact.mender")
+        digest = write_artifact(src, "release-1")
+        artifact_cache.add("release-1", digest, src)
+        assert not artifact_cache.get("release-2", digest, src + ".out")
+
+    def test_corrupt_entry_is_evicted(self, tmpdir, artifact_cache, write_artifact):
+        src = os.path.join(tmpdir, "artifact.mender")
+        digest = write_artifact(src, "release-1")
+        artifact_cache.add("release-1", digest, src)
+        os.unlink(src)
+        cached = artifact_cache._path(digest)
+        with open(cached, "r+b") as fh:
+            fh.seek(os.path.getsize(cached) // 2)
+            fh.write(b"corrupt")
+        assert not artifact_cache.get("release-1", digest, src)
+        assert not os.path.exists(cached)
+        assert artifact_cache.size() == 0
+
+    @pytest.mark.parametrize("cut", ["header-only", "mid-payload"])
+    def test_truncated_entry_is_evicted(
+        self, tmpdir, artifact_cache, write_artifact, cut
+    ):
+        src = os.path.join(tmpdir, "artifact.mender")
+        digest = write_artifact(src, "release-1")
+        artifact_cache.add("release-1", digest, src)
+        cached = artifact_cache._path(digest)
+        with tarfile.open(cached) as tar:
+            data = tar.getmember("data/0000.tar.gz")
+        size = data.offset if cut == "header-only" else data.offset_data + 1000
+        os.truncate(cached, size)
+        # Truncated in a way the recorded size does not catch
+        index = artifact_cache._load()
+        index[digest]["size"] = size
+        artifact_cache._store(index)
+        assert not cache.verify(cached, digest)
+        assert not artifact_cache.get("release-1", digest, src + ".out")
+        assert not os.path.exists(cached)
+        assert artifact_cache.size() == 0
+
+    def test_rejects_unverified(self, tmpdir, artifact_cache, write_artifact):
+        src = os.path.join(tmpdir, "artifact.mender")
+        write_artifact(src, "release-1")
+        assert not artifact_cache.add("release-1", "0" * 64, src)
+
+    def test_add_verified(self, tmpdir, artifact_cache, write_artifact, monkeypatch):
+        src = os.path.join(tmpdir, "artifact.mender")
+        digest = write_artifact(src, "release-1")
+        monkeypatch.setattr(cache, "verify", lambda *args: pytest.fail("Read again"))
+        assert artifact_cache.add("release-1", digest, src, verified=True)
+        assert artifact_cache.lookup(digest)
+
+    def test_lru_eviction(self, tmpdir, artifact_cache, write_artifact):
+        digests = {}
+        for name in ("release-1", "release-2"):
+            src = os.path.join(tmpdir, f"{name}.mender")
+            digests[name] = write_artifact(src, name, size=100 * 1024)
+            assert artifact_cache.add(name, digests[name], src)
+        # release-1 is now the most recently used
+        assert artifact_cache.get(
+            "release-1", digests["release-1"], os.path.join(tmpdir, "out")
+        )
+        src = os.path.join(tmpdir, "release-3.mender")
+        digests["release-3"] = write_artifact(src, "release-3", size=100 * 1024)
+        assert artifact_cache.add("release-3", digests["release-3"], src)
+        out = os.path.join(tmpdir, "out")
+        assert artifact_cache.get("release-1", digests["release-1"], out)
+        assert artifact_cache.get("release-3", digests["release-3"], out)
+        assert not artifact_cache.get("release-2", digests["release-2"], out)
+        assert artifact_cache.size() <= artifact_cache.max_size
+
+    def test_too_large(self, tmpdir, artifact_cache, write_artifact):
+        src = os.path.join(tmpdir, "artifact.mender")
+        digest = write_artifact(src, "release-1", size=400 * 1024)
+        assert not artifact_cache.add("release-1", digest, src)
+
+
+def test_configure(tmpdir):
+    assert cache.configure(Config({}, {}), str(tmpdir)) is None
+    config = Config({}, {"ArtifactCacheSizeMB": 10})
+    artifact_cache = cache.configure(config, str(tmpdir))
+    assert artifact_cache.max_size == 10 * 1024 * 1024
@@ -0,0 +1,220 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import os
+import shutil
+import socket
+import stat
+import struct
+import sys
+
+import pytest
+
+import mender.scripts.aggregator.aggregator as aggregator
+import mender.scripts.aggregator.inventory as inventory
+import mender.scripts.collectors as collectors
+
+SUPPORT = os.path.join(os.path.dirname(__file__), "..", "..", "support")
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Linux only")
+@pytest.mark.parametrize("name", sorted(collectors.COLLECTORS))
+def test_same_as_script(name):
+    """The collectors produce the attributes of the scripts they replace"""
+    if name == "network" and not shutil.which("ip"):
+        pytest.skip("The network script requires 'ip'")
+    script = os.path.join(SUPPORT, collectors.SCRIPT_PREFIX + name)
+    expected = aggregator.ScriptKeyValueAggregator(script).run()
+    assert expected
+    assert collectors.COLLECTORS[name]() == expected
+
+
+class TestHostinfo:
+    def test_hostinfo(self, tmpdir):
+        cpuinfo = tmpdir.join("cpuinfo")
+        cpuinfo.write(
+            "processor\t: 0\nmodel name\t: Cortex-A53\n"
+            "processor\t: 1\nmodel name\t: Cortex-A53\n"
+            "processor\t: 2\nmodel name\t: Cortex-A72\n"
+            "processor\t: 3\nmodel name\t: Cortex-A53\n"
+        )
+        version = tmpdir.join("version")
+        version.write("Linux version 5.10.17-v7+\n")
+        meminfo = tmpdir.join("meminfo")
+        meminfo.write("MemTotal:         948304 kB\nMemFree:          612124 kB\n")
+        assert collectors.hostinfo(
+            str(cpuinfo), str(version), str(meminfo), str(tmpdir.join("hostname"))
+        ) == {
+            # Only the adjacent repeated models are removed, as by 'uniq'
+            "cpu_model": ["Cortex-A53", "Cortex-A72", "Cortex-A53"],
+            "kernel": ["Linux version 5.10.17-v7+"],
+            "mem_total_kB": ["948304"],
+            "hostname": [""],
+        }
+
+
+class TestOS:
+    @pytest.mark.parametrize(
+        "os_release, expected",
+        [
+            ('NAME="Poky"\nPRETTY_NAME="Poky 3.1.6"\n', "Poky 3.1.6"),
+            ("NAME=Poky\nVERSION='3.1.6'\n", "Poky 3.1.6"),
+            ('PRETTY_NAME=""\nNAME="Poky"\nVERSION="3.1.6"\n', "Poky 3.1.6"),
+        ],
+    )
+    def test_os_release(self, tmpdir, os_release, expected):
+        path = tmpdir.join("os-release")
+        path.write(os_release)
+        assert collectors.os_name((str(path),)) == {"os": [expected]}
+
+    def test_carry_over(self, tmpdir):
+        etc = tmpdir.join("etc-os-release")
+        etc.write('NAME="Poky"\n')
+        usr = tmpdir.join("usr-os-release")
+        usr.write('VERSION="3.1.6"\n')
+        assert collectors.os_name((str(etc), str(usr))) == {"os": ["Poky 3.1.6"]}
+
+    def test_fallbacks(self, tmpdir):
+        lsb = tmpdir.join("lsb-release")
+        lsb.write('DISTRIB_ID=Ubuntu\nDISTRIB_DESCRIPTION="Ubuntu 20.04.2 LTS"\n')
+        issue = tmpdir.join("issue")
+        issue.write("Poky 3.1 \\n \\l\n\n")
+        missing = str(tmpdir.join("missing"))
+        assert collectors.os_name((missing,), str(lsb), str(issue)) == {
+            "os": ["Ubuntu 20.04.2 LTS"]
+        }
+        assert collectors.os_name((missing,), missing, str(issue)) == {
+            "os": ["Poky 3.1 \\n \\l"]
+        }
+        assert collectors.os_name((missing,), missing, missing) == {"os": ["unknown"]}
+
+
+class TestRootfsType:
+    def test_rootfs_type(self, tmpdir):
+        mounts = tmpdir.join("mounts")
+        mounts.write(
+            "rootfs / rootfs rw 0 0\n"
+            "proc /proc proc rw,nosuid,nodev,noexec,relatime 0 0\n"
+            "/dev/mmcblk0p2 / ext4 ro,relatime 0 0\n"
+        )
+        assert collectors.rootfs_type(str(mounts)) == {"rootfs_type": ["ext4"]}
+        mounts.write("proc /proc proc rw 0 0\n")
+        assert collectors.rootfs_type(str(mounts)) == {"rootfs_type": ["Unknown"]}
+
+
+class TestBootloaderIntegration:
+    @pytest.mark.parametrize(
+        "path, machine, expected",
+        [
+            ("boot/efi/EFI/BOOT/mender_grubenv1", "aarch64", "uboot_uefi_grub"),
+            ("boot/efi/EFI/BOOT/mender_grubenv1", "x86_64", "uefi_grub"),
+            ("boot/efi/EFI/BOOT/mender_grubenv1", "riscv64", "unknown_uefi_grub"),
+            ("boot/grub/mender_grubenv1", "i686", "bios_grub"),
+            ("boot/grub/mender_grubenv1", "armv7l", "unknown_grub"),
+            (None, "armv7l", "uboot"),
+        ],
+    )
+    def test_integration(self, tmpdir, path, machine, expected):
+        if path:
+            os.makedirs(str(tmpdir.join(path)))
+        else:
+            tmpdir.mkdir("etc").join("fw_env.config").write("")
+        assert collectors.bootloader_integration(str(tmpdir), machine) == {
+            "mender_bootloader_integration": [expected]
+        }
+
+    def test_unknown(self, tmpdir):
+        assert collectors.bootloader_integration(str(tmpdir), "x86_64") == {
+            "mender_bootloader_integration": ["unknown"]
+        }
+
+
+class TestUpdateModules:
+    def test_update_modules(self, tmpdir):
+        modules = tmpdir.join("modules")
+        assert collectors.update_modules(str(modules)) == {"update_modules": [""]}
+        v3 = modules.mkdir().mkdir("v3")
+        for name, mode in (("single-file", stat.S_IRWXU), ("readme", 0o644)):
+            v3.join(name).write("")
+            os.chmod(str(v3.join(name)), mode)
+        v3.join("deb").write("")
+        os.chmod(str(v3.join("deb")), stat.S_IRWXU)
+        assert collectors.update_modules(str(modules)) == {
+            "update_modules": ["deb", "single-file"]
+        }
+
+
+def netlink_address(family, prefix, index, address, local=None):
+    attributes = b""
+    for kind, value in ((1, address), (2, local)):
+        if value:
+            attributes += struct.pack("=HH", 4 + len(value), kind) + value
+    return struct.pack("=BBBBI", family, prefix, 0, 0, index) + attributes
+
+
+class TestNetwork:
+    def test_parse_address(self):
+        ipv4 = socket.inet_pton(socket.AF_INET, "10.0.0.2")
+        peer = socket.inet_pton(socket.AF_INET, "10.0.0.1")
+        ipv6 = socket.inet_pton(socket.AF_INET6, "fe80::1")
+        # pylint: disable=protected-access
+        assert collectors._parse_address(
+            netlink_address(socket.AF_INET, 24, 2, ipv4)
+        ) == (2, socket.AF_INET, "10.0.0.2/24")
+        assert collectors._parse_address(
+            netlink_address(socket.AF_INET, 32, 3, peer, local=ipv4)
+        ) == (3, socket.AF_INET, "10.0.0.2/32")
+        assert collectors._parse_address(
+            netlink_address(socket.AF_INET6, 64, 2, ipv6)
+        ) == (2, socket.AF_INET6, "fe80::1/64")
+
+    def test_network(self, tmpdir, monkeypatch):
+        net = tmpdir.mkdir("net")
+        for dev, mac in (("lo", "00:00:00:00:00:00"), ("eth0", "02:00:00:00:00:01")):
+            net.mkdir(dev).join("address").write(mac + "\n")
+        net.mkdir("wwan0").join("address").write("\n")
+        names = {1: "lo", 2: "eth0", 3: "wwan0"}
+        monkeypatch.setattr(collectors.socket, "if_indextoname", names.get)
+        found = [
+            (1, socket.AF_INET, "127.0.0.1/8"),
+            (2, socket.AF_INET6, "fe80::1/64"),
+            (2, socket.AF_INET, "10.0.0.2/24"),
+            (3, socket.AF_INET, "100.64.0.2/32"),
+            (2, socket.AF_INET, "10.0.0.3/24"),
+        ]
+        assert collectors.network(str(net), lambda: found) == {
+            "mac_eth0": ["02:00:00:00:00:01"],
+            "network_interfaces": ["eth0", "wwan0"],
+            "ipv4_eth0": ["10.0.0.2/24", "10.0.0.3/24"],
+            "ipv6_eth0": ["fe80::1/64"],
+            "ipv4_wwan0": ["100.64.0.2/32"],
+        }
+
+
+class TestAggregate:
+    def test_replaces_scripts(self, tmpdir, monkeypatch):
+        scripts = tmpdir.mkdir("inventory")
+        for name, output in (
+            ("mender-inventory-os", "echo os=script"),
+            ("mender-inventory-custom", "echo custom=yes"),
+        ):
+            scripts.join(name).write(f"#!/bin/sh\n{output}\n")
+            os.chmod(str(scripts.join(name)), stat.S_IRWXU)
+        monkeypatch.setitem(collectors.COLLECTORS, "os", lambda: {"os": ["collector"]})
+        assert inventory.aggregate(str(scripts), "", "") == {
+            "os": ["script"],
+            "custom": ["yes"],
+        }
+        assert inventory.aggregate(
+            str(scripts), "", "", enabled_collectors=["os", "bogus"]
+        ) == {"os": ["collector"], "custom": ["yes"]}
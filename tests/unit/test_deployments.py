@@ -0,0 +1,434 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import base64
+import io
+import os
+import re
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import urllib3
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+import mender.artifact.artifact as artifact
+import mender.cache.cache as artifactcache
+import mender.client.deployments as deployments
+import mender.security.signature as signature
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """http.server.ThreadingHTTPServer, which requires Python 3.7"""
+
+    daemon_threads = True
+
+
+class ArtifactServer:
+    """Serve 'data' at /artifact.mender, honouring Range requests if asked to
+
+    The first 'stalls' responses stop sending halfway through the body.
+    """
+
+    def __init__(self, data: bytes, ranges: bool = True, stalls: int = 0):
+        self.data = data
+        self.ranges = ranges
+        self.stalls = stalls
+        self.bytes_sent = 0
+        self.release = threading.Event()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                if self.path != "/artifact.mender":
+                    self.send_error(404)
+                    return
+                start, end = 0, len(server.data) - 1
+                m = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range") or "")
+                if server.ranges and m:
+                    start = int(m.group(1))
+                    end = min(int(m.group(2)), end) if m.group(2) else end
+                    self.send_response(206)
+                    self.send_header(
+                        "Content-Range", f"bytes {start}-{end}/{len(server.data)}"
+                    )
+                else:
+                    self.send_response(200)
+                body = server.data[start : end + 1]
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    if server.stalls:
+                        server.stalls -= 1
+                        self.wfile.write(body[: len(body) // 2])
+                        self.wfile.flush()
+                        server.bytes_sent += len(body) // 2
+                        server.release.wait(5)
+                        return
+                    self.wfile.write(body)
+                    server.bytes_sent += len(body)
+                except OSError:
+                    pass
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(
+            target=self.httpd.serve_forever, args=(0.05,), daemon=True
+        ).start()
+
+    def deployment(self, path="/artifact.mender", artifact_name="release-1"):
+        host, port = self.httpd.server_address[:2]
+        return deployments.DeploymentInfo(
+            {
+                "id": "deployment-1",
+                "artifact": {
+                    "artifact_name": artifact_name,
+                    "source": {"uri": f"http://{host}:{port}{path}"},
+                },
+            }
+        )
+
+    def close(self):
+        self.release.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def artifact_data(make_artifact):
+    return make_artifact({"rootfs.ext4": os.urandom(2 * 1024 * 1024)}, compression="")
+
+
+class TestPreflight:
+    @pytest.mark.parametrize("ranges", [True, False])
+    def test_fetches_only_the_header(self, artifact_data, ranges):
+        server = ArtifactServer(artifact_data, ranges=ranges)
+        try:
+            header, size = deployments.preflight(server.deployment(), "")
+        finally:
+            server.close()
+        assert header.artifact_name == "release-1"
+        assert header.device_types == ["qemux86-64"]
+        assert size == len(artifact_data)
+        if ranges:
+            assert server.bytes_sent < 64 * 1024
+
+    def test_unavailable(self, artifact_data):
+        server = ArtifactServer(artifact_data)
+        try:
+            assert deployments.preflight(server.deployment("/missing"), "") is None
+        finally:
+            server.close()
+
+    @pytest.mark.parametrize(
+        "error",
+        [
+            urllib3.exceptions.ReadTimeoutError(None, "", "Read timed out"),
+            urllib3.exceptions.ProtocolError("Connection reset by peer"),
+        ],
+    )
+    def test_read_error(self, artifact_data, monkeypatch, error):
+        def read(*args, **kwargs):
+            raise error
+
+        monkeypatch.setattr(urllib3.response.HTTPResponse, "read", read)
+        server = ArtifactServer(artifact_data)
+        try:
+            assert deployments.preflight(server.deployment(), "") is None
+        finally:
+            server.close()
+
+    def test_not_an_artifact(self):
+        server = ArtifactServer(os.urandom(100 * 1024))
+        try:
+            with pytest.raises(artifact.ArtifactError):
+                deployments.preflight(server.deployment(), "")
+        finally:
+            server.close()
+
+
+class TestCompatibility:
+    @pytest.fixture
+    def header(self, artifact_data):
+        return artifact.Reader(io.BytesIO(artifact_data)).read_header()
+
+    def test_compatible(self, header):
+        artifact.check_compatibility(
+            header, {"device_type": "qemux86-64", "artifact_name": "release-0"}
+        )
+
+    def test_wrong_device_type(self, header):
+        with pytest.raises(artifact.ArtifactError, match="device_type"):
+            artifact.check_compatibility(header, {"device_type": "raspberrypi4"})
+
+    def test_missing_provides(self, header):
+        with pytest.raises(artifact.ArtifactError, match="does not provide"):
+            artifact.check_compatibility(header, {})
+
+
+class TestDownload:
+    def test_resume(self, tmpdir, artifact_data):
+        server = ArtifactServer(artifact_data)
+        path = os.path.join(tmpdir, "artifact.mender")
+        offset = len(artifact_data) // 2
+        with open(path, "wb") as fh:
+            # A partial download, with trailing garbage past the checkpoint
+            fh.write(artifact_data[:offset] + b"garbage")
+        try:
+            assert deployments.download(server.deployment(), path, "", offset=offset)
+        finally:
+            server.close()
+        with open(path, "rb") as fh:
+            assert fh.read() == artifact_data
+        assert server.bytes_sent == len(artifact_data) - offset
+
+    def test_resume_unsupported(self, tmpdir, artifact_data):
+        server = ArtifactServer(artifact_data, ranges=False)
+        path = os.path.join(tmpdir, "artifact.mender")
+        with open(path, "wb") as fh:
+            fh.write(b"x" * 1000)
+        try:
+            assert deployments.download(server.deployment(), path, "", offset=1000)
+        finally:
+            server.close()
+        with open(path, "rb") as fh:
+            assert fh.read() == artifact_data
+
+    def test_progress(self, tmpdir, artifact_data, monkeypatch):
+        monkeypatch.setattr(deployments, "PROGRESS_INTERVAL", 1024 * 1024)
+        server = ArtifactServer(artifact_data)
+        progress = []
+        try:
+            assert deployments.download(
+                server.deployment(),
+                os.path.join(tmpdir, "artifact.mender"),
+                "",
+                progress=progress.append,
+            )
+        finally:
+            server.close()
+        assert progress and all(p >= 1024 * 1024 for p in progress)
+
+    def test_on_received(self, tmpdir, artifact_data):
+        server = ArtifactServer(artifact_data)
+        received = []
+        try:
+            assert deployments.download(
+                server.deployment(),
+                os.path.join(tmpdir, "artifact.mender"),
+                "",
+                min_speed=100 * 1024,
+                on_received=received.append,
+            )
+        finally:
+            server.close()
+        # Every chunk is counted, and not only every PROGRESS_INTERVAL bytes
+        assert len(received) > 1 and received == sorted(received)
+        assert received[-1] == len(artifact_data)
+
+    def test_stall(self, tmpdir, artifact_data):
+        server = ArtifactServer(artifact_data, stalls=1)
+        path = os.path.join(tmpdir, "artifact.mender")
+        start = time.monotonic()
+        try:
+            assert deployments.download(
+                server.deployment(),
+                path,
+                "",
+                min_speed=10000,
+                stall_window=0.2,
+                retries=1,
+            )
+        finally:
+            server.close()
+        assert time.monotonic() - start < 5
+        with open(path, "rb") as fh:
+            assert fh.read() == artifact_data
+        # The retry resumed the download where it stalled
+        assert server.bytes_sent < len(artifact_data) * 1.5
+
+    def test_stall_retries_exhausted(self, tmpdir, artifact_data):
+        server = ArtifactServer(artifact_data, stalls=2)
+        try:
+            assert not deployments.download(
+                server.deployment(),
+                os.path.join(tmpdir, "artifact.mender"),
+                "",
+                min_speed=10000,
+                stall_window=0.2,
+                retries=1,
+            )
+        finally:
+            server.close()
+
+    def test_stall_rootfs(self, tmpdir, make_artifact):
+        image = os.urandom(2 * 1024 * 1024)
+        server = ArtifactServer(
+            make_artifact({"rootfs.ext4": image}, compression=""), stalls=1
+        )
+        device = os.path.join(tmpdir, "rootfs.img")
+        start = time.monotonic()
+        try:
+            assert deployments.download_rootfs(
+                server.deployment(),
+                device,
+                "",
+                min_speed=10000,
+                stall_window=0.2,
+                retries=1,
+            )
+        finally:
+            server.close()
+        assert time.monotonic() - start < 5
+        # The stream was started over
+        with open(device, "rb") as fh:
+            assert fh.read() == image
+
+    def test_chunk_size(self):
+        assert deployments.chunk_size(0, 60) == deployments.MAX_CHUNK_SIZE
+        assert deployments.chunk_size(1024, 60) == 60 * 1024
+        assert deployments.chunk_size(10, 1) == deployments.MIN_CHUNK_SIZE
+
+    def test_not_found(self, tmpdir, artifact_data):
+        server = ArtifactServer(artifact_data)
+        try:
+            assert not deployments.download(
+                server.deployment("/missing"), os.path.join(tmpdir, "a"), ""
+            )
+        finally:
+            server.close()
+
+
+def signed_artifact(private_key):
+    """An Artifact signed with 'private_key', as mender-artifact does"""
+
+    def sign(manifest):
+        return base64.b64encode(
+            private_key.sign(manifest, padding.PKCS1v15(), hashes.SHA256())
+        )
+
+    buf = io.BytesIO()
+    artifact.write(
+        buf,
+        "release-1",
+        ["qemux86-64"],
+        {"rootfs.ext4": os.urandom(1024 * 1024)},
+        compression="",
+        sign=sign if private_key else None,
+    )
+    return buf.getvalue()
+
+
+def verifier(tmpdir, private_key):
+    path = str(tmpdir.join("artifact-verify-key.pem"))
+    with open(path, "wb") as fh:
+        fh.write(
+            private_key.public_key().public_bytes(
+                serialization.Encoding.PEM,
+                serialization.PublicFormat.SubjectPublicKeyInfo,
+            )
+        )
+    return signature.verifier(path)
+
+
+class TestVerifiedDownload:
+    def test_verified_while_downloading(self, tmpdir, rsa_key):
+        data = signed_artifact(rsa_key)
+        verify = verifier(tmpdir, rsa_key)
+        path = str(tmpdir.join("artifact.mender"))
+        server = ArtifactServer(data)
+        try:
+            assert deployments.download(server.deployment(), path, "", verify=verify)
+        finally:
+            server.close()
+        with open(path, "rb") as fh:
+            assert fh.read() == data
+
+    def test_rejected(self, tmpdir, rsa_key):
+        other = rsa.generate_private_key(65537, 2048, default_backend())
+        data = signed_artifact(other)
+        verify = verifier(tmpdir, rsa_key)
+        path = str(tmpdir.join("artifact.mender"))
+        server = ArtifactServer(data)
+        try:
+            assert not deployments.download(
+                server.deployment(), path, "", verify=verify
+            )
+        finally:
+            server.close()
+        assert not os.path.exists(path)
+
+    def test_resumed_download_verified_from_disk(self, tmpdir, rsa_key):
+        data = signed_artifact(rsa_key)
+        verify = verifier(tmpdir, rsa_key)
+        path = str(tmpdir.join("artifact.mender"))
+        with open(path, "wb") as fh:
+            fh.write(data[:1000])
+        server = ArtifactServer(data)
+        try:
+            assert deployments.download(
+                server.deployment(), path, "", offset=1000, verify=verify
+            )
+        finally:
+            server.close()
+        # A corrupt prefix, from before the resumption, is caught
+        with open(path, "r+b") as fh:
+            fh.write(b"\0" * 1000)
+        server = ArtifactServer(data)
+        try:
+            assert not deployments.download(
+                server.deployment(), path, "", offset=1000, verify=verify
+            )
+        finally:
+            server.close()
+
+    @pytest.mark.parametrize("offset", [0, 1000])
+    def test_digest(self, tmpdir, make_artifact, offset):
+        data = make_artifact()
+        digest = artifactcache.manifest_digest(
+            artifact.Reader(io.BytesIO(data)).read_header()
+        )
+        path = str(tmpdir.join("artifact.mender"))
+        for expected, valid in ((digest, True), ("0" * 64, False)):
+            with open(path, "wb") as fh:
+                fh.write(data[:offset])
+            server = ArtifactServer(data)
+            try:
+                assert deployments.download(
+                    server.deployment(), path, "", offset=offset, digest=expected
+                ) == valid
+            finally:
+                server.close()
+            assert os.path.exists(path) == valid
+
+    def test_stream_rootfs_rejected(self, tmpdir, rsa_key):
+        data = signed_artifact(None)
+        verify = verifier(tmpdir, rsa_key)
+        device = str(tmpdir.join("rootfs.img"))
+        server = ArtifactServer(data)
+        try:
+            assert not deployments.download_rootfs(
+                server.deployment(), device, "", verify=verify
+            )
+        finally:
+            server.close()
+        # Nothing reached the partition
+        assert not os.path.exists(device)
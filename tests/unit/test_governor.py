@@ -0,0 +1,194 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import mender.config.config as config
+import mender.governor.governor as governor
+
+
+@pytest.fixture(autouse=True)
+def fast_poll(monkeypatch):
+    monkeypatch.setattr(governor, "PAUSE_POLL_INTERVAL", 0.01)
+
+
+class TestLoad:
+    def test_read_load_average(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(governor.os, "cpu_count", lambda: 4)
+        path = tmpdir.join("loadavg")
+        path.write("6.00 3.10 1.00 2/345 6789\n")
+        assert governor.read_load_average(str(path)) == 1.5
+
+    def test_read_pressure(self, tmpdir):
+        tmpdir.join("cpu").write(
+            "some avg10=12.50 avg60=3.00 avg300=1.00 total=123\n"
+            "full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n"
+        )
+        tmpdir.join("io").write(
+            "some avg10=40.00 avg60=3.00 avg300=1.00 total=123\n"
+            "full avg10=90.00 avg60=0.00 avg300=0.00 total=0\n"
+        )
+        assert governor.read_pressure(str(tmpdir)) == 40.0
+
+    def test_busy(self):
+        loads = iter([2.0, 0.5])
+        limits = governor.Governor(
+            max_load=1.0, max_pressure=50, load=lambda: next(loads), pressure=lambda: 10
+        )
+        assert limits.busy() == "load average 2.00 per CPU"
+        assert limits.busy() is None
+
+    def test_unreadable_load(self):
+        def missing():
+            raise FileNotFoundError("/proc/pressure/cpu")
+
+        assert governor.Governor(max_pressure=10, pressure=missing).busy() is None
+
+
+class TestPause:
+    def test_pauses_while_busy(self):
+        loads = iter([3.0, 3.0, 3.0, 0.1])
+        limits = governor.Governor(max_load=1.0, load=lambda: next(loads))
+        assert limits.pause() > 0
+        with pytest.raises(StopIteration):
+            next(loads)
+
+    def test_max_pause(self):
+        limits = governor.Governor(max_load=1.0, max_pause=0.1, load=lambda: 3.0)
+        assert 0.1 <= limits.pause() < 1
+
+    def test_checked_at_most_every_poll_interval(self, monkeypatch):
+        monkeypatch.setattr(governor, "PAUSE_POLL_INTERVAL", 60)
+        checks = []
+        limits = governor.Governor(
+            max_load=1.0, load=lambda: checks.append(1) or 0.1
+        )
+        for _ in range(10):
+            assert limits.pause() == 0
+        assert len(checks) == 1
+
+    def test_disabled(self):
+        limits = governor.Governor(load=lambda: pytest.fail("Checked the load"))
+        assert limits.pause() == 0
+
+
+class TestPriority:
+    def test_lowered_priority(self):
+        niceness = os.getpriority(os.PRIO_PROCESS, 0)
+        seen = []
+        limits = governor.Governor(nice=5, io_class="best-effort", io_priority=7)
+        with limits.lowered_priority():
+            seen.append(os.getpriority(os.PRIO_PROCESS, 0))
+            # Threads started in the block inherit the priority
+            thread = threading.Thread(
+                target=lambda: seen.append(os.getpriority(os.PRIO_PROCESS, 0))
+            )
+            thread.start()
+            thread.join()
+            ioprio = governor.get_ioprio()
+        assert seen == [min(19, niceness + 5)] * 2
+        if ioprio is not None:
+            assert ioprio == (2 << governor.IOPRIO_CLASS_SHIFT) | 7
+        if os.geteuid() == 0:
+            assert os.getpriority(os.PRIO_PROCESS, 0) == niceness
+
+    @pytest.mark.parametrize("tools", [True, False])
+    def test_run(self, tmpdir, monkeypatch, tools):
+        if not tools:
+            # Without nice, and ionice, the daemon sets the priorities
+            monkeypatch.setattr(governor.shutil, "which", lambda name: None)
+        cgroup = tmpdir.mkdir("mender-update")
+        cgroup.join("cgroup.procs").write("")
+        limits = governor.Governor(nice=3, io_class="idle", cgroup=str(cgroup))
+        result = limits.run(
+            [
+                sys.executable,
+                "-c",
+                "import os, sys; sys.stdin.read(); print(os.getpid(), os.nice(0))",
+            ],
+            input=b"",
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        pid, niceness = result.stdout.split()
+        assert int(niceness) == min(19, os.nice(0) + 3)
+        # The daemon moved the subprocess into the cgroup. nice, and ionice,
+        # exec the command in the same process
+        assert cgroup.join("cgroup.procs").read() == pid.decode()
+
+    def test_run_failure(self):
+        with pytest.raises(subprocess.CalledProcessError):
+            governor.Governor(nice=1).run(["false"], check=True)
+        assert governor.Governor().run(["false"]).returncode == 1
+
+class TestCgroup:
+    def test_setup(self, tmpdir):
+        root = tmpdir.mkdir("cgroup")
+        limits = governor.Governor(
+            cgroup=str(root.join("mender-update")),
+            cgroup_limits={"cpu.max": "50000 100000", "memory.max": "256M"},
+        )
+        # Not a cgroup filesystem
+        assert limits.setup_cgroup() is None
+        root.join("mender-update", "cgroup.procs").write("")
+        procs = limits.setup_cgroup()
+        assert procs == str(root.join("mender-update", "cgroup.procs"))
+        assert root.join("cgroup.subtree_control").read() == "+cpu +memory"
+        assert root.join("mender-update", "cpu.max").read() == "50000 100000"
+        assert root.join("mender-update", "memory.max").read() == "256M"
+        # Only an empty cgroup can be removed; a plain directory stands in here
+        for name in ("cpu.max", "memory.max", "cgroup.procs"):
+            root.join("mender-update", name).remove()
+        limits.release_cgroup()
+        assert not root.join("mender-update").exists()
+
+    def test_disabled(self):
+        assert governor.Governor().setup_cgroup() is None
+
+
+class TestConfigure:
+    def test_defaults(self):
+        limits = governor.configure(config.Config({}, {}))
+        assert limits.nice == 10
+        assert limits.ioprio == (2 << governor.IOPRIO_CLASS_SHIFT) | 7
+        assert not limits.cgroup and not limits.cgroup_limits
+        assert not limits.max_load and not limits.max_pressure
+
+    def test_configure(self):
+        limits = governor.configure(
+            config.Config(
+                {
+                    "UpdateNice": 0,
+                    "UpdateIOClass": "idle",
+                    "UpdateCgroup": "/sys/fs/cgroup/mender-update",
+                    "UpdateCPUMax": "50000 100000",
+                    "UpdateIOMax": "179:0 wbps=10485760",
+                    "UpdatePauseLoadAverage": "1.5",
+                    "UpdatePausePressure": "bogus",
+                },
+                {},
+            )
+        )
+        assert limits.nice == 0
+        assert limits.ioprio == (3 << governor.IOPRIO_CLASS_SHIFT) | 7
+        assert limits.cgroup_limits == {
+            "cpu.max": "50000 100000",
+            "io.max": "179:0 wbps=10485760",
+        }
+        assert limits.max_load == 1.5
+        assert limits.max_pressure == 0
@@ -0,0 +1,48 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ("requests", "urllib3", "cryptography")
+
+CHECK_IMPORTS = """
+import sys
+sys.argv = {argv!r}
+import mender.mender
+mender.mender.main()
+heavy = [m for m in sys.modules if m.split(".")[0] in {heavy!r}]
+assert not heavy, heavy
+"""
+
+
+class TestLazyImports:
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            ["mender", "--version"],
+            ["mender", "--no-syslog"],
+            ["mender", "--no-syslog", "show-artifact"],
+        ],
+    )
+    def test_light_commands_do_not_import_heavy_modules(self, argv):
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                CHECK_IMPORTS.format(argv=argv, heavy=HEAVY_MODULES),
+            ],
+            check=True,
+        )
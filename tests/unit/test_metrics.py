@@ -0,0 +1,95 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import os
+
+import pytest
+
+import mender.config.config as config
+import mender.metrics.metrics as metrics
+
+
+class TestRegistry:
+    def test_disabled_registry_records_nothing(self):
+        registry = metrics.Registry(enabled=False)
+        counter = metrics.Counter("test_total", "A test counter.", registry=registry)
+        counter.inc(endpoint="foo")
+        with metrics.Histogram("test_seconds", "A test.", registry=registry).time():
+            pass
+        assert counter.value(endpoint="foo") == 0
+        assert registry.render() == (
+            "# HELP test_total A test counter.\n"
+            "# TYPE test_total counter\n"
+            "# HELP test_seconds A test.\n"
+            "# TYPE test_seconds histogram\n"
+        )
+
+    def test_render_counter_and_gauge(self):
+        registry = metrics.Registry(enabled=True)
+        counter = metrics.Counter("req_total", "Requests.", registry=registry)
+        gauge = metrics.Gauge("speed", "Speed.", registry=registry)
+        counter.inc(endpoint="auth", code="200")
+        counter.inc(2, endpoint="auth", code="200")
+        gauge.set(1.5)
+        assert counter.value(code="200", endpoint="auth") == 3
+        assert registry.render() == (
+            "# HELP req_total Requests.\n"
+            "# TYPE req_total counter\n"
+            'req_total{code="200",endpoint="auth"} 3\n'
+            "# HELP speed Speed.\n"
+            "# TYPE speed gauge\n"
+            "speed 1.5\n"
+        )
+
+    def test_render_histogram(self):
+        registry = metrics.Registry(enabled=True)
+        histogram = metrics.Histogram(
+            "dur_seconds", "Duration.", buckets=(1, 5), registry=registry
+        )
+        histogram.observe(0.5, state="Idle")
+        histogram.observe(3, state="Idle")
+        histogram.observe(10, state="Idle")
+        assert histogram.count(state="Idle") == 3
+        assert histogram.sum(state="Idle") == 13.5
+        assert registry.render().splitlines()[2:] == [
+            'dur_seconds_bucket{state="Idle",le="1"} 1',
+            'dur_seconds_bucket{state="Idle",le="5"} 2',
+            'dur_seconds_bucket{state="Idle",le="+Inf"} 3',
+            'dur_seconds_sum{state="Idle"} 13.5',
+            'dur_seconds_count{state="Idle"} 3',
+        ]
+
+    def test_label_escaping(self):
+        registry = metrics.Registry(enabled=True)
+        counter = metrics.Counter("esc_total", "Escaping.", registry=registry)
+        counter.inc(script='a"b\\c')
+        assert 'esc_total{script="a\\"b\\\\c"} 1' in registry.render()
+
+    def test_write_textfile(self, tmpdir):
+        registry = metrics.Registry(enabled=True)
+        metrics.Counter("file_total", "File.", registry=registry).inc()
+        path = os.path.join(tmpdir, "mender.prom")
+        metrics.write_textfile(path, registry)
+        with open(path) as fh:
+            assert fh.read() == registry.render()
+        assert not os.path.exists(path + ".tmp")
+
+
+@pytest.mark.parametrize(
+    "value, enabled",
+    [(True, True), (False, False), ("true", True), ("False", False), ("yes", False)],
+)
+def test_configure_enabled(value, enabled):
+    registry = metrics.Registry()
+    metrics.configure(config.Config({"MetricsEnabled": value}, {}), registry)
+    assert registry.enabled is enabled
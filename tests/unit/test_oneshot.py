@@ -0,0 +1,153 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import argparse
+import os
+
+import pytest
+
+import mender.client.inventory as client_inventory
+import mender.datastore.datastore as datastore
+import mender.mender as mender
+import mender.oneshot.oneshot as oneshot
+import mender.scripts.aggregator.inventory as inventory
+import mender.settings.settings as settings
+from mender.client import HTTPUnathorized
+
+
+@pytest.fixture
+def data_store(tmpdir, monkeypatch):
+    paths = settings.Path(data_store=str(tmpdir))
+    monkeypatch.setattr(settings, "PATHS", paths)
+    return paths
+
+
+@pytest.fixture
+def authorizations(monkeypatch):
+    issued = []
+
+    def authorize(context):
+        context.JWT = f"JWT-{len(issued)}"
+        context.fresh_JWT = True
+        issued.append(context.JWT)
+        datastore.write(settings.PATHS.authtoken, context.JWT)
+        return True
+
+    monkeypatch.setattr(oneshot, "authorize", authorize)
+    return issued
+
+
+class TestOneShot:
+    def test_load_stored_state(self, data_store):
+        datastore.write(data_store.authtoken, "stored-JWT")
+        datastore.write_json(data_store.identity_data, {"mac": "de:ad:be:ef"})
+        context = oneshot.load()
+        assert context.JWT == "stored-JWT"
+        assert context.identity_data == {"mac": "de:ad:be:ef"}
+        assert not context.fresh_JWT
+
+    def test_stored_jwt_is_reused(self, data_store, authorizations):
+        datastore.write(data_store.authtoken, "stored-JWT")
+        context = oneshot.load()
+        assert oneshot.with_authorization(context, lambda JWT: JWT) == "stored-JWT"
+        assert authorizations == []
+
+    def test_missing_jwt(self, data_store, authorizations):
+        context = oneshot.load()
+        assert oneshot.with_authorization(context, lambda JWT: JWT) == "JWT-0"
+        assert authorizations == ["JWT-0"]
+        assert datastore.read(data_store.authtoken) == "JWT-0"
+
+    def test_rejected_jwt(self, data_store, authorizations):
+        datastore.write(data_store.authtoken, "expired-JWT")
+        context = oneshot.load()
+        used = []
+
+        def request(JWT):
+            used.append(JWT)
+            if JWT == "expired-JWT":
+                raise HTTPUnathorized()
+            return True
+
+        assert oneshot.with_authorization(context, request)
+        assert used == ["expired-JWT", "JWT-0"]
+
+    def test_rejected_new_jwt(self, data_store, authorizations):
+        datastore.write(data_store.authtoken, "expired-JWT")
+        context = oneshot.load()
+        used = []
+
+        def request(JWT):
+            used.append(JWT)
+            raise HTTPUnathorized()
+
+        assert oneshot.with_authorization(context, request) is None
+        assert used == ["expired-JWT", "JWT-0"]
+        used.clear()
+        assert oneshot.with_authorization(context, request) is None
+        assert used == ["JWT-0"]
+
+    def test_failure_is_not_retried(self, data_store, authorizations):
+        datastore.write(data_store.authtoken, "stored-JWT")
+        context = oneshot.load()
+        used = []
+
+        def request(JWT):
+            used.append(JWT)
+            return False
+
+        assert oneshot.with_authorization(context, request) is False
+        # Such as a server error: a new JWT would not help
+        assert used == ["stored-JWT"]
+        assert authorizations == []
+
+
+class TestDatastore:
+    def test_atomic_write(self, tmpdir):
+        path = os.path.join(tmpdir, "authtoken")
+        datastore.write(path, "foo")
+        datastore.write(path, "bar")
+        assert datastore.read(path) == "bar"
+        assert not os.path.exists(path + ".tmp")
+        assert os.stat(path).st_mode & 0o777 == 0o600
+
+    def test_corrupt_json(self, tmpdir):
+        path = os.path.join(tmpdir, "identity.json")
+        datastore.write(path, "{not json")
+        assert datastore.read_json(path) is None
+        assert datastore.read_json(os.path.join(tmpdir, "missing")) is None
+
+
+class TestReport:
+    def test_unusable_outbox(self, data_store, caplog):
+        datastore.write(data_store.lockfile_path, "deployment-1")
+        # sqlite can not open a directory as its database
+        os.makedirs(data_store.outbox)
+        args = argparse.Namespace(data=None, success=True, failure=False)
+        with pytest.raises(SystemExit) as e:
+            mender.report(args)
+        assert e.value.code == 1
+        assert "Failed to use the report outbox" in caplog.text
+
+
+class TestSendInventory:
+    def test_rejected_jwt(self, data_store, authorizations, monkeypatch, caplog):
+        def request(*args):
+            raise HTTPUnathorized()
+
+        monkeypatch.setattr(inventory, "aggregate", lambda *args, **kwargs: {"a": 1})
+        monkeypatch.setattr(client_inventory, "request", request)
+        with pytest.raises(SystemExit) as e:
+            mender.send_inventory(argparse.Namespace(data=None))
+        assert e.value.code == 1
+        assert "Failed to upload the inventory" in caplog.text
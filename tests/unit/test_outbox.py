@@ -0,0 +1,134 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import logging
+import os
+import threading
+
+import pytest
+
+import mender.log.log as menderlog
+import mender.outbox.outbox as outbox
+
+
+@pytest.fixture
+def box(tmpdir):
+    b = outbox.Outbox(os.path.join(tmpdir, "outbox.sqlite"))
+    yield b
+    b.close()
+
+
+class TestOutbox:
+    def test_collapse_statuses(self, box):
+        box.status("deployment-1", "downloading")
+        box.status("deployment-2", "downloading")
+        box.log("deployment-1", [{"message": "first"}])
+        box.status("deployment-1", "failure")
+        box.log("deployment-1", [{"message": "second"}])
+        pending = [(r.deployment_id, r.kind, r.payload) for r in box.pending()]
+        assert pending == [
+            ("deployment-2", "status", {"status": "downloading"}),
+            ("deployment-1", "status", {"status": "failure"}),
+            ("deployment-1", "log", {"messages": [{"message": "second"}]}),
+        ]
+
+    def test_durable(self, tmpdir):
+        path = os.path.join(tmpdir, "outbox.sqlite")
+        b = outbox.Outbox(path)
+        b.status("deployment-1", "success")
+        b.close()
+        b = outbox.Outbox(path)
+        assert [r.payload for r in b.pending()] == [{"status": "success"}]
+        b.close()
+
+    def test_flush(self, box):
+        for i in range(5):
+            box.status(f"deployment-{i}", "success")
+        sent = []
+
+        def send(report):
+            sent.append(report.deployment_id)
+            return True
+
+        assert box.flush(send, batch_size=2)
+        assert sent == [f"deployment-{i}" for i in range(5)]
+        assert box.pending() == []
+
+    def test_flush_stops_at_failure(self, box):
+        box.status("deployment-1", "success")
+        box.status("deployment-2", "success")
+        sent = []
+
+        def send(report):
+            sent.append(report.deployment_id)
+            return False
+
+        assert not box.flush(send)
+        assert sent == ["deployment-1"]
+        assert len(box.pending()) == 2
+
+    def test_worker_retries(self, box, monkeypatch):
+        monkeypatch.setattr(outbox, "MIN_BACKOFF", 0.01)
+        delivered = threading.Event()
+        attempts = []
+
+        def send(report):
+            attempts.append(report.deployment_id)
+            if len(attempts) < 3:
+                return False
+            delivered.set()
+            return True
+
+        box.start(send)
+        box.status("deployment-1", "failure")
+        assert delivered.wait(5)
+        box.stop()
+        assert attempts == ["deployment-1"] * 3
+        assert box.pending() == []
+
+    def test_wake(self, box, monkeypatch):
+        """A retry backing off is cut short, such as once re-authorized"""
+        monkeypatch.setattr(outbox, "MIN_BACKOFF", 60)
+        failed, delivered = threading.Event(), threading.Event()
+
+        def send(report):
+            if not failed.is_set():
+                failed.set()
+                return False
+            delivered.set()
+            return True
+
+        box.start(send)
+        box.status("deployment-1", "failure")
+        assert failed.wait(5)
+        box.wake()
+        assert delivered.wait(5)
+        box.stop()
+        assert box.pending() == []
+
+
+def test_read_deployment_log(tmpdir):
+    path = os.path.join(tmpdir, "deployment.log")
+    handler = logging.FileHandler(path)
+    handler.setFormatter(menderlog.DeploymentLogFormatter())
+    record = logging.LogRecord("mender", logging.ERROR, "", 0, "Install failed", (), None)
+    handler.emit(record)
+    handler.close()
+    with open(path, "a") as fh:
+        fh.write("output from a script\n")
+    messages = menderlog.read_deployment_log(path)
+    assert [(m["level"], m["message"]) for m in messages] == [
+        ("ERROR", "Install failed"),
+        ("INFO", "output from a script"),
+    ]
+    assert messages[0]["timestamp"].endswith("Z")
@@ -0,0 +1,152 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import io
+import os
+import subprocess
+import sys
+import tarfile
+
+import pytest
+import requests
+
+import mender.artifact.artifact as artifact
+import mender.cache.cache as artifactcache
+import mender.metrics.metrics as metrics
+import mender.peer.peer as peer
+
+SERVE_IN_A_PROCESS = """
+import sys, time
+import mender.cache.cache as artifactcache
+import mender.peer.peer as peer
+server = peer.serve(artifactcache.ArtifactCache(sys.argv[1], 1 << 30), "127.0.0.1", 0)
+print(server.server_address[1], flush=True)
+time.sleep(60)
+"""
+
+
+@pytest.fixture(name="shared")
+def fixture_shared(tmpdir, make_artifact):
+    """An Artifact, and a cache holding it"""
+    data = make_artifact({"rootfs.ext4": os.urandom(512 * 1024)})
+    header = artifact.Reader(io.BytesIO(data)).read_header()
+    digest = artifactcache.manifest_digest(header)
+    src = str(tmpdir.join("downloaded.mender"))
+    with open(src, "wb") as fh:
+        fh.write(data)
+    cache = artifactcache.ArtifactCache(str(tmpdir.join("cache")), 1 << 30)
+    assert cache.add("release-1", digest, src)
+    return cache, data, digest
+
+
+@pytest.fixture(name="start")
+def fixture_start():
+    servers = []
+
+    def start(cache):
+        server = peer.serve(cache, "127.0.0.1", 0)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+class TestServe:
+    def test_get(self, shared, start):
+        cache, data, digest = shared
+        url = peer.artifact_url(start(cache), digest)
+        assert requests.get(url).content == data
+        response = requests.get(url, headers={"Range": "bytes=100-199"})
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == f"bytes 100-199/{len(data)}"
+        assert response.content == data[100:200]
+        response = requests.get(url, headers={"Range": f"bytes={len(data)}-"})
+        assert response.status_code == 416
+
+    def test_not_found(self, shared, start):
+        cache, _, digest = shared
+        base = start(cache)
+        assert requests.get(peer.artifact_url(base, "0" * 64)).status_code == 404
+        for path in (f"/artifacts/../{digest}", "/artifacts/", "/index.json"):
+            assert requests.get(base + path).status_code == 404
+
+
+class TestFetch:
+    def test_first_peer_having_it(self, tmpdir, shared, start, monkeypatch):
+        monkeypatch.setattr(metrics.REGISTRY, "enabled", True)
+        before = metrics.PEER_BYTES.value(direction="downloaded")
+        cache, data, digest = shared
+        empty = artifactcache.ArtifactCache(str(tmpdir.join("empty")), 1 << 30)
+        path = str(tmpdir.join("artifact.mender"))
+        assert peer.fetch([start(empty), start(cache)], digest, path, "")
+        with open(path, "rb") as fh:
+            assert fh.read() == data
+        after = metrics.PEER_BYTES.value(direction="downloaded")
+        assert after - before == len(data)
+
+    def test_corrupt_peer(self, tmpdir, shared, start):
+        cache, data, digest = shared
+        with open(cache.lookup(digest), "r+b") as fh:
+            fh.seek(len(data) // 2)
+            fh.write(b"corrupt")
+        path = str(tmpdir.join("artifact.mender"))
+        assert not peer.fetch([start(cache)], digest, path, "")
+        assert not os.path.exists(path)
+
+    @pytest.mark.parametrize("cut", ["header-only", "mid-payload"])
+    def test_truncated_peer(self, tmpdir, shared, start, cut):
+        cache, _, digest = shared
+        with tarfile.open(cache.lookup(digest)) as tar:
+            member = tar.getmember("data/0000.tar.gz")
+        os.truncate(
+            cache.lookup(digest),
+            member.offset if cut == "header-only" else member.offset_data + 1000,
+        )
+        path = str(tmpdir.join("artifact.mender"))
+        assert not peer.fetch([start(cache)], digest, path, "")
+        assert not os.path.exists(path)
+
+    def test_verification_error(self, tmpdir, shared, start, monkeypatch):
+        cache, _, digest = shared
+
+        def verify(*_):
+            raise tarfile.ReadError("unexpected end of data")
+
+        monkeypatch.setattr(peer.deployments, "verify_artifact", verify)
+        path = str(tmpdir.join("artifact.mender"))
+        assert not peer.fetch([start(cache)], digest, path, "")
+        assert not os.path.exists(path)
+
+    def test_unreachable_peer(self, tmpdir, shared):
+        _, _, digest = shared
+        path = str(tmpdir.join("artifact.mender"))
+        assert not peer.fetch(["http://127.0.0.1:1"], digest, path, "")
+
+    def test_peer_process(self, tmpdir, shared):
+        cache, data, digest = shared
+        process = subprocess.Popen(
+            [sys.executable, "-c", SERVE_IN_A_PROCESS, cache.directory],
+            stdout=subprocess.PIPE,
+        )
+        try:
+            port = int(process.stdout.readline())
+            path = str(tmpdir.join("artifact.mender"))
+            assert peer.fetch([f"http://127.0.0.1:{port}"], digest, path, "")
+            with open(path, "rb") as fh:
+                assert fh.read() == data
+        finally:
+            process.kill()
+            process.wait()
@@ -0,0 +1,116 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import io
+import os
+import threading
+
+import pytest
+
+import mender.metrics.metrics as metrics
+import mender.pipeline.pipeline as pipeline
+
+
+@pytest.fixture(name="registry")
+def fixture_registry(monkeypatch):
+    monkeypatch.setattr(metrics.REGISTRY, "enabled", True)
+    metrics.PIPELINE_QUEUE_DEPTH.reset()
+    yield metrics.REGISTRY
+    metrics.PIPELINE_QUEUE_DEPTH.reset()
+
+
+class TestStage:
+    def test_consumes_in_order(self):
+        consumed = []
+        with pipeline.Stage("write", consumed.append) as stage:
+            for i in range(100):
+                stage.put(i)
+        assert consumed == list(range(100))
+
+    def test_runs_in_a_thread(self):
+        threads = set()
+        with pipeline.Stage(
+            "write", lambda _: threads.add(threading.current_thread())
+        ) as stage:
+            stage.put(b"data")
+        assert threads and threading.current_thread() not in threads
+
+    def test_error(self):
+        def consume(chunk):
+            if chunk == 3:
+                raise OSError("No space left on device")
+
+        with pytest.raises(OSError, match="No space"):
+            with pipeline.Stage("write", consume, depth=1) as stage:
+                # Does not block on the full queue after the error
+                for i in range(100):
+                    stage.put(i)
+
+    def test_queue_depth(self, registry):
+        release = threading.Event()
+        with pipeline.Stage("write", lambda _: release.wait(), depth=2) as stage:
+            for i in range(3):
+                stage.put(i)
+            # One chunk is being consumed, and two are waiting
+            assert metrics.PIPELINE_QUEUE_DEPTH.value(stage="write") == 2
+            release.set()
+        assert metrics.PIPELINE_QUEUE_DEPTH.value(stage="write") == 0
+
+
+class TestPrefetcher:
+    @pytest.mark.parametrize("chunk_size", [1, 1000, 1 << 20])
+    def test_read(self, chunk_size):
+        data = os.urandom(100 * 1024)
+        with pipeline.Prefetcher("verify", io.BytesIO(data), chunk_size) as fileobj:
+            assert fileobj.read(10) == data[:10]
+            assert fileobj.read() == data[10:]
+            assert fileobj.read(10) == b""
+
+    def test_error(self):
+        class Failing(io.RawIOBase):
+            def __init__(self):
+                super().__init__()
+                self.reads = 0
+
+            def readable(self):
+                return True
+
+            def readinto(self, b):
+                self.reads += 1
+                if self.reads > 2:
+                    raise ConnectionResetError("Connection reset by peer")
+                b[:4] = b"data"
+                return 4
+
+        with pipeline.Prefetcher("verify", Failing(), 4) as fileobj:
+            # The data read before the error comes first
+            assert fileobj.read(4) == b"data"
+            assert fileobj.read(4) == b"data"
+            with pytest.raises(ConnectionResetError):
+                fileobj.read(4)
+
+    def test_close_unblocks_the_reader_thread(self):
+        fileobj = pipeline.Prefetcher("verify", io.BytesIO(b"x" * 1000), 1, depth=1)
+        with fileobj:
+            fileobj.read(1)
+        # pylint: disable=protected-access
+        fileobj._thread.join(1)
+        assert not fileobj._thread.is_alive()
+
+    def test_progress(self):
+        done = []
+        with pipeline.Prefetcher(
+            "verify", io.BytesIO(b"x" * 1000), 300, progress=done.append
+        ) as fileobj:
+            assert fileobj.read() == b"x" * 1000
+        assert done == [300, 600, 900, 1000]
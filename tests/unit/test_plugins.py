@@ -0,0 +1,190 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import os
+import stat
+import threading
+import time
+
+import pytest
+
+import mender.scripts.aggregator.identity as identity
+import mender.scripts.aggregator.inventory as inventory
+import mender.scripts.aggregator.plugins as plugins
+
+
+@pytest.fixture(name="plugin_dir")
+def fixture_plugin_dir(tmpdir, monkeypatch):
+    monkeypatch.setattr(plugins, "entry_points", lambda *args: ())
+    return tmpdir.mkdir("plugins")
+
+
+class TestPluginAggregator:
+    def test_normalize(self):
+        assert plugins.PluginAggregator(
+            "test", lambda: {"key": "value", "list": ["a", 1], "number": 2}
+        ).run() == {"key": ["value"], "list": ["a", "1"], "number": ["2"]}
+
+    def test_failure(self):
+        def fail():
+            raise RuntimeError("boom")
+
+        assert plugins.PluginAggregator("fail", fail).run() == {}
+        assert plugins.PluginAggregator("none", lambda: None).run() == {}
+
+    def test_limits(self):
+        assert (
+            plugins.PluginAggregator(
+                "keys", lambda: {str(i): "x" for i in range(3)}, max_keys=2
+            ).run()
+            == {}
+        )
+        assert (
+            plugins.PluginAggregator("size", lambda: {"k": "x" * 64}, max_size=32).run()
+            == {}
+        )
+
+    def test_timeout(self):
+        release = threading.Event()
+        calls = []
+
+        def hang():
+            calls.append(1)
+            release.wait(10)
+            return {"key": "value"}
+
+        plugin = plugins.PluginAggregator("hang", hang, timeout=0.1)
+        assert plugin.run() == {}
+        # Not started again while the previous run hangs
+        assert plugin.run() == {}
+        assert len(calls) == 1
+        release.set()
+        while plugins._busy("hang"):  # pylint: disable=protected-access
+            release.wait(0.01)
+        assert plugin.run() == {"key": ["value"]}
+
+
+class TestDiscovery:
+    def test_directory(self, plugin_dir):
+        plugin_dir.join("network.py").write(
+            "def inventory():\n    return {'ipv4_eth0': ['10.0.0.2/24']}\n"
+        )
+        plugin_dir.join("serial.py").write(
+            "def identity():\n    return {'serial': '1234'}\n"
+        )
+        plugin_dir.join("broken.py").write("import nonexistent\n")
+        plugin_dir.join("README").write("Not a plugin")
+        found = plugins.plugins(plugins.INVENTORY, str(plugin_dir))
+        assert [os.path.basename(p.name) for p in found] == ["network.py"]
+        found = plugins.plugins(plugins.IDENTITY, str(plugin_dir))
+        assert [p.run() for p in found] == [{"serial": ["1234"]}]
+
+    def test_reload(self, plugin_dir):
+        path = plugin_dir.join("plugin.py")
+        path.write("def inventory():\n    return {'version': '1'}\n")
+        (plugin,) = plugins.plugins(plugins.INVENTORY, str(plugin_dir))
+        assert plugin.run() == {"version": ["1"]}
+        path.write("def inventory():\n    return {'version': '2'}\n")
+        os.utime(str(path), (0, 0))
+        (plugin,) = plugins.plugins(plugins.INVENTORY, str(plugin_dir))
+        assert plugin.run() == {"version": ["2"]}
+
+    def test_entry_points(self, monkeypatch):
+        monkeypatch.setattr(
+            plugins,
+            "entry_points",
+            lambda *args: (("mender.inventory:test", lambda: {"ep": "yes"}),),
+        )
+        found = plugins.plugins(plugins.INVENTORY, "")
+        assert [p.run() for p in found] == [{"ep": ["yes"]}]
+
+    def test_no_entry_points(self):
+        plugins._entry_points.cache_clear()  # pylint: disable=protected-access
+        assert not plugins.entry_points(plugins.IDENTITY)
+
+    def test_import_timeout(self, plugin_dir, monkeypatch):
+        monkeypatch.setattr(plugins, "_modules", {})
+        release = plugin_dir.dirpath("release")
+        plugin_dir.join("slow.py").write(
+            "import os, time\n"
+            f"while not os.path.exists({str(release)!r}):\n"
+            "    time.sleep(0.01)\n"
+            "def inventory():\n    return {'slow': 'yes'}\n"
+        )
+        plugin_dir.join("fast.py").write(
+            "def inventory():\n    return {'fast': 'yes'}\n"
+        )
+        found = plugins.plugins(plugins.INVENTORY, str(plugin_dir), timeout=0.1)
+        assert [p.run() for p in found] == [{"fast": ["yes"]}]
+        # Not loaded again while the previous load hangs
+        found = plugins.plugins(plugins.INVENTORY, str(plugin_dir), timeout=0.1)
+        assert len(found) == 1
+        release.write("")
+        path = str(plugin_dir.join("slow.py"))
+        while plugins._busy(path):  # pylint: disable=protected-access
+            time.sleep(0.01)
+        found = plugins.plugins(plugins.INVENTORY, str(plugin_dir), timeout=0.1)
+        assert [p.run() for p in found] == [{"fast": ["yes"]}, {"slow": ["yes"]}]
+
+    def test_entry_point_timeout(self, monkeypatch):
+        release = threading.Event()
+        loads = []
+
+        class EntryPoint:
+            name = "slow"
+
+            @staticmethod
+            def load():
+                loads.append(1)
+                release.wait(10)
+                return lambda: {"ep": "yes"}
+
+        monkeypatch.setattr(plugins, "_entry_points", lambda kind: (EntryPoint,))
+        monkeypatch.setattr(plugins, "_loaded", {})
+        assert plugins.entry_points(plugins.INVENTORY, timeout=0.1) == ()
+        assert plugins.entry_points(plugins.INVENTORY, timeout=0.1) == ()
+        assert len(loads) == 1
+        release.set()
+        name = "mender.inventory:slow"
+        while plugins._busy(name):  # pylint: disable=protected-access
+            release.wait(0.01)
+        (found,) = plugins.plugins(plugins.INVENTORY, "", timeout=0.1)
+        assert found.run() == {"ep": ["yes"]}
+        plugins.entry_points(plugins.INVENTORY, timeout=0.1)
+        assert len(loads) == 2
+
+
+class TestAggregate:
+    def test_inventory(self, tmpdir, plugin_dir):
+        scripts = tmpdir.mkdir("inventory")
+        script = scripts.join("mender-inventory-test")
+        script.write("#!/bin/sh\necho script=yes\necho both=script\n")
+        os.chmod(str(script), stat.S_IRWXU)
+        plugin_dir.join("plugin.py").write(
+            "def inventory():\n    return {'plugin': 'yes', 'both': 'plugin'}\n"
+        )
+        assert inventory.aggregate(
+            str(scripts), "", "", plugin_path=str(plugin_dir)
+        ) == {"script": ["yes"], "plugin": ["yes"], "both": ["plugin"]}
+
+    def test_identity(self, tmpdir, plugin_dir):
+        script = tmpdir.join("mender-device-identity")
+        script.write("#!/bin/sh\necho mac=de:ad:be:ef:00:01\n")
+        os.chmod(str(script), stat.S_IRWXU)
+        plugin_dir.join("plugin.py").write(
+            "def identity():\n    return {'serial': '1234'}\n"
+        )
+        assert identity.aggregate(str(script), plugin_path=str(plugin_dir)) == {
+            "mac": ["de:ad:be:ef:00:01"],
+            "serial": ["1234"],
+        }
@@ -0,0 +1,98 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import io
+import os
+
+import pytest
+
+import mender.artifact.artifact as artifact
+import mender.installer.rootfs as rootfs
+
+
+class TestRootfsInstaller:
+    @pytest.mark.parametrize("size", [0, 1, 4096, 65536 + 123, 3 * 65536])
+    def test_write(self, tmpdir, size):
+        data = os.urandom(size)
+        device = os.path.join(tmpdir, "rootfs.img")
+        with rootfs.RootfsInstaller(device, block_size=65536) as installer:
+            # Uneven chunks, as they arrive from the network
+            for i in range(0, size, 10000):
+                installer.write(data[i : i + 10000])
+        installer.verify()
+        with open(device, "rb") as fh:
+            assert fh.read() == data
+
+    def test_direct(self, tmpdir):
+        data = os.urandom(2 * 65536 + 100)
+        device = os.path.join(tmpdir, "rootfs.img")
+        # Falls back to buffered writes where O_DIRECT is not supported
+        with rootfs.RootfsInstaller(device, 65536, direct=True) as installer:
+            installer.write(data)
+        installer.verify()
+        with open(device, "rb") as fh:
+            assert fh.read() == data
+
+    def test_overwrite_partition(self, tmpdir):
+        device = os.path.join(tmpdir, "rootfs.img")
+        with open(device, "wb") as fh:
+            fh.write(b"\xff" * 200000)
+        data = os.urandom(100000)
+        with rootfs.RootfsInstaller(device, 65536) as installer:
+            installer.write(data)
+        installer.verify()
+        with open(device, "rb") as fh:
+            assert fh.read(100000) == data
+
+    def test_verify_mismatch(self, tmpdir):
+        device = os.path.join(tmpdir, "rootfs.img")
+        with rootfs.RootfsInstaller(device, 65536) as installer:
+            installer.write(b"x" * 5000)
+        with open(device, "r+b") as fh:
+            fh.write(b"y")
+        with pytest.raises(rootfs.InstallError):
+            installer.verify()
+
+    def test_install(self, tmpdir, make_artifact):
+        image = os.urandom(500 * 1024)
+        device = os.path.join(tmpdir, "rootfs.img")
+        reader = artifact.Reader(io.BytesIO(make_artifact({"rootfs.ext4": image})))
+        rootfs.install(reader, device, block_size=65536)
+        with open(device, "rb") as fh:
+            assert fh.read() == image
+
+    def test_install_wrong_payload_type(self, tmpdir, make_artifact):
+        reader = artifact.Reader(
+            io.BytesIO(make_artifact({"file": b"data"}, payload_type="single-file"))
+        )
+        with pytest.raises(rootfs.InstallError):
+            rootfs.install(reader, os.path.join(tmpdir, "rootfs.img"))
+
+
+class TestInactivePartition:
+    def test_unknown(self, tmpdir):
+        assert rootfs.inactive_partition(
+            os.path.join(tmpdir, "a"), os.path.join(tmpdir, "b")
+        ) is None
+
+    def test_active(self, monkeypatch):
+        class Stat:
+            def __init__(self, st_dev=0, st_rdev=0):
+                self.st_dev = st_dev
+                self.st_rdev = st_rdev
+
+        stats = {"/": Stat(st_dev=42), "/dev/a": Stat(st_rdev=7), "/dev/b": Stat(st_rdev=42)}
+        monkeypatch.setattr(rootfs.os, "stat", stats.__getitem__)
+        assert rootfs.inactive_partition("/dev/a", "/dev/b") == "/dev/a"
+        stats["/dev/a"], stats["/dev/b"] = stats["/dev/b"], stats["/dev/a"]
+        assert rootfs.inactive_partition("/dev/a", "/dev/b") == "/dev/b"
@@ -15,6 +15,7 @@ import os
 import pytest
 import stat
 import tempfile
+import time
 
 
 import mender.scripts.aggregator.aggregator as aggregator
@@ -29,9 +30,13 @@ class TestScriptKeyValueAggregator:
             "key=value\nkey2=value2\nkey=value2",
             {"key": ["value", "value2"], "key2": ["value2"]},
         ),
-        ("key=value key=value", {}),
+        ("key=value key=value", {"key": ["value key=value"]}),
         ("key=value\nkey=val2\nkey=value", {"key": ["value", "val2", "value"]}),
-        ("key=val\tkey=val2", {}),
+        ("key=val\tkey=val2", {"key": ["val\tkey=val2"]}),
+        (
+            "url=https://example.com/?a=b\n=value\nnovalue",
+            {"url": ["https://example.com/?a=b"]},
+        ),
     ]
 
     @pytest.mark.parametrize("data, expected", TEST_DATA)
@@ -39,6 +44,54 @@ class TestScriptKeyValueAggregator:
         vals = aggregator.ScriptKeyValueAggregator("foo").parse(data)
         assert vals == expected
 
+    def test_parse_resets_values(self):
+        script = aggregator.ScriptKeyValueAggregator("foo")
+        script.parse("key=value")
+        assert script.parse("key2=value") == {"key2": ["value"]}
+
+    def test_parse_limits(self):
+        script = aggregator.ScriptKeyValueAggregator("foo", max_size=32, max_keys=2)
+        assert script.parse("a=1\nb=2\na=3") == {"a": ["1", "3"], "b": ["2"]}
+        assert script.parse("a=1\nb=2\nc=3") == {}
+        assert script.parse("a=" + "x" * 32) == {}
+
+    @pytest.fixture
+    def script(self, tmpdir):
+        def create_script(data):
+            f = tmpdir.join("script")
+            f.write("#!/bin/sh\n" + data)
+            os.chmod(f, stat.S_IRWXU)
+            return str(f)
+
+        return create_script
+
+    def test_run(self, script):
+        path = script("echo key=a=b\necho key=c\necho other=d\n")
+        assert aggregator.ScriptKeyValueAggregator(path).run() == {
+            "key": ["a=b", "c"],
+            "other": ["d"],
+        }
+
+    def test_run_failure(self, script):
+        path = script("echo key=value\necho oops >&2\nexit 3\n")
+        assert aggregator.ScriptKeyValueAggregator(path).run() == {}
+
+    def test_run_runaway_output(self, script):
+        path = script("yes key=value\n")
+        assert aggregator.ScriptKeyValueAggregator(path, max_size=4096).run() == {}
+        path = script("while true; do printf x; done\n")
+        assert aggregator.ScriptKeyValueAggregator(path, max_size=4096).run() == {}
+
+    def test_run_timeout(self, script):
+        path = script("echo key=value\nsleep 10\n")
+        assert aggregator.ScriptKeyValueAggregator(path, timeout=0.2).run() == {}
+
+    def test_run_timeout_after_closing_stdout(self, script):
+        path = script("echo key=value\nexec >&-\nsleep 1000\n")
+        start = time.monotonic()
+        assert aggregator.ScriptKeyValueAggregator(path, timeout=0.2).run() == {}
+        assert time.monotonic() - start < 5
+
 
 class TestArtifactInfo:
 
@@ -0,0 +1,212 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import pytest
+
+import mender.client
+import mender.client.servers as servers
+import mender.config.config as config
+
+A, B, C = "https://eu.example.com", "https://us.example.com", "https://ap.example.com"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(name="clock")
+def fixture_clock():
+    return Clock()
+
+
+def pool(clock, *weights):
+    urls = [A, B, C][: len(weights)]
+    return servers.Servers(list(zip(urls, weights)), clock=clock)
+
+
+class TestParse:
+    def test_server_url_only(self):
+        assert servers.parse(config.Config({"ServerURL": A + "/"}, {})) == [(A, 1.0)]
+
+    def test_servers(self):
+        conf = config.Config(
+            {
+                "ServerURL": A,
+                "Servers": [
+                    {"ServerURL": B, "Weight": 2},
+                    {"ServerURL": A},
+                    C,
+                    {"ServerURL": "https://bogus.example.com", "Weight": "heavy"},
+                ],
+            },
+            {},
+        )
+        assert servers.parse(conf) == [
+            (A, 1.0),
+            (B, 2.0),
+            (C, 1.0),
+            ("https://bogus.example.com", 1.0),
+        ]
+
+    def test_comma_separated(self):
+        conf = config.Config({"Servers": f"{A}, {B}"}, {})
+        assert servers.parse(conf) == [(A, 1.0), (B, 1.0)]
+
+
+class TestSelect:
+    def test_configured_order(self, clock):
+        assert pool(clock, 1, 1, 1).select() == A
+
+    def test_fastest(self, clock):
+        pool_ = pool(clock, 1, 1, 1)
+        pool_.record(A, 0.5, True)
+        pool_.record(B, 0.1, True)
+        assert pool_.candidates() == [B, A, C]
+        assert pool_.select() == B
+        # Not worth switching for a slightly faster server
+        pool_.record(C, 0.45, True)
+        assert pool_.select(A) == B
+        pool_.record(B, 0.5, True)
+        pool_.record(B, 0.5, True)
+        assert pool_.select(A) == A
+
+    def test_weight(self, clock):
+        pool_ = pool(clock, 1, 4)
+        pool_.record(A, 0.1, True)
+        pool_.record(B, 0.15, True)
+        assert pool_.select(A) == B
+
+    def test_moving_average(self, clock):
+        pool_ = pool(clock, 1)
+        pool_.record(A, 1.0, True)
+        pool_.record(A, 2.0, True)
+        assert pool_.servers[0].latency == pytest.approx(1.0 + servers.LATENCY_ALPHA)
+
+    def test_unknown_server(self, clock):
+        pool_ = pool(clock, 1)
+        pool_.record("https://other.example.com", 0.1, False)
+        assert pool_.select("https://other.example.com") == A
+        assert servers.Servers([]).select() == ""
+
+
+class TestCircuitBreaker:
+    def test_failover(self, clock):
+        pool_ = pool(clock, 1, 1)
+        for _ in range(servers.FAILURE_THRESHOLD - 1):
+            pool_.record(A, 0.1, False)
+        assert pool_.select(A) == A
+        pool_.record(A, 0.1, False)
+        assert pool_.select(A) == B
+        assert pool_.candidates() == [B, A]
+
+    def test_retry_after_cooldown(self, clock):
+        pool_ = pool(clock, 1, 1)
+        pool_.record(A, 0.1, True)
+        pool_.record(B, 0.5, True)
+        for _ in range(servers.FAILURE_THRESHOLD):
+            pool_.record(A, 0.1, False)
+        assert pool_.select(B) == B
+        clock.now += servers.OPEN_SECONDS
+        assert pool_.select(B) == A
+        # A single failure takes it out of use again, for longer
+        pool_.record(A, 0.1, False)
+        assert pool_.select(B) == B
+        clock.now += servers.OPEN_SECONDS
+        assert pool_.select(B) == B
+        clock.now += servers.OPEN_SECONDS
+        assert pool_.select(B) == A
+        pool_.record(A, 0.1, True)
+        pool_.record(A, 0.1, False)
+        assert pool_.select(B) == A
+
+    def test_all_failing(self, clock):
+        pool_ = pool(clock, 1, 1)
+        for url in (A, B):
+            for _ in range(servers.FAILURE_THRESHOLD):
+                pool_.record(url, 0.1, False)
+            clock.now += 1
+        # The server back the soonest
+        assert pool_.select(B) == A
+
+
+class TestProbe:
+    def test_due_probes(self, clock):
+        pool_ = pool(clock, 1, 1, 1)
+        assert pool_.due_probes(A) == [B, C]
+        assert pool_.due_probes(A) == []
+        clock.now += servers.PROBE_INTERVAL
+        assert pool_.due_probes(B) == [A, C]
+        assert pool(clock, 1).due_probes(None) == []
+
+    def test_backoff(self, clock):
+        pool_ = pool(clock, 1, 1)
+        assert pool_.due_probes(A) == [B]
+        pool_.record(B, 0.1, False)
+        clock.now += servers.PROBE_INTERVAL
+        assert pool_.due_probes(A) == [B]
+        pool_.record(B, 0.1, False)
+        clock.now += servers.PROBE_INTERVAL
+        # Twice the interval after a failure
+        assert pool_.due_probes(A) == []
+        clock.now += servers.PROBE_INTERVAL
+        assert pool_.due_probes(A) == [B]
+
+    def test_out_of_use(self, clock):
+        pool_ = pool(clock, 1, 1)
+        for _ in range(servers.FAILURE_THRESHOLD):
+            pool_.record(B, 0.1, False)
+        assert pool_.due_probes(A) == []
+        # The probe retries the server once its circuit breaker closes
+        clock.now += servers.OPEN_SECONDS
+        assert pool_.due_probes(A) == [B]
+
+    def test_faster_idle_server(self, clock):
+        pool_ = pool(clock, 1, 1)
+        pool_.record(A, 0.5, True)
+        assert pool_.select(A) == A
+        for url in pool_.due_probes(A):
+            pool_.record(url, 0.1, True)
+        assert pool_.select(A) == B
+
+
+class TestObserveRequest:
+    @pytest.fixture(autouse=True)
+    def configured(self, monkeypatch):
+        monkeypatch.setattr(servers, "SERVERS", servers.Servers([(A, 1), (B, 1)]))
+
+    def test_recorded(self):
+        with mender.client.observe_request("deployments_next", "GET", A) as span:
+            span.set(status_code=204)
+        assert servers.SERVERS.servers[0].latency is not None
+        for _ in range(servers.FAILURE_THRESHOLD):
+            with mender.client.observe_request("deployments_next", "GET", A) as span:
+                span.set(status_code=503)
+        assert servers.SERVERS.select(A) == B
+
+    def test_error(self):
+        for _ in range(servers.FAILURE_THRESHOLD):
+            with pytest.raises(ConnectionError):
+                with mender.client.observe_request("auth_requests", "POST", A):
+                    raise ConnectionError("Connection refused")
+        assert servers.SERVERS.select(A) == B
+
+    def test_configure_keeps_the_measurements(self):
+        conf = config.Config({"ServerURL": A, "Servers": [B]}, {})
+        configured = servers.configure(conf)
+        configured.record(A, 0.1, True)
+        assert servers.configure(conf) is configured
+        assert servers.configure(config.Config({"ServerURL": B}, {})).urls == [B]
@@ -0,0 +1,117 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import base64
+import io
+import os
+
+import pytest
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+
+import mender.artifact.artifact as artifact
+import mender.security.signature as signature
+
+
+def rsa_signer(private_key):
+    def sign(manifest):
+        return base64.b64encode(
+            private_key.sign(manifest, padding.PKCS1v15(), hashes.SHA256())
+        )
+
+    return sign
+
+
+def ecdsa_signer(private_key, der=False):
+    def sign(manifest):
+        raw = private_key.sign(manifest, ec.ECDSA(hashes.SHA256()))
+        if not der:
+            # The encoding of mender-artifact: r and s, concatenated
+            r, s = decode_dss_signature(raw)
+            raw = r.to_bytes(32, "big") + s.to_bytes(32, "big")
+        return base64.b64encode(raw)
+
+    return sign
+
+
+@pytest.fixture(name="ecdsa_key")
+def fixture_ecdsa_key():
+    return ec.generate_private_key(ec.SECP256R1(), default_backend())
+
+
+def store_public_key(tmpdir, private_key):
+    path = str(tmpdir.join(f"artifact-verify-{id(private_key)}.pem"))
+    with open(path, "wb") as fh:
+        fh.write(
+            private_key.public_key().public_bytes(
+                serialization.Encoding.PEM,
+                serialization.PublicFormat.SubjectPublicKeyInfo,
+            )
+        )
+    return path
+
+
+@pytest.fixture(name="signed")
+def fixture_signed(make_artifact):
+    """Return a function building an Artifact with the signature of 'sign'"""
+    return lambda sign=None: make_artifact(compression="", sign=sign)
+
+
+def read(data, verify):
+    reader = artifact.Reader(io.BytesIO(data), verify=verify)
+    reader.read_header()
+    return [f.read() for f in reader.payload_files()]
+
+
+class TestVerify:
+    @pytest.mark.parametrize("kind", ["rsa", "ecdsa", "ecdsa-der"])
+    def test_valid(self, tmpdir, rsa_key, ecdsa_key, kind, signed):
+        if kind == "rsa":
+            key, sign = rsa_key, rsa_signer(rsa_key)
+        else:
+            key, sign = ecdsa_key, ecdsa_signer(ecdsa_key, der=kind == "ecdsa-der")
+        verify = signature.verifier(store_public_key(tmpdir, key))
+        assert read(signed(sign), verify) == [b"image"]
+
+    def test_unsigned(self, tmpdir, rsa_key, signed):
+        verify = signature.verifier(store_public_key(tmpdir, rsa_key))
+        with pytest.raises(artifact.ArtifactError, match="not signed"):
+            read(signed(), verify)
+        # Without a key, the signature is not required
+        assert read(signed(), None) == [b"image"]
+
+    def test_wrong_key(self, tmpdir, rsa_key, ecdsa_key, signed):
+        other = rsa.generate_private_key(65537, 2048, default_backend())
+        for key in (other, ecdsa_key):
+            verify = signature.verifier(store_public_key(tmpdir, key))
+            with pytest.raises(artifact.ArtifactError, match="signature is invalid"):
+                read(signed(rsa_signer(rsa_key)), verify)
+
+    def test_malformed(self, tmpdir, rsa_key, signed):
+        verify = signature.verifier(store_public_key(tmpdir, rsa_key))
+        with pytest.raises(artifact.ArtifactError, match="Malformed"):
+            read(signed(lambda _: b"not base64!"), verify)
+
+    def test_missing_key(self, tmpdir, signed):
+        verify = signature.verifier(str(tmpdir.join("missing.pem")))
+        with pytest.raises(artifact.ArtifactError, match="Failed to load"):
+            read(signed(lambda _: b""), verify)
+
+    def test_key_is_cached(self, tmpdir, rsa_key, signed):
+        path = store_public_key(tmpdir, rsa_key)
+        verify = signature.verifier(path)
+        read(signed(rsa_signer(rsa_key)), verify)
+        os.remove(path)
+        assert read(signed(rsa_signer(rsa_key)), verify) == [b"image"]
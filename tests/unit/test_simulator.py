@@ -0,0 +1,113 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import pytest
+
+import mender.client.deployments as deployments
+import mender.simulator.simulator as simulator
+from mender.client import HTTPUnathorized
+
+
+class TestStats:
+    def test_summary(self):
+        stats = simulator.Stats()
+        for i in range(1, 101):
+            stats.record("update_check", i / 1000, ok=i % 10 != 0)
+        summary = stats.summary()["update_check"]
+        assert summary["count"] == 100
+        assert summary["errors"] == 10
+        assert summary["p50"] == 0.051
+        assert summary["max"] == 0.1
+
+    def test_merge(self):
+        a, b = simulator.Stats(), simulator.Stats()
+        a.record("authorize", 1, ok=True)
+        b.record("authorize", 2, ok=False)
+        a.merge(b)
+        assert a.summary()["authorize"]["count"] == 2
+        assert a.summary()["authorize"]["errors"] == 1
+
+
+class TestVirtualDevice:
+    @pytest.fixture
+    def server(self, monkeypatch):
+        calls = []
+        deployment = deployments.DeploymentInfo(
+            {
+                "id": "deployment-1",
+                "artifact": {
+                    "artifact_name": "release-2",
+                    "source": {"uri": "http://localhost/release-2.mender"},
+                },
+            }
+        )
+
+        def authorize(server_url, tenant_token, id_data, private_key, cert):
+            calls.append(("authorize", id_data["mac"]))
+            return "JWT"
+
+        def inventory(server_url, jwt, data, cert):
+            calls.append(("inventory", data["artifact_name"]))
+            return True
+
+        def request(server_url, jwt, device_type, artifact_name, server_certificate):
+            calls.append(("update_check", artifact_name["artifact_name"]))
+            if jwt != "JWT":
+                raise HTTPUnathorized()
+            if artifact_name["artifact_name"] != "release-2":
+                return deployment
+            return None
+
+        def report(server_url, status, deployment_id, cert, jwt):
+            calls.append(("report", status))
+            return True
+
+        monkeypatch.setattr(simulator.authorize, "request", authorize)
+        monkeypatch.setattr(simulator.client_inventory, "request", inventory)
+        monkeypatch.setattr(simulator.deployments, "request", request)
+        monkeypatch.setattr(simulator.deployments, "report", report)
+        return calls
+
+    def test_step(self, server):
+        stats = simulator.Stats()
+        behavior = simulator.Behavior(
+            inventory_interval=100, update_interval=10, jitter=0, download=False
+        )
+        device = simulator.VirtualDevice(
+            258, None, "http://localhost", "", "", behavior, stats
+        )
+        assert device.mac == "02:00:00:00:01:02"
+        assert device.step(now=0) == 10
+        assert server == [
+            ("authorize", "02:00:00:00:01:02"),
+            ("inventory", "simulated-release"),
+            ("update_check", "simulated-release"),
+            ("report", deployments.STATUS_DOWNLOADING),
+            ("report", deployments.STATUS_SUCCESS),
+        ]
+        assert device.artifact_name == "release-2"
+        server.clear()
+        assert device.step(now=10) == 20
+        assert server == [("update_check", "release-2")]
+
+    def test_step_unauthorized(self, server):
+        stats = simulator.Stats()
+        behavior = simulator.Behavior(jitter=0, download=False)
+        device = simulator.VirtualDevice(
+            1, None, "http://localhost", "", "", behavior, stats
+        )
+        device.jwt = "expired"
+        device.next_inventory = 1000
+        assert device.step(now=0) == 0
+        assert device.jwt is None
+        assert stats.summary()["update_check"]["errors"] == 1
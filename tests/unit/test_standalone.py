@@ -0,0 +1,187 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import io
+import os
+import socketserver
+import threading
+import time
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+
+import mender.artifact.artifact as artifact
+import mender.config.config as config
+import mender.installer.rootfs as rootfs
+import mender.installer.standalone as standalone
+import mender.settings.settings as settings
+
+PROVIDES = {"device_type": "qemux86-64"}
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """http.server.ThreadingHTTPServer, which requires Python 3.7"""
+
+    daemon_threads = True
+
+
+@pytest.fixture(name="image")
+def fixture_image():
+    return os.urandom(3 * 1024 * 1024)
+
+
+@pytest.fixture(name="artifact_path")
+def fixture_artifact_path(tmpdir, image):
+    path = str(tmpdir.join("mirror", "release-1.mender"))
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as fh:
+        artifact.write(fh, "release-1", ["qemux86-64"], {"rootfs.ext4": image})
+    return path
+
+
+@pytest.fixture(name="installed")
+def fixture_installed(tmpdir, monkeypatch):
+    """Record the targets given to the install script, instead of running it"""
+    monkeypatch.setattr(settings, "PATHS", settings.Path(data_store=str(tmpdir)))
+    targets = []
+
+    def run_sub_updater(deployment_id, artifact_path, governor):
+        assert deployment_id is None and governor is not None
+        targets.append(artifact_path)
+        return True
+
+    monkeypatch.setattr(
+        standalone.installscriptrunner, "run_sub_updater", run_sub_updater
+    )
+    return targets
+
+
+@pytest.fixture(name="mirror")
+def fixture_mirror(artifact_path):
+    class Handler(SimpleHTTPRequestHandler):
+        def translate_path(self, path):
+            # The 'directory' argument requires Python 3.7
+            return os.path.join(os.path.dirname(artifact_path), path.lstrip("/"))
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True).start()
+    host, port = httpd.server_address[:2]
+    yield f"http://{host}:{port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_config(**values):
+    return config.Config(dict({"UpdateNice": 0}, **values), {})
+
+
+def streamed(tmpdir, monkeypatch):
+    device = str(tmpdir.join("rootfs.img"))
+    monkeypatch.setattr(rootfs, "inactive_partition", lambda a, b: device)
+    return make_config(RootfsStreamInstall=True), device
+
+
+class TestLocal:
+    def test_install(self, artifact_path, installed):
+        out = io.StringIO()
+        assert standalone.install(artifact_path, make_config(), PROVIDES, out)
+        # The install script installs straight from the file
+        assert installed == [artifact_path]
+
+    def test_incompatible(self, artifact_path, installed):
+        assert not standalone.install(
+            artifact_path, make_config(), {"device_type": "raspberrypi4"}
+        )
+        assert not installed
+
+    def test_not_an_artifact(self, tmpdir, installed):
+        path = str(tmpdir.join("garbage.mender"))
+        with open(path, "wb") as fh:
+            fh.write(os.urandom(10000))
+        assert not standalone.install(path, make_config(), PROVIDES)
+        assert not standalone.install(str(tmpdir.join("missing")), make_config())
+        assert not installed
+
+    def test_no_lockfile(self, tmpdir, monkeypatch, artifact_path):
+        monkeypatch.setattr(settings, "PATHS", settings.Path(data_store=str(tmpdir)))
+        scripts = []
+        monkeypatch.setattr(
+            standalone.governor.Governor,
+            "run",
+            lambda self, args, **kwargs: scripts.append(args),
+        )
+        assert standalone.install(artifact_path, make_config(), PROVIDES)
+        assert scripts == [["/usr/share/mender/install", artifact_path]]
+        # Nothing for the daemon to wait for, nor for 'mender report' to report
+        assert not os.path.exists(settings.PATHS.lockfile_path)
+
+    def test_stream(self, tmpdir, monkeypatch, artifact_path, image, installed):
+        conf, device = streamed(tmpdir, monkeypatch)
+        out = io.StringIO()
+        assert standalone.install(artifact_path, conf, PROVIDES, out)
+        assert installed == [device]
+        with open(device, "rb") as fh:
+            assert fh.read() == image
+        assert out.getvalue().startswith("Transferred 3.0 MiB in ")
+
+
+class TestURL:
+    def test_download(self, tmpdir, mirror, artifact_path, installed):
+        out = io.StringIO()
+        url = f"{mirror}/release-1.mender"
+        assert standalone.install(url, make_config(), PROVIDES, out)
+        downloaded = os.path.join(str(tmpdir), "artifact.mender")
+        assert installed == [downloaded]
+        with open(downloaded, "rb") as fh, open(artifact_path, "rb") as original:
+            assert fh.read() == original.read()
+        assert "Transferred" in out.getvalue()
+
+    def test_stream(self, tmpdir, monkeypatch, mirror, image, installed):
+        conf, device = streamed(tmpdir, monkeypatch)
+        url = f"{mirror}/release-1.mender"
+        assert standalone.install(url, conf, PROVIDES, io.StringIO())
+        assert installed == [device]
+        with open(device, "rb") as fh:
+            assert fh.read() == image
+
+    def test_incompatible(self, mirror, installed):
+        url = f"{mirror}/release-1.mender"
+        assert not standalone.install(url, make_config(), {"device_type": "other"})
+        assert not installed
+
+    def test_not_found(self, mirror, installed):
+        assert not standalone.install(f"{mirror}/missing.mender", make_config())
+        assert not installed
+
+
+class TestProgress:
+    def test_line(self):
+        progress = standalone.Progress(total=4 * standalone.MiB, out=io.StringIO())
+        progress.start = 0
+        progress.update(standalone.MiB)
+        assert progress.line(2.0) == "1.0 MiB / 4.0 MiB (25%), 0.5 MiB/s"
+
+    def test_interval(self):
+        """The lines are printed on time, even without any bytes counted"""
+        out = io.StringIO()
+        with standalone.Progress(out=out, interval=0.05) as progress:
+            progress.update(2 * standalone.MiB)
+            time.sleep(0.3)
+        lines = out.getvalue().splitlines()
+        assert len(lines) >= 2 and lines[-1].startswith("2.0 MiB, ")
+        # Not printed outside of the 'with' block
+        time.sleep(0.1)
+        assert out.getvalue().splitlines() == lines
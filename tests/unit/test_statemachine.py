@@ -0,0 +1,330 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import os
+import subprocess
+import sys
+import threading
+from unittest import mock
+
+import pytest
+
+import mender.client as client
+import mender.client.deployments as deployments
+import mender.config.config as config
+import mender.datastore.datastore as datastore
+import mender.peer.peer as peer
+import mender.settings.settings as settings
+import mender.statemachine.statemachine as statemachine
+
+
+@pytest.fixture
+def data_store(tmpdir, monkeypatch):
+    paths = settings.Path(data_store=str(tmpdir))
+    monkeypatch.setattr(settings, "PATHS", paths)
+    monkeypatch.setattr(statemachine.time, "sleep", lambda _: None)
+    return paths
+
+
+@pytest.fixture
+def context(data_store):
+    context = statemachine.Context()
+    context.config = config.Config({}, {})
+    context.JWT = "JWT"
+    context.outbox = None
+    context.deployment = deployments.DeploymentInfo(
+        {
+            "id": "deployment-1",
+            "artifact": {
+                "artifact_name": "release-2",
+                "source": {"uri": "http://localhost/release-2.mender"},
+            },
+        }
+    )
+    return context
+
+
+class Crash(Exception):
+    pass
+
+
+class TestCheckpoint:
+    def test_invalid(self, data_store):
+        assert statemachine.load_checkpoint() is None
+        datastore.write_json(data_store.update_checkpoint, {"state": "Bogus"})
+        assert statemachine.load_checkpoint() is None
+
+    def test_resume_download(self, context, data_store, monkeypatch):
+        artifact_path = os.path.join(data_store.artifact_download, "artifact.mender")
+        offsets = []
+
+        def preflight(context):
+            statemachine.save_checkpoint(context, artifact_digest="0" * 64)
+            return True
+
+        def download(
+            deployment, artifact_path, server_certificate, offset, progress, **limits
+        ):
+            offsets.append(offset)
+            with open(artifact_path, "ab") as fh:
+                fh.write(b"x" * 100)
+            if len(offsets) == 1:
+                progress(100)
+                raise Crash()
+            return True
+
+        monkeypatch.setattr(statemachine, "preflight", preflight)
+        monkeypatch.setattr(statemachine.deployments, "download", download)
+        monkeypatch.setattr(statemachine.deployments, "request", lambda *a, **k: None)
+        monkeypatch.setattr(statemachine.artifactcache, "verify", lambda p, d, v: True)
+        monkeypatch.setattr(
+            statemachine.installscriptrunner,
+            "run_sub_updater",
+            lambda deployment_id, path, governor: True,
+        )
+
+        with pytest.raises(Crash):
+            statemachine.UpdateStateMachine().run(context)
+        checkpoint = statemachine.load_checkpoint()
+        assert checkpoint["state"] == "Download"
+        assert checkpoint["download_offset"] == 100
+        assert checkpoint["deployment"]["id"] == "deployment-1"
+
+        # Restart
+        resumed = statemachine.Context()
+        resumed.config = context.config
+        resumed.JWT = "JWT"
+        resumed.outbox = None
+        statemachine.resume(resumed, checkpoint)
+        states = []
+        run_state = statemachine.run_state
+
+        def record(state, context):
+            states.append(type(state).__name__)
+            return run_state(state, context)
+
+        monkeypatch.setattr(statemachine, "run_state", record)
+        statemachine.UpdateStateMachine(checkpoint).run(resumed)
+        assert offsets == [0, 100]
+        assert states[:2] == ["Download", "ArtifactInstall"]
+        assert statemachine.load_checkpoint() is None
+
+    def test_resume_install(self, context, data_store, monkeypatch):
+        checkpoint = statemachine.new_checkpoint(context.deployment)
+        checkpoint["state"] = "ArtifactInstall"
+        datastore.write_json(data_store.update_checkpoint, checkpoint)
+        with open(data_store.lockfile_path, "w") as fh:
+            fh.write("deployment-1")
+        monkeypatch.setattr(
+            statemachine.StateMachine, "run", lambda self: self.context.checkpoint
+        )
+        statemachine.run()
+        # The lockfile left by the interrupted install does not block the client
+        assert not os.path.exists(data_store.lockfile_path)
+
+        installs = []
+        monkeypatch.setattr(
+            statemachine.deployments,
+            "download",
+            lambda *args, **kwargs: pytest.fail("The Artifact was downloaded again"),
+        )
+        monkeypatch.setattr(
+            statemachine.installscriptrunner,
+            "run_sub_updater",
+            lambda deployment_id, path, governor: installs.append(deployment_id) or True,
+        )
+        statemachine.resume(context, statemachine.load_checkpoint())
+        statemachine.UpdateStateMachine(context.checkpoint).run(context)
+        assert installs == ["deployment-1"]
+
+
+class TestPeers:
+    @pytest.mark.parametrize("shared", [True, False])
+    def test_peers_first(self, context, data_store, monkeypatch, shared):
+        context.config = config.Config({"PeerURLs": "http://a:8, http://b:8"}, {})
+        context.checkpoint = statemachine.new_checkpoint(context.deployment)
+        context.checkpoint["artifact_digest"] = "0" * 64
+        sources = []
+
+        def fetch(peers, digest, artifact_path, server_certificate, verify, **kwargs):
+            sources.append(peers)
+            return shared
+
+        def download(deployment, artifact_path, **kwargs):
+            sources.append(deployment.artifact_uri)
+            # Verified against the digest as it is downloaded
+            assert kwargs["digest"] == "0" * 64
+            return True
+
+        monkeypatch.setattr(peer, "fetch", fetch)
+        monkeypatch.setattr(statemachine.deployments, "download", download)
+        assert statemachine.download(context)
+        expected = [["http://a:8", "http://b:8"]]
+        if not shared:
+            expected.append("http://localhost/release-2.mender")
+        assert sources == expected
+        assert statemachine.load_checkpoint()["verified"]
+
+    def test_imported_only_when_configured(self):
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys; import mender.statemachine.statemachine; "
+                "assert 'mender.peer.peer' not in sys.modules",
+            ],
+            check=True,
+        )
+
+
+class TestAuthorize:
+    def test_wakes_the_outbox(self, context, monkeypatch):
+        class Outbox:
+            woken = 0
+
+            def wake(self):
+                self.woken += 1
+
+        context.outbox = Outbox()
+        context.identity_data = {}
+        monkeypatch.setattr(
+            statemachine.servers, "SERVERS", statemachine.servers.Servers([])
+        )
+        monkeypatch.setattr(
+            statemachine.authorize, "request", lambda *args, **kwargs: "JWT-2"
+        )
+        statemachine.UnauthorizedStateMachine().run(context)
+        assert context.JWT == "JWT-2"
+        # The reports backing off after a rejected JWT are delivered right away
+        assert context.outbox.woken == 1
+
+
+class TestSwitchServer:
+    def test_probes_the_idle_servers(self, context, monkeypatch):
+        a, b = "https://eu.example.com", "https://us.example.com"
+        pool = statemachine.servers.Servers([(a, 1), (b, 1)])
+        pool.record(a, 0.5, True)
+        monkeypatch.setattr(statemachine.servers, "SERVERS", pool)
+        probed = []
+
+        def probe(url, server_certificate):
+            probed.append(url)
+            pool.record(url, 0.1, True)
+            return True
+
+        monkeypatch.setattr(statemachine.authorize, "probe", probe)
+        context.server_url, context.JWTs = a, {b: "JWT-b"}
+        assert statemachine.switch_server(context)
+        assert probed == [b]
+        assert (context.server_url, context.JWT) == (b, "JWT-b")
+
+
+class TestIdle:
+    def test_poll_interval(self):
+        assert statemachine.poll_interval("", 2) == 2
+        assert statemachine.poll_interval(100, 2) == 100
+        assert statemachine.poll_interval("1.5", 2) == 1.5
+        assert statemachine.poll_interval("soon", 2) == 2
+
+    def test_update_check_not_blocked_by_inventory(self, context, monkeypatch):
+        inventory_started = threading.Event()
+        inventory_done = threading.Event()
+        release_inventory = threading.Event()
+        checks = []
+
+        def aggregate(*args, **kwargs):
+            inventory_started.set()
+            release_inventory.wait(10)
+            return {"mac": "de:ad:be:ef:00:01"}
+
+        def request(*args, **kwargs):
+            checks.append(inventory_done.is_set())
+            return context.deployment if len(checks) == 2 else None
+
+        monkeypatch.setattr(statemachine.inventory, "aggregate", aggregate)
+        monkeypatch.setattr(
+            statemachine.client_inventory,
+            "request",
+            lambda *args: inventory_done.set(),
+        )
+        monkeypatch.setattr(statemachine.deployments, "request", request)
+        context.authorized = True
+        context.deployment_log_handler = mock.Mock()
+        try:
+            statemachine.IdleStateMachine().run(context)
+            assert inventory_started.wait(10)
+            # The deployment is found while the inventory scripts still run
+            assert checks == [False, False]
+        finally:
+            release_inventory.set()
+        assert inventory_done.wait(10)
+
+    def test_single_inventory_sync(self, context, monkeypatch):
+        syncs = []
+        running = threading.Lock()
+
+        def aggregate(*args, **kwargs):
+            # A sync never overlaps another one
+            assert running.acquire(blocking=False)
+            syncs.append(threading.current_thread())
+            threading.Event().wait(0.05)
+            running.release()
+
+        def request(*args, **kwargs):
+            # Leave Idle once synced, to enter it again
+            if len(syncs) > len(found):
+                found.append(syncs[-1])
+                return context.deployment
+            threading.Event().wait(0.01)
+            return None
+
+        found = []
+        monkeypatch.setattr(statemachine.inventory, "aggregate", aggregate)
+        monkeypatch.setattr(statemachine.deployments, "request", request)
+        context.authorized = True
+        context.deployment_log_handler = mock.Mock()
+        context.config.InventoryPollIntervalSeconds = 0
+        idle_machine = statemachine.IdleStateMachine()
+        try:
+            for _ in range(3):
+                idle_machine.run(context)
+            inventory_sync = idle_machine.inventory_sync
+        finally:
+            idle_machine.inventory_sync.stop()
+        inventory_sync.join(10)
+        assert syncs and set(syncs) == {inventory_sync}
+
+    def test_rejected_jwt(self, context, monkeypatch):
+        def request(*args, **kwargs):
+            raise client.HTTPUnathorized()
+
+        monkeypatch.setattr(
+            statemachine.inventory, "aggregate", lambda *args, **kwargs: {"a": "b"}
+        )
+        monkeypatch.setattr(statemachine.client_inventory, "request", request)
+        monkeypatch.setattr(
+            statemachine.deployments,
+            "request",
+            lambda *args, **kwargs: threading.Event().wait(0.01) and None,
+        )
+        context.server_url = "https://a.example.com"
+        context.JWTs = {context.server_url: "JWT"}
+        context.authorized = True
+        authorized_machine = statemachine.AuthorizedStateMachine()
+        try:
+            # Returns to Authorize, without waiting for an update check to fail
+            authorized_machine.run(context)
+        finally:
+            authorized_machine.idle_machine.inventory_sync.stop()
+        assert not context.authorized
+        assert context.JWTs == {}
@@ -0,0 +1,141 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import json
+import os
+import time
+
+import pytest
+
+import mender.tracing.tracing as tracing
+from mender.client import observe_request
+
+
+@pytest.fixture
+def spans():
+    collected = []
+    tracing.subscribe(collected.append)
+    yield collected
+    tracing.unsubscribe(collected.append)
+    tracing.set_deployment(None)
+
+
+class TestSpan:
+    def test_span_outcome_and_nesting(self, spans):
+        with tracing.span("outer") as outer:
+            with tracing.span("inner", foo="bar"):
+                pass
+        assert [s.name for s in spans] == ["inner", "outer"]
+        inner = spans[0]
+        assert inner.parent_id == outer.span_id
+        assert inner.attributes == {"foo": "bar"}
+        assert inner.outcome == tracing.OUTCOME_OK
+        assert outer.start <= inner.start <= inner.end <= outer.end
+
+    def test_span_error(self, spans):
+        with pytest.raises(ValueError):
+            with tracing.span("failing"):
+                raise ValueError("foo")
+        assert spans[0].outcome == tracing.OUTCOME_ERROR
+
+    def test_duration_ignores_clock_steps(self, spans, monkeypatch):
+        class SteppedClock:
+            """The wall clock set back an hour during the span, as NTP may do"""
+
+            def __init__(self):
+                self.wall = [1_700_000_000.0, 1_700_000_000.0 - 3600]
+
+            def time(self):
+                return self.wall.pop(0) if len(self.wall) > 1 else self.wall[0]
+
+            def monotonic(self):
+                return time.monotonic()
+
+        monkeypatch.setattr(tracing, "time", SteppedClock())
+        with tracing.span("stepped"):
+            pass
+        assert spans[0].end < spans[0].start
+        assert 0 <= spans[0].duration < 1
+
+    def test_deployment_id(self, spans):
+        deployment_id = "f4e5d2a8-2e8c-4d5c-9e3f-6f1a2b3c4d5e"
+        tracing.set_deployment(deployment_id)
+        with tracing.span("download"):
+            pass
+        tracing.set_deployment(None)
+        with tracing.span("idle"):
+            pass
+        assert spans[0].deployment_id == deployment_id
+        assert spans[0].trace_id == deployment_id.replace("-", "")
+        assert spans[1].deployment_id is None
+        assert spans[1].trace_id != spans[0].trace_id
+
+    def test_observe_request(self, spans):
+        with observe_request("deployments_next", "GET") as span:
+            span.set(status_code=401)
+        assert spans[0].kind == tracing.KIND_CLIENT
+        assert spans[0].outcome == tracing.OUTCOME_ERROR
+        assert spans[0].attributes["endpoint"] == "deployments_next"
+
+
+class TestSinks:
+    def test_json_lines_sink(self, tmpdir):
+        path = os.path.join(tmpdir, "spans.jsonl")
+        sink = tracing.JSONLinesSink(path)
+        tracing.subscribe(sink)
+        try:
+            with tracing.span("one"):
+                pass
+            with tracing.span("two"):
+                pass
+        finally:
+            tracing.unsubscribe(sink)
+        with open(path) as fh:
+            lines = [json.loads(line) for line in fh]
+        assert [line["name"] for line in lines] == ["one", "two"]
+        assert lines[0]["end"] >= lines[0]["start"]
+
+    def test_rotation(self, tmpdir):
+        path = os.path.join(tmpdir, "spans.jsonl")
+        sink = tracing.JSONLinesSink(path, max_size=1024)
+        tracing.subscribe(sink)
+        try:
+            for i in range(50):
+                with tracing.span(f"span-{i}"):
+                    pass
+        finally:
+            tracing.unsubscribe(sink)
+        with open(path) as fh:
+            lines = fh.readlines()
+        assert json.loads(lines[-1])["name"] == "span-49"
+        longest = max(len(line) for line in lines)
+        assert os.path.getsize(path) < 1024 + longest
+        assert os.path.getsize(path + ".1") < 1024 + longest
+
+    def test_otlp_file_sink(self, tmpdir):
+        path = os.path.join(tmpdir, "spans.otlp.jsonl")
+        sink = tracing.OTLPFileSink(path)
+        tracing.subscribe(sink)
+        try:
+            with tracing.span("GET deployments_next", kind=tracing.KIND_CLIENT):
+                pass
+        finally:
+            tracing.unsubscribe(sink)
+        with open(path) as fh:
+            request = json.loads(fh.readline())
+        span = request["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+        assert span["name"] == "GET deployments_next"
+        assert span["kind"] == 3
+        assert len(span["traceId"]) == 32
+        assert len(span["spanId"]) == 16
+        assert span["status"] == {"code": 1}
@@ -0,0 +1,241 @@
+# Copyright 2021 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+import datetime
+import ipaddress
+import json
+import socket
+import socketserver
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+import pytest
+import requests
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.x509.oid import NameOID
+
+import mender.client
+import mender.client.transport as transport
+import mender.config.config as config
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """http.server.ThreadingHTTPServer, which requires Python 3.7"""
+
+    daemon_threads = True
+
+
+@pytest.fixture(name="server")
+def fixture_server(request):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, code: int, body: bytes):
+            self.send_response(code)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path == "/data":
+                self._reply(200, b"0123456789" * 1000)
+            elif self.path == "/slow":
+                time.sleep(0.5)
+                self._reply(200, b"")
+            else:
+                self._reply(404, b"")
+
+        def do_PUT(self):  # pylint: disable=invalid-name
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            self._reply(
+                200,
+                json.dumps(
+                    {"body": body.decode(), "type": self.headers["Content-Type"]}
+                ).encode(),
+            )
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    scheme = getattr(request, "param", "http")
+    if scheme == "https":
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*request.getfixturevalue("server_certificate"))
+        httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
+        # The handshakes rejected by the clients
+        httpd.handle_error = lambda *args: None
+    threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True).start()
+    host, port = httpd.server_address[:2]
+    yield f"{scheme}://{host}:{port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(name="server_certificate")
+def fixture_server_certificate(tmpdir, rsa_key):
+    """A self-signed certificate for 127.0.0.1, and its key: (cert, key) paths"""
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(rsa_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(
+            x509.SubjectAlternativeName(
+                [x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]
+            ),
+            critical=False,
+        )
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(rsa_key, hashes.SHA256(), default_backend())
+    )
+    cert_path, key_path = str(tmpdir / "server.crt"), str(tmpdir / "server.key")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(
+            rsa_key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.TraditionalOpenSSL,
+                serialization.NoEncryption(),
+            )
+        )
+    return cert_path, key_path
+
+
+class TestCreate:
+    def test_requests(self):
+        assert isinstance(transport.create("requests", 2), requests.Session)
+
+    def test_unknown(self):
+        assert isinstance(transport.create("carrier-pigeon", 2), requests.Session)
+
+    def test_http2_missing(self):
+        with mock.patch.dict("sys.modules", {"httpx": None}):
+            assert isinstance(transport.create("http2", 2), requests.Session)
+
+    def test_timeout(self, server):
+        session = transport.create("requests", 2, (1, 0.1))
+        with pytest.raises(requests.Timeout):
+            session.get(server + "/slow")
+        # A timeout given by the request wins
+        assert session.get(server + "/slow", timeout=5).status_code == 200
+
+    def test_configure_timeout(self):
+        # pylint: disable=protected-access
+        values = {"ConnectTimeoutSeconds": 5, "ReadTimeoutSeconds": 0}
+        try:
+            mender.client.configure(config.Config(values, {}))
+            assert mender.client._timeout == (5, None)
+        finally:
+            mender.client.configure(config.Config({}, {}))
+        assert mender.client._timeout == (30, 60)
+
+    def test_configure(self):
+        pytest.importorskip("httpx")
+        pytest.importorskip("h2")
+        try:
+            mender.client.configure(config.Config({"HTTPTransport": "http2"}, {}))
+            assert isinstance(mender.client.session(), transport.HTTP2Transport)
+        finally:
+            mender.client.configure(config.Config({}, {}))
+        assert isinstance(mender.client.session(), requests.Session)
+
+
+class TestHTTP2Transport:
+    @pytest.fixture(name="client")
+    def fixture_client(self):
+        pytest.importorskip("httpx")
+        pytest.importorskip("h2")
+        client = transport.HTTP2Transport(2)
+        yield client
+        client.close()
+
+    def test_get(self, server, client):
+        response = client.get(server + "/data", verify=False)
+        assert response.status_code == 200
+        assert response.content == b"0123456789" * 1000
+        response.raise_for_status()
+
+    def test_put_json(self, server, client):
+        response = client.put(server + "/status", json={"status": "success"})
+        assert response.json() == {
+            "body": '{"status":"success"}',
+            "type": "application/json",
+        }
+
+    def test_put_data(self, server, client):
+        response = client.put(
+            server + "/log",
+            data='{"messages": []}',
+            headers={"Content-Type": "application/json"},
+        )
+        assert response.json()["body"] == '{"messages": []}'
+
+    def test_stream(self, server, client):
+        with client.get(server + "/data", stream=True) as response:
+            assert b"".join(response.iter_content(4096)) == b"0123456789" * 1000
+
+    def test_raw(self, server, client):
+        with client.get(server + "/data", stream=True) as response:
+            response.raw.decode_content = True
+            assert response.raw.read(5) == b"01234"
+            assert response.raw.read(5) == b"56789"
+            assert len(response.raw.read()) == 9990
+            assert response.raw.read(5) == b""
+            assert response.raw.tell() == 10000
+
+    def test_http_error(self, server, client):
+        response = client.get(server + "/missing")
+        assert response.status_code == 404
+        with pytest.raises(requests.HTTPError):
+            response.raise_for_status()
+
+    def test_timeout(self, server):
+        pytest.importorskip("httpx")
+        pytest.importorskip("h2")
+        client = transport.HTTP2Transport(2, (1, 0.1))
+        try:
+            with pytest.raises(requests.Timeout):
+                client.get(server + "/slow")
+        finally:
+            client.close()
+
+    def test_connection_error(self, client):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        with pytest.raises(requests.ConnectionError):
+            client.get(f"http://127.0.0.1:{port}/data")
+
+    @pytest.mark.parametrize("server", ["https"], indirect=True)
+    def test_server_certificate(self, server, server_certificate, client):
+        cert = server_certificate[0]
+        with mock.patch.object(
+            transport, "_ssl_context", wraps=transport._ssl_context
+        ) as ssl_context:
+            for _ in range(2):
+                assert client.get(server + "/data", verify=cert).status_code == 200
+        ssl_context.assert_called_once_with(cert)
+        with pytest.raises(requests.ConnectionError):
+            client.get(server + "/data", verify=True)